@@ -13,10 +13,12 @@ const state = {
     top_p: 0.9,
     repeat_penalty: 1.1,
     seed: null,
+    context_budget: false,
     // Tools
     rag_enabled: true,
     rag_threshold: 0.35,
     rag_limit: 5,
+    rag_server_side: false,
     web_search_enabled: true
   },
   isGenerating: false
@@ -54,6 +56,7 @@ const elements = {
   settingTopP: document.getElementById("topPInput"),
   settingRepeatPenalty: document.getElementById("repeatPenaltyInput"),
   settingSeed: document.getElementById("seedInput"),
+  settingContextBudget: document.getElementById("contextBudgetInput"),
   
   // Settings Displays
   settingTempDisplay: document.getElementById("tempValue"),
@@ -64,6 +67,7 @@ const elements = {
   settingRagEnabled: document.getElementById("ragEnabledInput"),
   settingRagThreshold: document.getElementById("ragThresholdInput"),
   settingRagLimit: document.getElementById("ragLimitInput"),
+  settingRagServerSide: document.getElementById("ragServerSideInput"),
   settingWebSearchEnabled: document.getElementById("webSearchEnabledInput"),
   
   settingRagThresholdDisplay: document.getElementById("ragThresholdValue"),
@@ -115,7 +119,8 @@ const kbState = {
   allMemories: [],
   filteredMemories: [],
   selectedIds: new Set(),
-  searchQuery: ""
+  searchQuery: "",
+  nextCursor: null
 };
 
 const vramDisplayCache = {
@@ -132,6 +137,15 @@ const vramDisplayCache = {
 };
 
 const pendingAttachments = [];
+// Attachments are uploaded once to the server's content-addressed store (PUT /api/blobs).
+// Chat payloads then carry "blob:<sha256>" image refs and "{{blob:<sha256>}}" text refs,
+// which the /api/chat proxy expands, instead of re-sending the bytes every turn.
+const attachmentUploads = new Map();
+const ATTACHMENT_PREVIEW_CHARS = 600;
+// Documents longer than this are ingested into the RAG store (/api/rag/ingest) and only their
+// most relevant chunks for the message are sent to the model
+const DOC_INLINE_CHARS = 8000;
+const DOC_EXCERPT_CHUNKS = 6;
 let activeSpeechRecognition = null;
 let isListening = false;
 
@@ -259,6 +273,7 @@ function addAttachmentFromFile(file) {
       attachment.dataUrl = dataUrl;
       attachment.base64 = String(dataUrl).split(",")[1] || "";
       pendingAttachments.push(attachment);
+      uploadAttachment(attachment, file);
       updateAttachmentBar();
     };
     reader.readAsDataURL(file);
@@ -269,6 +284,7 @@ function addAttachmentFromFile(file) {
     reader.onload = () => {
       attachment.dataUrl = reader.result || "";
       pendingAttachments.push(attachment);
+      uploadAttachment(attachment, file);
       updateAttachmentBar();
     };
     reader.readAsDataURL(file);
@@ -279,6 +295,7 @@ function addAttachmentFromFile(file) {
     reader.onload = () => {
       attachment.text = reader.result || "";
       pendingAttachments.push(attachment);
+      uploadAttachment(attachment);
       updateAttachmentBar();
     };
     reader.readAsText(file);
@@ -287,11 +304,108 @@ function addAttachmentFromFile(file) {
   reader.onload = () => {
     attachment.dataUrl = reader.result || "";
     pendingAttachments.push(attachment);
+    uploadAttachment(attachment, file);
     updateAttachmentBar();
   };
   reader.readAsDataURL(file);
 }
 
+async function putBlob(body) {
+  const res = await fetch("/api/blobs", { method: "PUT", body });
+  if (!res.ok) throw new Error(`HTTP ${res.status}`);
+  const data = await res.json();
+  return data.hash;
+}
+
+// Uploads an attachment's bytes (or a document's text) once; on failure it is sent inline as before
+function uploadAttachment(att, file = null) {
+  if (attachmentUploads.has(att.id)) return attachmentUploads.get(att.id);
+  const task = (async () => {
+    try {
+      if (att.kind === "document" && att.text) {
+        att.textBlob = await putBlob(new Blob([att.text], { type: "text/plain;charset=utf-8" }));
+      } else if (file || att.dataUrl) {
+        att.blob = await putBlob(file || await (await fetch(att.dataUrl)).blob());
+      }
+    } catch (e) {
+      console.warn("Attachment upload failed, sending it inline:", e);
+    }
+    return att;
+  })();
+  attachmentUploads.set(att.id, task);
+  return task;
+}
+
+// Ingests a large document once and keeps the chunks that best match the message as its excerpt
+async function prepareDocumentExcerpt(att, queryText) {
+  if (att.kind !== "document" || !att.text || att.text.length <= DOC_INLINE_CHARS || att.excerpt) return;
+  try {
+    if (!att.docId) {
+      const res = await fetch("/api/rag/ingest", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify(att.textBlob ? { blob: att.textBlob, name: att.name } : { text: att.text, name: att.name })
+      });
+      if (!res.ok) throw new Error(`HTTP ${res.status}`);
+      att.docId = (await res.json()).doc_id;
+    }
+    const res = await fetch("/api/rag/query", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ query: queryText || att.name, doc_id: att.docId, limit: DOC_EXCERPT_CHUNKS })
+    });
+    if (!res.ok) throw new Error(`HTTP ${res.status}`);
+    const results = (await res.json()).results || [];
+    if (results.length) {
+      att.excerpt = results
+        .sort((a, b) => a.chunk_index - b.chunk_index)
+        .map(r => r.content.trim())
+        .join("\n……\n");
+    }
+  } catch (e) {
+    console.warn("Document ingestion failed, sending the full text:", e);
+  }
+}
+
+function attachmentUrl(att) {
+  if (att.dataUrl) return att.dataUrl;
+  return att.blob ? `/api/blobs/${att.blob}` : "";
+}
+
+// Re-uploads blobs the server no longer has from bytes still held in memory, and
+// removes references to the ones that cannot be recovered from the payload.
+async function restoreMissingBlobs(messages, missing) {
+  const lost = new Set(missing);
+  for (const chat of state.chats) {
+    for (const msg of chat.messages) {
+      for (const att of msg.attachments || []) {
+        if (lost.has(att.blob)) {
+          const hash = att.blob;
+          try {
+            if (att.dataUrl && await putBlob(await (await fetch(att.dataUrl)).blob()) === hash) lost.delete(hash);
+          } catch (e) {}
+          if (lost.has(hash)) att.blob = "";
+        }
+        if (lost.has(att.textBlob)) {
+          const hash = att.textBlob;
+          try {
+            if (att.text && !att.textTruncated && await putBlob(new Blob([att.text], { type: "text/plain;charset=utf-8" })) === hash) lost.delete(hash);
+          } catch (e) {}
+          if (lost.has(hash)) att.textBlob = "";
+        }
+      }
+    }
+  }
+  for (const msg of messages) {
+    if (Array.isArray(msg.images)) {
+      msg.images = msg.images.filter(image => !lost.has(String(image).replace(/^blob:/, "")));
+    }
+    if (typeof msg.content === "string") {
+      msg.content = msg.content.replace(/\{\{blob:([0-9a-f]{64})\}\}/g, (ref, hash) => lost.has(hash) ? "[附件已失效]" : ref);
+    }
+  }
+}
+
 function handleFileInputChange(e) {
   const files = Array.from(e.target.files || []);
   files.forEach(file => addAttachmentFromFile(file));
@@ -303,19 +417,19 @@ function renderMessageAttachments(messageDiv, attachments) {
   const container = document.createElement("div");
   container.className = "message-attachments";
   attachments.forEach(att => {
-    if (att.kind === "image" && att.dataUrl) {
+    if (att.kind === "image" && attachmentUrl(att)) {
       const img = document.createElement("img");
       img.className = "attachment-preview-image";
-      img.src = att.dataUrl;
+      img.src = attachmentUrl(att);
       img.alt = att.name || "image";
       container.appendChild(img);
       return;
     }
-    if (att.kind === "audio" && att.dataUrl) {
+    if (att.kind === "audio" && attachmentUrl(att)) {
       const audio = document.createElement("audio");
       audio.className = "attachment-audio";
       audio.controls = true;
-      audio.src = att.dataUrl;
+      audio.src = attachmentUrl(att);
       container.appendChild(audio);
       return;
     }
@@ -329,11 +443,11 @@ function renderMessageAttachments(messageDiv, attachments) {
       if (att.text) {
         const preview = document.createElement("div");
         preview.className = "attachment-doc-preview";
-        preview.textContent = att.text.slice(0, 600);
+        preview.textContent = att.text.slice(0, ATTACHMENT_PREVIEW_CHARS);
         doc.appendChild(preview);
-      } else if (att.dataUrl) {
+      } else if (attachmentUrl(att)) {
         const link = document.createElement("a");
-        link.href = att.dataUrl;
+        link.href = attachmentUrl(att);
         link.download = att.name || "file";
         link.textContent = "下载文件";
         link.style.fontSize = "12px";
@@ -347,15 +461,19 @@ function renderMessageAttachments(messageDiv, attachments) {
   messageDiv.appendChild(container);
 }
 
-function buildMessageContentWithAttachments(message) {
+// With useBlobRefs, uploaded document text is referenced as {{blob:<sha256>}} for the server to expand
+function buildMessageContentWithAttachments(message, useBlobRefs = false) {
   let content = message.content || "";
   const attachments = message.attachments || [];
   const docs = attachments.filter(att => att.kind === "document");
-  const docsWithText = docs.filter(att => att.text);
-  const docsWithoutText = docs.filter(att => !att.text);
+  const docsWithText = docs.filter(att => att.text || att.textBlob);
+  const docsWithoutText = docs.filter(att => !att.text && !att.textBlob);
   const audios = attachments.filter(att => att.kind === "audio");
   if (docsWithText.length) {
-    const docText = docsWithText.map(doc => `[${doc.name}]\n${doc.text}`).join("\n\n");
+    const docText = docsWithText.map(doc => {
+      if (doc.excerpt) return `[${doc.name}]（节选）\n${doc.excerpt}`;
+      return `[${doc.name}]\n${useBlobRefs && doc.textBlob ? `{{blob:${doc.textBlob}}}` : doc.text}`;
+    }).join("\n\n");
     content = `${content}\n\n[文档内容]\n${docText}\n[文档内容结束]`;
   }
   if (docsWithoutText.length) {
@@ -370,9 +488,11 @@ function buildMessageContentWithAttachments(message) {
 }
 
 function buildMessagePayload(message) {
-  const content = buildMessageContentWithAttachments(message);
+  const content = buildMessageContentWithAttachments(message, true);
   const payload = { role: message.role, content };
-  const images = (message.attachments || []).filter(att => att.kind === "image" && att.base64).map(att => att.base64);
+  const images = (message.attachments || [])
+    .filter(att => att.kind === "image" && (att.blob || att.base64))
+    .map(att => att.blob ? `blob:${att.blob}` : att.base64);
   if (images.length) {
     payload.images = images;
   }
@@ -494,11 +614,13 @@ function loadState() {
   elements.settingTopP.value = state.settings.top_p;
   elements.settingRepeatPenalty.value = state.settings.repeat_penalty || 1.1;
   elements.settingSeed.value = state.settings.seed !== null ? state.settings.seed : "";
+  elements.settingContextBudget.checked = state.settings.context_budget === true;
   
   // Tools
   elements.settingRagEnabled.checked = state.settings.rag_enabled !== false; // Default true
   elements.settingRagThreshold.value = state.settings.rag_threshold || 0.35;
   elements.settingRagLimit.value = state.settings.rag_limit || 5;
+  elements.settingRagServerSide.checked = state.settings.rag_server_side === true;
   elements.settingWebSearchEnabled.checked = state.settings.web_search_enabled !== false; // Default true
   
   updateRangeDisplays();
@@ -506,9 +628,27 @@ function loadState() {
   updateVramEstimator();
 }
 
+// Uploaded attachments are stored as blob references; document text keeps only its preview
+function compactAttachment(att) {
+  const stored = { ...att };
+  if (att.blob) {
+    stored.dataUrl = "";
+    stored.base64 = "";
+  }
+  if (att.textBlob && att.text && att.text.length > ATTACHMENT_PREVIEW_CHARS) {
+    stored.text = att.text.slice(0, ATTACHMENT_PREVIEW_CHARS);
+    stored.textTruncated = true;
+  }
+  return stored;
+}
+
 function saveState() {
+  const chats = state.chats.map(chat => ({
+    ...chat,
+    messages: chat.messages.map(msg => msg.attachments && msg.attachments.length ? { ...msg, attachments: msg.attachments.map(compactAttachment) } : msg)
+  }));
   localStorage.setItem("ollama_client_state", JSON.stringify({
-    chats: state.chats,
+    chats,
     currentChatId: state.currentChatId,
     settings: state.settings
   }));
@@ -548,7 +688,7 @@ function initEventListeners() {
   }
   
   elements.newChatBtn.addEventListener("click", () => createNewChat());
-  elements.scanBtn.addEventListener("click", scanModels);
+  elements.scanBtn.addEventListener("click", () => scanModels(true));
 
   // Search
   elements.searchInput.addEventListener("input", (e) => {
@@ -583,18 +723,20 @@ function initEventListeners() {
     state.settings.repeat_penalty = parseFloat(elements.settingRepeatPenalty.value);
     const seedVal = elements.settingSeed.value.trim();
     state.settings.seed = seedVal === "" ? null : parseInt(seedVal);
+    state.settings.context_budget = elements.settingContextBudget.checked;
     
     // Tools
     state.settings.rag_enabled = elements.settingRagEnabled.checked;
     state.settings.rag_threshold = parseFloat(elements.settingRagThreshold.value);
     state.settings.rag_limit = parseInt(elements.settingRagLimit.value);
+    state.settings.rag_server_side = elements.settingRagServerSide.checked;
     state.settings.web_search_enabled = elements.settingWebSearchEnabled.checked;
     
     saveState();
     syncMaxTokenPresetState();
     updateVramEstimator();
     elements.settingsModal.classList.add("hidden");
-    scanModels(); // Re-scan in case endpoint changed
+    scanModels(true); // Re-scan in case endpoint changed
   });
   
   // Max tokens preset buttons
@@ -846,6 +988,7 @@ async function loadMemories() {
     
     const data = await response.json();
     kbState.allMemories = data.memories || [];
+    kbState.nextCursor = data.next_cursor || null;
     kbState.searchQuery = "";
     kbState.selectedIds.clear();
     elements.memorySearchInput.value = "";
@@ -965,6 +1108,32 @@ function renderMemoryList(memories) {
     
     list.appendChild(item);
   });
+  
+  // The server returns one page at a time; older memories are fetched on demand
+  if (kbState.nextCursor) {
+    const moreBtn = document.createElement("button");
+    moreBtn.className = "btn-ghost";
+    moreBtn.style.margin = "12px auto";
+    moreBtn.style.display = "block";
+    moreBtn.textContent = "加载更多";
+    moreBtn.onclick = () => loadMoreMemories(moreBtn);
+    list.appendChild(moreBtn);
+  }
+}
+
+async function loadMoreMemories(button) {
+  button.disabled = true;
+  try {
+    const response = await fetch(`/api/rag/memories?cursor=${encodeURIComponent(kbState.nextCursor)}`);
+    if (!response.ok) throw new Error("Failed to load memories");
+    const data = await response.json();
+    kbState.allMemories = kbState.allMemories.concat(data.memories || []);
+    kbState.nextCursor = data.next_cursor || null;
+    filterAndRenderMemories();
+  } catch (e) {
+    button.disabled = false;
+    button.textContent = `加载失败: ${e.message}`;
+  }
 }
 
 async function clearAllMemories() {
@@ -1159,35 +1328,23 @@ function exportKnowledgeBase() {
     return;
   }
   
-  const exportData = {
-    version: "1.0",
-    exported_at: new Date().toISOString(),
-    count: kbState.allMemories.length,
-    memories: kbState.allMemories.map(m => ({
-      content: m.content,
-      created_at: m.created_at
-    }))
-  };
-  
-  const blob = new Blob([JSON.stringify(exportData, null, 2)], { type: "application/json" });
-  const url = URL.createObjectURL(blob);
+  // The server streams every memory with its vector as NDJSON (POST it to /api/rag/import to restore),
+  // so the download is not limited to the page shown here
   const a = document.createElement("a");
-  a.href = url;
-  a.download = `knowledge_base_${new Date().toISOString().split('T')[0]}.json`;
+  a.href = "/api/rag/export?encoding=float16";
+  a.download = "";
   document.body.appendChild(a);
   a.click();
   document.body.removeChild(a);
-  URL.revokeObjectURL(url);
-  
-  alert(`成功导出 ${kbState.allMemories.length} 条知识`);
 }
 
 // Model Management
-async function scanModels() {
+async function scanModels(refresh = false) {
   elements.scanBtn.classList.add("rotating"); // Add CSS animation class if exists
   elements.statusIndicator.textContent = "正在扫描模型...";
   
-  const fetchUrl = "/api/models"; 
+  // An explicit scan bypasses the server's model list cache
+  const fetchUrl = refresh ? "/api/models?refresh=1" : "/api/models"; 
   
   try {
     const response = await fetch(fetchUrl);
@@ -2045,57 +2202,23 @@ async function executeTool(toolCall) {
 async function extractAndSaveMemory(userText, assistantText) {
   if (state.settings.rag_enabled === false) return;
   
-  // Use a separate non-streaming call to analyze the conversation
-  const analysisPrompt = `
-Analyze the following conversation and extract ONE key fact, user preference, or technical detail that is worth remembering for future context. 
-If nothing is worth remembering (e.g., casual greeting, simple question), return "NULL".
-Also categorize the memory into one of: "User Preference", "Technical", "General", "Project".
-
-Format the output as JSON: {"content": "...", "category": "..."}
-
-Conversation:
-User: ${userText}
-Assistant: ${assistantText}
-`;
-
+  // The server queues the exchange and extracts a memory once the model is idle,
+  // so this neither competes with the next message nor is lost if the tab closes
   try {
-    const response = await fetch("/api/chat", {
+    const response = await fetch("/api/rag/extract", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
       body: JSON.stringify({
         model: state.currentModel,
-        messages: [{ role: "user", content: analysisPrompt }],
-        stream: false,
-        options: { temperature: 0.1 } // Low temp for extraction
+        user: userText,
+        assistant: assistantText
       })
     });
     
-    if (response.ok) {
-      const data = await response.json();
-      let result = data.message?.content || "";
-      
-      // Clean up JSON markdown if present
-      result = result.replace(/```json/g, "").replace(/```/g, "").trim();
-      
-      if (result.includes("NULL")) return;
-      
-      try {
-        const json = JSON.parse(result);
-        if (json.content && json.content !== "NULL") {
-          // Send to server
-          await fetch("/api/rag/add", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ 
-                content: json.content,
-                category: json.category || "General"
-            })
-          });
-          console.log("Memory saved:", json);
-        }
-      } catch (e) {
-        console.warn("Failed to parse memory extraction:", e);
-      }
+    if (response.status === 429) {
+      console.warn("Memory extraction queue is full, skipping this exchange");
+    } else if (!response.ok) {
+      console.warn("Failed to queue memory extraction:", response.status);
     }
   } catch (e) {
     const isAbort = e?.name === "AbortError" || (e?.message || "").includes("Failed to fetch");
@@ -2105,6 +2228,23 @@ Assistant: ${assistantText}
   }
 }
 
+function showRagHitStatus(results) {
+  const statusDiv = document.createElement("div");
+  statusDiv.className = "rag-hit-status";
+  statusDiv.innerHTML = `📚 已检索到 ${results.length} 条相关记忆`;
+  statusDiv.style.fontSize = "12px";
+  statusDiv.style.color = "var(--text-secondary)";
+  statusDiv.style.marginTop = "4px";
+  statusDiv.style.marginBottom = "8px";
+  statusDiv.title = results.map(r => r.content.slice(0, 50) + "...").join("\n");
+  
+  const userMessages = elements.chatContainer.querySelectorAll(".message-user");
+  const lastUserMsg = userMessages[userMessages.length - 1] || elements.chatContainer.lastElementChild;
+  if (lastUserMsg) {
+     lastUserMsg.querySelector(".message-content").appendChild(statusDiv);
+  }
+}
+
 // Core Messaging Logic
 async function sendMessage() {
   if (state.isGenerating) return;
@@ -2112,6 +2252,16 @@ async function sendMessage() {
   const text = elements.chatInput.value.trim();
   const hasAttachments = pendingAttachments.length > 0;
   if (!text && !hasAttachments) return;
+  if (hasAttachments) {
+    // Block a second send while attachments finish uploading
+    state.isGenerating = true;
+    try {
+      await Promise.all(pendingAttachments.map(att => uploadAttachment(att)));
+      await Promise.all(pendingAttachments.map(att => prepareDocumentExcerpt(att, text)));
+    } finally {
+      state.isGenerating = false;
+    }
+  }
   
   if (!state.currentModel) {
     alert("请先选择一个模型");
@@ -2150,8 +2300,22 @@ async function sendMessage() {
     let ragContext = "";
     const queryText = buildMessageContentWithAttachments({ content: text, attachments });
     
+    // Server-side mode: the /api/chat proxy retrieves and injects memories itself
+    const ragServerSide = state.settings.rag_enabled !== false && state.settings.rag_server_side === true;
+    const ragRequest = ragServerSide ? {
+        query: queryText,
+        limit: state.settings.rag_limit || 5,
+        threshold: state.settings.rag_threshold || 0.35
+    } : null;
+    let ragStatusShown = false;
+    const onRag = (results) => {
+        if (ragStatusShown || !results.length) return;
+        ragStatusShown = true;
+        showRagHitStatus(results);
+    };
+    
     // Only query if RAG is enabled
-    if (state.settings.rag_enabled !== false) {
+    if (state.settings.rag_enabled !== false && !ragServerSide) {
         try {
           const ragRes = await fetch("/api/rag/query", {
             method: "POST",
@@ -2170,19 +2334,7 @@ async function sendMessage() {
               ragContext = `[系统提示：检索到以下相关历史记忆，请优先基于这些信息回答]\n${memories}\n[记忆结束]\n`;
               
               // Show RAG status in UI
-              const statusDiv = document.createElement("div");
-              statusDiv.className = "rag-hit-status";
-              statusDiv.innerHTML = `📚 已检索到 ${ragData.results.length} 条相关记忆`;
-              statusDiv.style.fontSize = "12px";
-              statusDiv.style.color = "var(--text-secondary)";
-              statusDiv.style.marginTop = "4px";
-              statusDiv.style.marginBottom = "8px";
-              statusDiv.title = ragData.results.map(r => r.content.slice(0, 50) + "...").join("\n");
-              
-              const lastUserMsg = elements.chatContainer.lastElementChild;
-              if (lastUserMsg) {
-                 lastUserMsg.querySelector(".message-content").appendChild(statusDiv);
-              }
+              showRagHitStatus(ragData.results);
             }
           }
         } catch (e) {
@@ -2238,6 +2390,13 @@ async function sendMessage() {
       stream: true,
       options: options
     };
+    if (ragRequest) {
+        payload.rag = ragRequest;
+    }
+    // Let the server fit long histories into num_ctx (older turns become a cached summary)
+    if (state.settings.context_budget === true) {
+        payload.budget = true;
+    }
     
     // Smart tool enabling logic:
     // 1. Only provide tools on first turn (let model decide if it needs them)
@@ -2256,7 +2415,7 @@ async function sendMessage() {
     }
 
     // Stream response
-        await streamResponse(payload, assistantMsg, responseContentDiv);
+        await streamResponse(payload, assistantMsg, responseContentDiv, onRag);
         
         // Check for tool calls
         if (assistantMsg.tool_calls && assistantMsg.tool_calls.length > 0) {
@@ -2525,7 +2684,7 @@ AI：${cleanAssistantText.slice(0, 300)}`;
   }
 }
 
-async function streamResponse(payload, messageObj, domElement) {
+async function streamResponse(payload, messageObj, domElement, onRag = null, retried = false) {
   let response;
   try {
     response = await fetch("/api/chat", {
@@ -2543,16 +2702,23 @@ async function streamResponse(payload, messageObj, domElement) {
 
   if (!response.ok) {
     let errorMsg = `HTTP ${response.status}`;
+    let missingBlobs = null;
     try {
       const errorText = await response.text();
       try {
           const errorData = JSON.parse(errorText);
+          missingBlobs = errorData.missing_blobs || null;
           if (errorData.error) errorMsg += `: ${errorData.error}`;
           else errorMsg += `: ${errorText}`;
       } catch {
           errorMsg += `: ${errorText.slice(0, 200)}`; // Limit length
       }
     } catch (e) {}
+    // The server no longer has some attachment blobs: restore what we can and retry once
+    if (response.status === 409 && missingBlobs && !retried) {
+      await restoreMissingBlobs(payload.messages, missingBlobs);
+      return streamResponse(payload, messageObj, domElement, onRag, true);
+    }
     throw new Error(errorMsg);
   }
 
@@ -2574,6 +2740,16 @@ async function streamResponse(payload, messageObj, domElement) {
         
         try {
           const json = JSON.parse(line);
+          // Leading event from server-side RAG: which memories were injected
+          if (json.rag) {
+            if (onRag) onRag(json.rag.results || []);
+            continue;
+          }
+          // Leading event from budgeted chats: how the history was fitted into num_ctx
+          if (json.context) {
+            if (json.context.summary) console.debug("Context budget:", json.context);
+            continue;
+          }
           // Handle different Ollama response formats
           const msg = json.message;
           const content = msg?.content || json.response || "";
@@ -0,0 +1,75 @@
+"""
+Recall@k vs. latency of the IVF index against exact scoring, for tuning
+RAG_IVF_NLIST / RAG_IVF_NPROBE. Uses a clustered synthetic corpus in a
+throwaway SQLite file, so no Ollama instance is needed.
+
+    python3 benchmarks/bench_ann.py --rows 100000 --nprobe 1 4 8 16 32
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def clustered_vectors(rng, count, dim, clusters):
+    # Real embeddings are far from uniform; a gaussian mixture is a closer stand-in
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, count)
+    return centers[labels] + 0.6 * rng.standard_normal((count, dim)).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--nlist", type=int, default=0, help="0 = sqrt(rows)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="ollama-studio-bench-")
+    os.environ["MEMORY_DB_PATH"] = os.path.join(workdir, "memory.db")
+    os.environ["RAG_INDEX"] = "ivf"
+    os.environ["RAG_IVF_MIN_ROWS"] = "0"
+    import server
+
+    rng = np.random.default_rng(0)
+    vectors = clustered_vectors(rng, args.rows, args.dim, clusters=max(8, args.rows // 500))
+    conn = server.get_db_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO memories (content, category, embedding, embed_dim) VALUES (?, ?, ?, ?)",
+            ((f"memory {i}", "General", vectors[i].tobytes(), args.dim) for i in range(args.rows)),
+        )
+    picks = rng.choice(args.rows, args.queries, replace=False)
+    queries = vectors[picks] + 0.3 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+
+    index = server.MEMORY_INDEX
+    index.ensure_loaded()
+    start = time.perf_counter()
+    ivf = index.build_ivf(nlist=args.nlist or None)
+    print(f"rows={args.rows} dim={args.dim} nlist={ivf.centroids.shape[0]} build={time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    truth = [[i for i, _ in index.search(q, args.k, -1.0, exact=True)] for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / args.queries
+    print(f"{'mode':>10} {'recall@' + str(args.k):>10} {'ms/query':>9}")
+    print(f"{'exact':>10} {1.0:>10.3f} {exact_ms:>9.2f}")
+
+    for nprobe in args.nprobe:
+        server.RAG_IVF_NPROBE = nprobe
+        start = time.perf_counter()
+        found = [[i for i, _ in index.search(q, args.k, -1.0)] for q in queries]
+        ivf_ms = (time.perf_counter() - start) * 1000 / args.queries
+        recall = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(found, truth)])
+        print(f"{'nprobe=' + str(nprobe):>10} {recall:>10.3f} {ivf_ms:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
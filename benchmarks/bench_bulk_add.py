@@ -0,0 +1,66 @@
+"""
+Ingestion throughput of POST /api/rag/add (one item per request) against
+POST /api/rag/bulk_add, with server.py talking to the fake Ollama backend.
+
+    python3 benchmarks/bench_bulk_add.py --items 2000 --embed-latency 0.02
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import HTTPServer
+from urllib.request import Request, urlopen
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_ollama import FakeOllama
+
+
+def post(url, payload, content_type="application/json"):
+    data = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+    req = Request(url, data=data, method="POST", headers={"Content-Type": content_type})
+    with urlopen(req, timeout=600) as response:
+        return json.loads(response.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--single-items", type=int, default=200, help="items sent through /api/rag/add")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--embed-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    fake = FakeOllama(dim=args.dim, embed_latency=args.embed_latency)
+    os.environ["OLLAMA_BASE_URL"] = fake.start()
+    os.environ["MEMORY_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="ollama-studio-bench-"), "memory.db")
+    import server
+
+    httpd = HTTPServer(("127.0.0.1", 0), server.OllamaHandler)
+    server.OllamaHandler.log_message = lambda *a: None
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{httpd.server_address[1]}"
+
+    start = time.perf_counter()
+    for i in range(args.single_items):
+        post(f"{base}/api/rag/add", {"content": f"single fact number {i} about the test corpus", "category": "Bench"})
+    single_rate = args.single_items / (time.perf_counter() - start)
+
+    lines = "\n".join(json.dumps({"content": f"bulk fact number {i} about the test corpus", "category": "Bench"}) for i in range(args.items))
+    start = time.perf_counter()
+    summary = post(f"{base}/api/rag/bulk_add?batch_size={args.batch_size}", lines.encode("utf-8"), "application/x-ndjson")
+    bulk_rate = args.items / (time.perf_counter() - start)
+
+    print(f"/api/rag/add       {single_rate:8.1f} items/s")
+    print(f"/api/rag/bulk_add  {bulk_rate:8.1f} items/s  (added={summary['added']} skipped={summary['skipped']})")
+    print(f"speedup            {bulk_rate / single_rate:8.1f}x")
+    httpd.shutdown()
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Time from process start to the first RAG search result, loading the index
+from SQLite BLOBs (RAG_VECTOR_FILE=0), building the .vec sidecar on first
+start, and mapping the existing sidecar on later starts. Each measurement
+runs in a fresh Python process; the OS page cache is left warm.
+
+    python3 benchmarks/bench_coldstart.py --rows 1000000 --dim 384
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import numpy as np
+import server
+imported = time.perf_counter()
+server.MEMORY_INDEX.ensure_loaded()
+loaded = time.perf_counter()
+hits = server.MEMORY_INDEX.search(np.random.default_rng(1).standard_normal(int(sys.argv[1])), limit=5, threshold=-1.0)
+searched = time.perf_counter()
+print(json.dumps({
+    "import": imported - started,
+    "load": loaded - imported,
+    "first_query": searched - loaded,
+    "total": searched - started,
+    "source": server.MEMORY_INDEX.load_source,
+    "hits": len(hits),
+}))
+"""
+
+
+def start_process(db_path, dim, vector_file):
+    env = dict(os.environ, MEMORY_DB_PATH=db_path, RAG_VECTOR_FILE="1" if vector_file else "0")
+    out = subprocess.run([sys.executable, "-c", CHILD, str(dim)], env=env, cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=768)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="ollama-studio-bench-"), "memory.db")
+    os.environ["MEMORY_DB_PATH"] = db_path
+    os.environ["RAG_VECTOR_FILE"] = "0"
+    import server
+
+    rng = np.random.default_rng(0)
+    start = time.perf_counter()
+    conn = server.get_db_connection()
+    for offset in range(0, args.rows, 50000):
+        count = min(50000, args.rows - offset)
+        vectors = rng.standard_normal((count, args.dim)).astype(np.float32)
+        with conn:
+            conn.executemany(
+                "INSERT INTO memories (content, category, embedding, embed_model, embed_dim) VALUES (?, ?, ?, ?, ?)",
+                ((f"memory {offset + i}", "General", vectors[i].tobytes(), "bench-embed", args.dim) for i in range(count)),
+            )
+    print(f"Stored {args.rows} x {args.dim} vectors in {time.perf_counter() - start:.1f}s\n")
+
+    print(f"{'start':>24} {'import s':>9} {'load s':>8} {'query s':>8} {'total s':>8}")
+    runs = [
+        ("SQLite BLOBs", False),
+        ("first start (builds .vec)", True),
+        ("mapped .vec", True),
+        ("mapped .vec again", True),
+    ]
+    for label, vector_file in runs:
+        stats = start_process(db_path, args.dim, vector_file)
+        print(f"{label:>24} {stats['import']:>9.2f} {stats['load']:>8.2f} {stats['first_query']:>8.2f} {stats['total']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
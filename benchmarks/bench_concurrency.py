@@ -0,0 +1,105 @@
+"""
+Load test for the serving modes: several streaming /api/chat requests run
+while RAG queries and model listings are fired alongside them. In "single"
+mode everything queues behind the streams; the concurrent modes should
+finish in roughly the time of one stream.
+
+    python3 benchmarks/bench_concurrency.py --streams 8 --queries 20
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from urllib.request import Request, urlopen
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_ollama import FakeOllama
+
+
+def start_server(server, mode):
+    httpd = server.make_server(mode, host="127.0.0.1", port=0)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    if mode == "asyncio":
+        httpd.ready.wait()
+    return httpd, f"http://127.0.0.1:{httpd.server_address[1]}"
+
+
+def request(url, payload=None):
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = Request(url, data=data, method="POST" if data else "GET", headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    with urlopen(req, timeout=600) as response:
+        while response.read(65536):
+            pass
+    return time.perf_counter() - start
+
+
+def run_mode(server, mode, args):
+    httpd, base = start_server(server, mode)
+    stream_times, query_times, failures = [], [], []
+    chat = {"model": "llama3.1:8b", "stream": True, "messages": [{"role": "user", "content": "hi"}]}
+
+    def stream():
+        try:
+            stream_times.append(request(f"{base}/api/chat", chat))
+        except OSError as e:
+            failures.append(e)
+
+    def query(i):
+        try:
+            if i % 2:
+                query_times.append(request(f"{base}/api/models"))
+            else:
+                query_times.append(request(f"{base}/api/rag/query", {"query": f"question {i}", "limit": 5}))
+        except OSError as e:
+            # The single-threaded server's listen backlog overflows under load
+            failures.append(e)
+
+    threads = [threading.Thread(target=stream) for _ in range(args.streams)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    query_threads = [threading.Thread(target=query, args=(i,)) for i in range(args.queries)]
+    for t in query_threads:
+        t.start()
+    for t in threads + query_threads:
+        t.join()
+    wall = time.perf_counter() - start
+    httpd.shutdown()
+    httpd.server_close()
+    return wall, np.percentile(stream_times, 50), np.percentile(query_times, 50), np.percentile(query_times, 95), len(failures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modes", nargs="+", default=["single", "threaded", "asyncio"])
+    parser.add_argument("--streams", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--token-interval", type=float, default=0.025)
+    args = parser.parse_args()
+
+    fake = FakeOllama(dim=256, tokens=args.tokens, token_interval=args.token_interval)
+    os.environ["OLLAMA_BASE_URL"] = fake.start()
+    os.environ["MEMORY_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="ollama-studio-bench-"), "memory.db")
+    os.environ.setdefault("SERVER_WORKERS", str(args.streams + 8))
+    import server
+    server.OllamaHandler.log_message = lambda *a: None
+    server.bulk_add_memories([{"content": f"background fact number {i}"} for i in range(500)])
+
+    print(f"{'mode':>9} {'wall s':>7} {'stream p50 s':>13} {'query p50 ms':>13} {'query p95 ms':>13} {'failed':>7}")
+    for mode in args.modes:
+        wall, stream_p50, q50, q95, failed = run_mode(server, mode, args)
+        print(f"{mode:>9} {wall:>7.2f} {stream_p50:>13.2f} {q50 * 1000:>13.1f} {q95 * 1000:>13.1f} {failed:>7}")
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Prompt evaluation over a long streamed chat, sent the way app.js sends it:
+system prompt, a retrieved-memory message that changes every turn, then the
+whole history. The fake Ollama charges --prompt-interval seconds per prompt
+token missing from its KV cache (the prefix shared with the previous prompt)
+and, like Ollama, keeps only the end of a prompt longer than num_ctx.
+"before" forwards the history as is; "after" sets the budget field.
+
+    python3 benchmarks/bench_context_budget.py --turns 40 --num-ctx 4096 --prompt-interval 0.0005
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from urllib.request import Request, urlopen
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_ollama import FakeOllama
+
+WORDS = "the model keeps a cache of the prompt prefix so only new tokens need evaluation during each turn".split()
+
+
+def stream_chat(base, payload):
+    req = Request(base + "/api/chat", data=json.dumps(payload).encode("utf-8"), headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    context, final, reply = None, None, ""
+    with urlopen(req, timeout=120) as response:
+        for line in response:
+            event = json.loads(line)
+            if "context" in event:
+                context = event["context"]
+            elif event.get("done"):
+                final = event
+            else:
+                reply += event["message"]["content"]
+    return time.perf_counter() - start, context, final, reply
+
+
+def run(server, fake, base, budget, args):
+    rng = np.random.default_rng(0)
+    fake.prompts.clear()
+    history, latencies = [], []
+    prompt_tokens = prompt_seconds = saved_tokens = 0
+    chats_before = fake.requests.get("/api/chat", 0)
+    for turn in range(args.turns):
+        text = " ".join(rng.choice(WORDS, args.user_words))
+        history.append({"role": "user", "content": f"Turn {turn}: {text}"})
+        memories = " ".join(rng.choice(WORDS, 60))
+        messages = [{"role": "system", "content": "You are a helpful assistant."},
+                    {"role": "system", "content": f"{server.RAG_CONTEXT_HEADER}\n[记忆1] (关联度: 80%)\n{memories}\n[记忆结束]\n"}]
+        payload = {"model": "llama3.1:8b", "stream": True, "messages": messages + history,
+                   "options": {"num_ctx": args.num_ctx, "num_predict": args.num_predict}}
+        if budget:
+            payload["budget"] = True
+        elapsed, context, final, reply = stream_chat(base, payload)
+        history.append({"role": "assistant", "content": reply})
+        latencies.append(elapsed)
+        prompt_tokens += final["prompt_eval_count"]
+        prompt_seconds += final["prompt_eval_duration"] / 1e9
+        saved_tokens += (context or {}).get("saved_tokens", 0)
+    summaries = fake.requests.get("/api/chat", 0) - chats_before - args.turns
+    return prompt_tokens, prompt_seconds, sum(latencies), np.percentile(latencies, 95), summaries, saved_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--user-words", type=int, default=150, help="words per user message")
+    parser.add_argument("--num-ctx", type=int, default=4096)
+    parser.add_argument("--num-predict", type=int, default=512)
+    parser.add_argument("--tokens", type=int, default=120, help="tokens per reply")
+    parser.add_argument("--prompt-interval", type=float, default=0.0005, help="seconds per evaluated prompt token")
+    args = parser.parse_args()
+
+    fake = FakeOllama(dim=64, models=2, tokens=args.tokens, token_interval=0.0, prompt_interval=args.prompt_interval)
+    os.environ["OLLAMA_BASE_URL"] = fake.start()
+    os.environ["MEMORY_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="ollama-studio-bench-"), "memory.db")
+    import server
+    server.OllamaHandler.log_message = lambda *a: None
+
+    httpd = server.make_server("threaded", host="127.0.0.1", port=0)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{httpd.server_address[1]}"
+
+    print(f"{args.turns} turns, ~{args.user_words} words per user message, num_ctx {args.num_ctx}, "
+          f"{args.prompt_interval * 1000:.2f} ms per prompt token\n")
+    print(f"{'':>8} {'prompt tokens':>14} {'prompt s':>9} {'total s':>8} {'p95 s':>7} {'summaries':>10} {'reported saved':>15}")
+    for label, budget in (("before", False), ("after", True)):
+        tokens, seconds, total, p95, summaries, saved = run(server, fake, base, budget, args)
+        print(f"{label:>8} {tokens:>14} {seconds:>9.2f} {total:>8.2f} {p95:>7.2f} {summaries:>10} {saved:>15}")
+    print("\n" + json.dumps(server.CONTEXT_BUDGET.snapshot(), indent=2))
+    httpd.shutdown()
+    httpd.server_close()
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Near-duplicate compaction on a synthetic store: clustered random memories
+plus noisy copies of some of them (paraphrases, cosine well above the
+threshold). Compares finding the duplicates with one index search per
+memory, the way add_memory checks a single insert, against the blocked
+exact scan and the IVF-list scan of duplicate_clusters, then compacts and
+reports rows, bytes and exact scan time before and after.
+
+    python3 benchmarks/bench_dedup.py --rows 20000 --dim 384 --dup-rate 0.15
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000, help="distinct memories")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--dup-rate", type=float, default=0.15, help="extra paraphrases, as a fraction of --rows")
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--per-row-sample", type=int, default=2000, help="memories timed for the per-row search baseline")
+    args = parser.parse_args()
+
+    os.environ["MEMORY_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="ollama-studio-bench-"), "memory.db")
+    import server
+
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((max(1, args.rows // 50), args.dim)).astype(np.float32)
+    base = centers[rng.integers(0, centers.shape[0], args.rows)] + 0.8 * rng.standard_normal((args.rows, args.dim)).astype(np.float32)
+    sources = rng.integers(0, args.rows, int(args.rows * args.dup_rate))
+    noise = 0.2 * np.linalg.norm(base[sources], axis=1, keepdims=True) / np.sqrt(args.dim)
+    vectors = np.concatenate([base, base[sources] + noise * rng.standard_normal((sources.size, args.dim))]).astype(np.float32)
+    contents = [f"memory {i}" for i in range(args.rows)] + [f"paraphrase of memory {s}" for s in sources]
+    conn = server.get_db_connection()
+    with conn:
+        conn.executemany("INSERT INTO memories (content, category, embedding, embed_model, embed_dim) VALUES (?, ?, ?, ?, ?)",
+                         ((c, "General", v.tobytes(), "bench-embed", args.dim) for c, v in zip(contents, vectors)))
+    server.MEMORY_INDEX.ensure_loaded()
+    print(f"{vectors.shape[0]} memories x {args.dim} dims, {sources.size} paraphrases, threshold {args.threshold}\n")
+
+    # Baseline: one index search per memory, extrapolated from a sample
+    sample = rng.choice(vectors.shape[0], min(args.per_row_sample, vectors.shape[0]), replace=False)
+    start = time.perf_counter()
+    for row in sample:
+        server.MEMORY_INDEX.search(vectors[row], limit=10, threshold=args.threshold, exact=True)
+    per_row = (time.perf_counter() - start) / sample.size * vectors.shape[0]
+
+    start = time.perf_counter()
+    exact, _ = server.duplicate_clusters(args.threshold)
+    exact_seconds = time.perf_counter() - start
+    exact_found = sum(len(c) - 1 for c in exact)
+
+    server.MEMORY_INDEX.build_ivf()
+    start = time.perf_counter()
+    approx, _ = server.duplicate_clusters(args.threshold)
+    ivf_seconds = time.perf_counter() - start
+    ivf_found = sum(len(c) - 1 for c in approx)
+    server.MEMORY_INDEX.ivf = None
+
+    print(f"{'method':>22} {'seconds':>9} {'removable':>10}")
+    print(f"{'per-row search':>22} {per_row:>9.2f} {'-':>10}")
+    print(f"{'blocked exact':>22} {exact_seconds:>9.2f} {exact_found:>10}")
+    print(f"{'IVF lists':>22} {ivf_seconds:>9.2f} {ivf_found:>10}")
+
+    summary = server.dedup_memories(args.threshold)
+    print(f"\nrows {summary['rows_before']} -> {summary['rows_after']}, "
+          f"MB {summary['bytes_before'] / 1e6:.1f} -> {summary['bytes_after'] / 1e6:.1f}, "
+          f"exact scan {summary['scan_ms_before']} -> {summary['scan_ms_after']} ms ({summary.get('scan_speedup')}x)")
+
+
+if __name__ == "__main__":
+    main()
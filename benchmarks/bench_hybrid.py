@@ -0,0 +1,120 @@
+"""
+Relevance and latency of search_memory in vector, lexical and hybrid modes
+over a synthetic corpus of incident notes. Every note carries one exact
+identifier (hostname, error code or package name) among shared topical
+vocabulary; each query asks about one identifier, and the note holding it
+is the only relevant answer. Embeddings come from the fake Ollama's
+bag-of-words mode, with a configurable embedding round-trip latency.
+
+    python3 benchmarks/bench_hybrid.py --docs 5000 --queries 200 --embed-latency 0.02
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_ollama import FakeOllama
+
+TOPICS = {
+    "disk": "disk volume full storage quota inode usage alert cleanup",
+    "network": "network latency packet loss timeout route dns resolver",
+    "deploy": "deploy rollout release pipeline build artifact version",
+    "database": "database replica lag query slow index connection pool",
+    "auth": "login token expired certificate auth session denied",
+}
+
+
+def identifier(rng, i):
+    kind = i % 3
+    if kind == 0:
+        return f"srv-{rng.integers(1000, 9999)}-{i}.internal"
+    if kind == 1:
+        return f"E{rng.integers(10000, 99999)}{i}"
+    return f"libpkg{i}-{rng.integers(1, 9)}.{rng.integers(0, 20)}"
+
+
+def build_corpus(count, rng):
+    topics = list(TOPICS)
+    docs, queries = [], []
+    for i in range(count):
+        topic = topics[i % len(topics)]
+        words = rng.choice(TOPICS[topic].split(), size=6).tolist()
+        ident = identifier(rng, i)
+        docs.append(f"{' '.join(words[:3])} {ident} {' '.join(words[3:])} observed during {topic} checks")
+        queries.append(f"what happened with {ident} {topic}")
+    return docs, queries
+
+
+def evaluate(server, mode, queries, expected, limit):
+    latencies, hits, reciprocal = [], 0, 0.0
+    for query, want in zip(queries, expected):
+        start = time.perf_counter()
+        results = server.search_memory(query, limit=limit, threshold=0.0, mode=mode)
+        latencies.append((time.perf_counter() - start) * 1000)
+        ids = [r["id"] for r in results]
+        if want in ids:
+            hits += 1
+            reciprocal += 1.0 / (ids.index(want) + 1)
+    return {
+        "recall": hits / len(queries),
+        "mrr": reciprocal / len(queries),
+        "p50": float(np.percentile(latencies, 50)),
+        "p95": float(np.percentile(latencies, 95)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--rrf-k", type=int, default=None, help="override RAG_RRF_K for the hybrid mode")
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="seconds per embedding round trip")
+    args = parser.parse_args()
+
+    fake = FakeOllama(dim=args.dim, embed_latency=args.embed_latency, semantic=True)
+    os.environ["OLLAMA_BASE_URL"] = fake.start()
+    os.environ["MEMORY_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="ollama-studio-bench-"), "memory.db")
+    # Every query must pay for its embedding, as a first-time query would
+    os.environ["EMBED_CACHE_SIZE"] = "0"
+    os.environ["EMBED_CACHE_PERSIST"] = "0"
+    if args.rrf_k is not None:
+        os.environ["RAG_RRF_K"] = str(args.rrf_k)
+    import server
+
+    rng = np.random.default_rng(0)
+    docs, queries = build_corpus(args.docs, rng)
+    model = server.get_embed_model()
+    start = time.perf_counter()
+    vectors = []
+    for i in range(0, len(docs), 256):
+        vectors.extend(server.fetch_embeddings(docs[i:i + 256], model))
+    conn = server.get_db_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO memories (id, content, category, embedding, embed_model, embed_dim) VALUES (?, ?, ?, ?, ?, ?)",
+            ((i + 1, doc, "Bench", np.array(vec, dtype=np.float32).tobytes(), model, args.dim) for i, (doc, vec) in enumerate(zip(docs, vectors))),
+        )
+    server.MEMORY_INDEX.invalidate()
+    server.MEMORY_INDEX.ensure_loaded()
+    print(f"Loaded {args.docs} notes in {time.perf_counter() - start:.1f}s (FTS5: {server.FTS_ENABLED})")
+
+    picks = rng.choice(len(queries), size=min(args.queries, len(queries)), replace=False)
+    sample = [queries[i] for i in picks]
+    expected = [int(i) + 1 for i in picks]
+
+    print(f"\n{'mode':>8} {'recall@' + str(args.limit):>10} {'MRR':>6} {'p50 ms':>8} {'p95 ms':>8}")
+    for mode in server.SEARCH_MODES:
+        stats = evaluate(server, mode, sample, expected, args.limit)
+        print(f"{mode:>8} {stats['recall']:>10.3f} {stats['mrr']:>6.3f} {stats['p50']:>8.2f} {stats['p95']:>8.2f}")
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
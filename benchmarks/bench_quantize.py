@@ -0,0 +1,81 @@
+"""
+Recall, storage and latency of the float32 / float16 / int8 vector
+encodings. The same clustered random corpus is stored as float32, converted
+with reencode_memories, and searched through a MemoryIndex; recall@k is
+measured against exact float32 scoring. No Ollama instance is needed.
+
+    python3 benchmarks/bench_quantize.py --rows 100000 --dim 768
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def corpus(rows, dim, rng):
+    # Clustered like real embeddings, so neighbours are not all near-ties
+    centers = rng.standard_normal((max(1, rows // 50), dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, centers.shape[0], rows)] + 0.6 * rng.standard_normal((rows, dim)).astype(np.float32)
+    return vectors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    os.environ["MEMORY_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="ollama-studio-bench-"), "memory.db")
+    import server
+
+    rng = np.random.default_rng(0)
+    vectors = corpus(args.rows, args.dim, rng)
+    picks = rng.choice(args.rows, args.queries, replace=False)
+    queries = vectors[picks] + 0.3 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    truth = []
+    for query in queries:
+        scores = unit @ (query / np.linalg.norm(query))
+        truth.append(set((np.argpartition(-scores, args.limit)[:args.limit] + 1).tolist()))
+
+    conn = server.get_db_connection()
+    print(f"{args.rows} rows x {args.dim} dims, recall@{args.limit} against exact float32\n")
+    print(f"{'encoding':>9} {'DB MB':>8} {'file MB':>8} {'convert s':>10} {'load s':>7} {'index MB':>9} {'p50 ms':>7} {'recall':>7}")
+    for encoding in server.VECTOR_ENCODINGS:
+        with conn:
+            conn.execute("DELETE FROM memories")
+            conn.executemany(
+                "INSERT INTO memories (id, content, category, embedding, embed_dim) VALUES (?, ?, ?, ?, ?)",
+                ((i + 1, f"memory {i}", "General", vectors[i].tobytes(), args.dim) for i in range(args.rows)),
+            )
+        summary = server.reencode_memories(encoding, batch_size=2000)
+        conn.execute("VACUUM")
+        blob_bytes = conn.execute("SELECT SUM(LENGTH(embedding)) FROM memories").fetchone()[0]
+        file_bytes = os.path.getsize(server.DB_PATH)
+
+        index = server.MemoryIndex(encoding=encoding, vector_file=False)
+        start = time.perf_counter()
+        index.ensure_loaded()
+        load_seconds = time.perf_counter() - start
+
+        samples, found = [], 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            hits = index.search(query, limit=args.limit, threshold=-1.0)
+            samples.append((time.perf_counter() - start) * 1000)
+            found += len(expected & {memory_id for memory_id, _ in hits})
+        recall = found / (args.limit * len(queries))
+        print(f"{encoding:>9} {blob_bytes / 1e6:>8.1f} {file_bytes / 1e6:>8.1f} {summary['elapsed_seconds']:>10.2f} "
+              f"{load_seconds:>7.2f} {index.snapshot()['vector_bytes'] / 1e6:>9.1f} {np.median(samples):>7.2f} {recall:>7.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Compares the old per-row cosine loop in search_memory against the resident
+MemoryIndex. Runs against a throwaway SQLite file filled with random vectors,
+so no Ollama instance is needed.
+
+    python3 benchmarks/bench_search.py --sizes 1000 10000 100000 --dim 768
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def legacy_search(server, query_vec, limit, threshold):
+    # Verbatim scoring loop from the pre-index search_memory
+    conn = server.get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT id, content, embedding, created_at FROM memories")
+    rows = c.fetchall()
+    results = []
+    for row in rows:
+        vec = np.frombuffer(row["embedding"], dtype=np.float32)
+        score = server.cosine_similarity(query_vec, vec)
+        if score >= threshold:
+            results.append({"id": row["id"], "score": float(score)})
+    results.sort(key=lambda x: x["score"], reverse=True)
+    return results[:limit]
+
+
+def populate(server, count, dim, rng):
+    conn = server.get_db_connection()
+    vectors = rng.standard_normal((count, dim)).astype(np.float32)
+    with conn:
+        conn.executemany(
+            "INSERT INTO memories (content, category, embedding, embed_dim) VALUES (?, ?, ?, ?)",
+            ((f"memory {i}", "General", vectors[i].tobytes(), dim) for i in range(count)),
+        )
+    return vectors
+
+
+def timed(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return result, float(np.median(samples))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="ollama-studio-bench-")
+    os.environ["MEMORY_DB_PATH"] = os.path.join(workdir, "memory.db")
+    import server
+
+    rng = np.random.default_rng(0)
+    print(f"{'rows':>8} {'legacy ms':>10} {'index ms':>10} {'load ms':>9} {'speedup':>8}  same")
+    for size in args.sizes:
+        server.clear_all_memories()
+        server.MEMORY_INDEX.invalidate()
+        vectors = populate(server, size, args.dim, rng)
+        # Query near an existing row so there are hits above the threshold
+        query = (vectors[size // 2] + 0.5 * rng.standard_normal(args.dim)).tolist()
+
+        start = time.perf_counter()
+        server.MEMORY_INDEX.ensure_loaded()
+        load_ms = (time.perf_counter() - start) * 1000
+
+        legacy, legacy_ms = timed(lambda: legacy_search(server, np.array(query), args.limit, args.threshold), max(1, args.repeat // 2))
+        indexed, index_ms = timed(lambda: server.MEMORY_INDEX.search(query, args.limit, args.threshold), args.repeat)
+        same = [r["id"] for r in legacy] == [memory_id for memory_id, _ in indexed]
+        print(f"{size:>8} {legacy_ms:>10.2f} {index_ms:>10.2f} {load_ms:>9.1f} {legacy_ms / max(index_ms, 1e-9):>7.0f}x  {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Upstream Ollama calls when several tabs open the studio at once. Each
+burst starts cold (model registry, embed model and shared-call cache
+cleared), then every tab loads /api/models, /api/rag/status,
+/api/models/tool-capable and /api/models/details together and sends the same
+deterministic non-streaming chat (fixed seed, temperature 0). "before" runs
+with the single-flight layer replaced by a pass-through.
+
+    python3 benchmarks/bench_shared_calls.py --tabs 8 --bursts 5 --latency 0.05
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from urllib.request import Request, urlopen
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_ollama import FakeOllama
+
+PAGE = ["/api/models", "/api/rag/status", "/api/models/tool-capable", "/api/models/details"]
+CHAT = {"model": "llama3.1:8b", "stream": False, "options": {"seed": 42, "temperature": 0},
+        "messages": [{"role": "user", "content": "Summarise the release notes"}]}
+
+
+class PassThrough:
+    """SharedCalls stand-in that always calls through, as the server behaved before."""
+
+    def call(self, key, fn, ttl=0.0, keep=None):
+        return fn(), "miss"
+
+    def forget(self, kind):
+        pass
+
+
+def request(url, payload=None):
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = Request(url, data=data, method="POST" if data else "GET", headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    with urlopen(req, timeout=60) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def run(server, fake, base, shared, args):
+    server.SHARED_CALLS = shared
+    fake.requests.clear()
+    latencies = []
+    lock = threading.Lock()
+
+    def tab():
+        for path in PAGE:
+            elapsed = request(base + path)
+            with lock:
+                latencies.append(elapsed)
+        elapsed = request(base + "/api/chat", CHAT)
+        with lock:
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    for _ in range(args.bursts):
+        server.MODEL_REGISTRY.clear()
+        server.CACHED_EMBED_MODEL = None
+        if hasattr(shared, "clear"):
+            shared.clear()
+        threads = [threading.Thread(target=tab) for _ in range(args.tabs)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    wall = time.perf_counter() - start
+    return wall, np.percentile(latencies, 50), np.percentile(latencies, 95), dict(fake.requests)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tabs", type=int, default=8)
+    parser.add_argument("--bursts", type=int, default=5)
+    parser.add_argument("--models", type=int, default=6)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds Ollama takes per request")
+    args = parser.parse_args()
+
+    fake = FakeOllama(dim=64, models=args.models, latency=args.latency, tokens=20, token_interval=0.01)
+    os.environ["OLLAMA_BASE_URL"] = fake.start()
+    os.environ["MEMORY_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="ollama-studio-bench-"), "memory.db")
+    os.environ.setdefault("SERVER_WORKERS", str(args.tabs * 2))
+    import server
+    server.OllamaHandler.log_message = lambda *a: None
+
+    httpd = server.make_server("threaded", host="127.0.0.1", port=0)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{httpd.server_address[1]}"
+
+    print(f"{args.bursts} cold bursts x {args.tabs} tabs, {args.models} models, {args.latency * 1000:.0f} ms per Ollama call\n")
+    print(f"{'':>8} {'wall s':>7} {'p50 ms':>7} {'p95 ms':>7} {'/api/tags':>10} {'/api/show':>10} {'/api/chat':>10}")
+    shared = server.SharedCalls(server.RESPONSE_CACHE_SIZE)
+    for label, layer in (("before", PassThrough()), ("after", shared)):
+        wall, p50, p95, calls = run(server, fake, base, layer, args)
+        print(f"{label:>8} {wall:>7.2f} {p50 * 1000:>7.1f} {p95 * 1000:>7.1f} "
+              f"{calls.get('/api/tags', 0):>10} {calls.get('/api/show', 0):>10} {calls.get('/api/chat', 0):>10}")
+    print("\n" + json.dumps(shared.snapshot()["kinds"], indent=2))
+    httpd.shutdown()
+    httpd.server_close()
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Bytes transferred and requests per second for the static assets
+(index.html, styles.css, app.js). "before" is a handler serving them the
+old way, re-reading each file per request and sending it uncompressed with
+no validators; "after" is the current handler on a first visit (gzip, or
+brotli when installed) and on a revisit that sends If-None-Match.
+
+    python3 benchmarks/bench_static.py --clients 8 --loads 300
+"""
+import argparse
+import http.client
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ASSETS = ["/", "/styles.css", "/app.js"]
+
+
+def quiet_handler(server):
+    class QuietHandler(server.OllamaHandler):
+        def log_message(self, format, *args):
+            pass
+
+    return QuietHandler
+
+
+def legacy_handler(server):
+    class LegacyHandler(quiet_handler(server)):
+        def send_static(self, name):
+            with open(os.path.join(server.BASE_DIR, name), "rb") as file:
+                data = file.read()
+            content_type = server.StaticAssets.CONTENT_TYPES.get(os.path.splitext(name)[1], "text/plain")
+            self.send_bytes(200, content_type, data)
+
+    return LegacyHandler
+
+
+def start(server, handler, workers):
+    httpd = server.PooledHTTPServer(("127.0.0.1", 0), handler, workers)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def fetch(port, path, headers):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    conn.request("GET", path, headers=headers)
+    response = conn.getresponse()
+    body = response.read()
+    etag = response.getheader("ETag")
+    conn.close()
+    return response.status, len(body), etag
+
+
+def page_loads(port, clients, loads, encoding, revisit):
+    # One unconditional load per asset learns the ETags a returning browser would hold
+    etags = {path: fetch(port, path, {"Accept-Encoding": encoding})[2] for path in ASSETS}
+    counts = {"requests": 0, "bytes": 0, "not_modified": 0}
+    lock = threading.Lock()
+
+    def client(n):
+        sent, not_modified = 0, 0
+        for _ in range(n):
+            for path in ASSETS:
+                headers = {"Accept-Encoding": encoding}
+                if revisit and etags[path]:
+                    headers["If-None-Match"] = etags[path]
+                status, size, _ = fetch(port, path, headers)
+                sent += size
+                not_modified += status == 304
+        with lock:
+            counts["requests"] += n * len(ASSETS)
+            counts["bytes"] += sent
+            counts["not_modified"] += not_modified
+
+    per_client = max(1, loads // clients)
+    threads = [threading.Thread(target=client, args=(per_client,)) for _ in range(clients)]
+    start_time = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start_time
+    return counts["requests"] / elapsed, counts["bytes"] / (per_client * clients), counts["not_modified"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--loads", type=int, default=300, help="page loads (3 requests each)")
+    args = parser.parse_args()
+
+    os.environ.setdefault("MEMORY_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="ollama-studio-bench-"), "memory.db"))
+    import server
+
+    encoding = "gzip, deflate, br" if server.brotli is not None else "gzip, deflate"
+    print(f"{args.loads} page loads x {len(ASSETS)} assets, {args.clients} clients, Accept-Encoding: {encoding}\n")
+    print(f"{'handler':>22} {'req/s':>8} {'KB/page':>9} {'304s':>6}")
+    runs = [
+        ("before", legacy_handler(server), False),
+        ("after, first visit", quiet_handler(server), False),
+        ("after, revisit", quiet_handler(server), True),
+    ]
+    for label, handler, revisit in runs:
+        httpd = start(server, handler, args.clients)
+        rps, page_bytes, not_modified = page_loads(httpd.server_address[1], args.clients, args.loads, encoding, revisit)
+        httpd.shutdown()
+        httpd.server_close()
+        print(f"{label:>22} {rps:>8.0f} {page_bytes / 1024:>9.1f} {not_modified:>6}")
+
+
+if __name__ == "__main__":
+    main()
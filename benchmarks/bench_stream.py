@@ -0,0 +1,105 @@
+"""
+Time-to-first-token and per-token relay delay of the streaming /api/chat
+proxy, against a fake Ollama that emits one NDJSON token on a timer. The
+pre-read1 relay (blocking 4 KB reads, three writes per chunk) is included
+for comparison.
+
+    python3 benchmarks/bench_stream.py --tokens 100 --token-interval 0.01
+"""
+import argparse
+import http.client
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import HTTPServer
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_ollama import FakeOllama
+
+
+def legacy_handler(server):
+    class LegacyHandler(server.OllamaHandler):
+        disable_nagle_algorithm = False
+
+        def relay_chunked(self, response):
+            # Verbatim relay loop from before read1 framing
+            while True:
+                chunk = response.read(4096)
+                if not chunk:
+                    break
+                self.wfile.write(f"{len(chunk):X}\r\n".encode("utf-8"))
+                self.wfile.write(chunk)
+                self.wfile.write(b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+    return LegacyHandler
+
+
+def measure(port, runs):
+    """Returns (ttft list, per-token delay list) measured against the fake's emit timestamps."""
+    ttfts, delays = [], []
+    body = json.dumps({"model": "llama3.1:8b", "stream": True, "messages": [{"role": "user", "content": "hi"}]})
+    for _ in range(runs):
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        start = time.time()
+        conn.request("POST", "/api/chat", body=body, headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        pending = b""
+        first = None
+        while True:
+            data = response.read1(65536)
+            if not data:
+                break
+            now = time.time()
+            pending += data
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                event = json.loads(line)
+                if event.get("done"):
+                    continue
+                if first is None:
+                    first = now - start
+                delays.append(now - event["created_at"])
+        ttfts.append(first)
+        conn.close()
+    return ttfts, delays
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--token-interval", type=float, default=0.01)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--coalesce-ms", type=float, nargs="*", default=[0, 20])
+    args = parser.parse_args()
+
+    fake = FakeOllama(tokens=args.tokens, token_interval=args.token_interval)
+    os.environ["OLLAMA_BASE_URL"] = fake.start()
+    os.environ["MEMORY_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="ollama-studio-bench-"), "memory.db")
+    import server
+    server.OllamaHandler.log_message = lambda *a: None
+
+    variants = [("legacy", legacy_handler(server), 0)]
+    variants += [(f"read1 coalesce={ms:g}ms", server.OllamaHandler, ms) for ms in args.coalesce_ms]
+    print(f"{'relay':>22} {'ttft ms':>8} {'delay p50 ms':>13} {'delay p99 ms':>13}")
+    for name, handler, coalesce_ms in variants:
+        server.CHAT_COALESCE_MS = coalesce_ms
+        httpd = HTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        ttfts, delays = measure(httpd.server_address[1], args.runs)
+        httpd.shutdown()
+        httpd.server_close()
+        print(f"{name:>22} {np.median(ttfts) * 1000:>8.1f} {np.percentile(delays, 50) * 1000:>13.2f} {np.percentile(delays, 99) * 1000:>13.2f}")
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Latency of the web_search tool over a simulated conversation in which the
+tool loop repeats queries. DDGS is replaced by a stub whose backends have
+fixed latencies and failure modes (by default "api" is down, "html" is slow
+and "lite" is fast), so no network access is needed. Compares the old
+behaviour (serial fallback, no cache, no breaker) with the cached fallback
+and racing modes.
+
+    python3 benchmarks/bench_web_search.py --queries 60 --distinct 15
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubDDGS:
+    """DDGS stand-in: backend -> (latency seconds, fails)."""
+
+    profile = {}
+    calls = 0
+    lock = threading.Lock()
+
+    def text(self, query, max_results=5, backend="api"):
+        latency, fails = self.profile.get(backend, (0.0, True))
+        with self.lock:
+            StubDDGS.calls += 1
+        time.sleep(latency)
+        if fails:
+            raise RuntimeError(f"{backend} backend returned 202 Ratelimit")
+        return iter([{"title": f"{query} #{i}", "href": f"https://example.com/{i}", "body": backend} for i in range(max_results)])
+
+
+def run(server, label, queries, **options):
+    StubDDGS.calls = 0
+    search = server.WebSearch(server.WEB_SEARCH_BACKENDS, client_factory=StubDDGS, **options)
+    latencies, errors = [], 0
+    for query in queries:
+        start = time.perf_counter()
+        result = search.search(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+        errors += "error" in result
+    stats = search.snapshot()
+    print(f"{label:>28} {np.percentile(latencies, 50):>8.1f} {np.percentile(latencies, 95):>8.1f} "
+          f"{sum(latencies) / 1000:>8.2f} {StubDDGS.calls:>6} {stats['hit_rate']:>6.2f} {errors:>6}")
+    search.executor.shutdown(wait=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--queries", type=int, default=60, help="tool calls in the conversation")
+    parser.add_argument("--distinct", type=int, default=15, help="distinct queries among them")
+    parser.add_argument("--api", type=float, default=0.4, help="seconds before the failing api backend errors")
+    parser.add_argument("--html", type=float, default=0.8)
+    parser.add_argument("--lite", type=float, default=0.3)
+    args = parser.parse_args()
+
+    import server
+
+    StubDDGS.profile = {"api": (args.api, True), "html": (args.html, False), "lite": (args.lite, False)}
+    rng = np.random.default_rng(0)
+    topics = [f"Python asyncio Release notes {i}" for i in range(args.distinct)]
+    # Repeats differ in case and spacing, as the model rephrases tool arguments
+    queries = [topics[i] if rng.random() < 0.5 else "  " + topics[i].upper() for i in rng.integers(0, args.distinct, args.queries)]
+
+    print(f"{args.queries} searches, {args.distinct} distinct; api fails after {args.api}s, html {args.html}s, lite {args.lite}s\n")
+    print(f"{'configuration':>28} {'p50 ms':>8} {'p95 ms':>8} {'total s':>8} {'calls':>6} {'hits':>6} {'errors':>6}")
+    run(server, "serial, no cache (old)", queries, mode="fallback", size=0, failures=10 ** 9)
+    run(server, "serial + breaker", queries, mode="fallback", size=0)
+    run(server, "fallback + cache + breaker", queries, mode="fallback")
+    run(server, "race + cache + breaker", queries, mode="race")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Minimal stand-in for the Ollama HTTP API used by the benchmarks. It serves
+/api/tags, /api/show, /api/embeddings, /api/embed and /api/chat (streaming
+and not) with configurable latency, so server.py can be exercised without a
+GPU box.
+
+    python3 benchmarks/fake_ollama.py --port 11435 --dim 768
+    OLLAMA_BASE_URL=http://127.0.0.1:11435 python3 server.py
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+class FakeOllama:
+    def __init__(self, dim=768, models=4, latency=0.0, embed_latency=0.0, token_interval=0.01, tokens=32, semantic=False,
+                 prompt_interval=0.0):
+        self.dim = dim
+        self.semantic = semantic
+        self.latency = latency
+        self.embed_latency = embed_latency
+        self.token_interval = token_interval
+        self.tokens = tokens
+        self.prompt_interval = prompt_interval
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.prompts = {}
+        names = ["nomic-embed-text:latest", "llama3.1:8b"]
+        names += [f"fake-model-{i}:latest" for i in range(max(0, models - len(names)))]
+        self.models = names[:max(models, 1)]
+        self.httpd = None
+        self.thread = None
+
+    def count(self, path):
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def vector(self, token):
+        seed = int.from_bytes(hashlib.sha256(token.encode("utf-8")).digest()[:8], "little")
+        return np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+
+    def embed(self, text):
+        # Deterministic per text so repeated runs and duplicate checks behave like a real model
+        if not self.semantic:
+            return self.vector(text).tolist()
+        # Bag of words: texts sharing vocabulary land close together, like a (very) small real model
+        words = text.lower().split() or [""]
+        return np.sum([self.vector(word) for word in words], axis=0).tolist()
+
+    def prompt_eval(self, body):
+        """
+        Prompt tokens (4 characters each) the model has to evaluate, and the
+        seconds it takes at prompt_interval per token. Like Ollama's KV cache,
+        the part shared with the model's previous prompt is free; a prompt
+        over num_ctx keeps only its end, which shifts it and defeats reuse.
+        """
+        prompt = json.dumps(body.get("tools") or []) + "".join(json.dumps(m, sort_keys=True) for m in body.get("messages") or [])
+        limit = int((body.get("options") or {}).get("num_ctx") or 2048) * 4
+        prompt = prompt[-limit:]
+        with self.lock:
+            previous = self.prompts.get(body.get("model"), "")
+            self.prompts[body.get("model")] = prompt
+        shared, high = 0, min(len(prompt), len(previous))
+        while shared < high:
+            middle = (shared + high + 1) // 2
+            if prompt[:middle] == previous[:middle]:
+                shared = middle
+            else:
+                high = middle - 1
+        count = max(1, (len(prompt) - shared) // 4)
+        return count, count * self.prompt_interval
+
+    def details(self, name):
+        if "embed" in name:
+            return {"template": "", "capabilities": ["embedding"], "model_info": {"families": ["nomic-bert"], "general.architecture": "nomic-bert", "nomic-bert.context_length": 2048}}
+        return {
+            "template": "{{ if .Tools }}{{ .Tools }}{{ end }}{{ .Prompt }}",
+            "capabilities": ["completion", "tools"],
+            "model_info": {"families": ["llama"], "general.architecture": "llama", "llama.context_length": 8192},
+        }
+
+    def start(self, host="127.0.0.1", port=0):
+        fake = self
+
+        class Handler(FakeOllamaHandler):
+            server_state = fake
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return f"http://{host}:{self.httpd.server_address[1]}"
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, delayed ACKs add ~40ms per keep-alive response
+    disable_nagle_algorithm = True
+    server_state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", "0"))
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def do_GET(self):
+        fake = self.server_state
+        fake.count(self.path)
+        time.sleep(fake.latency)
+        if self.path == "/api/tags":
+            models = [{"name": name, "modified_at": "2024-01-01T00:00:00Z", "digest": hashlib.sha256(name.encode()).hexdigest(), "size": 1} for name in fake.models]
+            self.send_json({"models": models})
+            return
+        self.send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        fake = self.server_state
+        fake.count(self.path)
+        body = self.read_json()
+        time.sleep(fake.latency)
+        if self.path == "/api/show":
+            name = body.get("name") or body.get("model")
+            if name not in fake.models:
+                self.send_json({"error": "model not found"}, 404)
+                return
+            self.send_json(fake.details(name))
+            return
+        if self.path == "/api/embeddings":
+            time.sleep(fake.embed_latency)
+            self.send_json({"embedding": fake.embed(body.get("prompt", ""))})
+            return
+        if self.path == "/api/embed":
+            inputs = body.get("input", [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            time.sleep(fake.embed_latency)
+            self.send_json({"model": body.get("model"), "embeddings": [fake.embed(text) for text in inputs]})
+            return
+        if self.path == "/api/chat":
+            self.chat(body)
+            return
+        self.send_json({"error": "not found"}, 404)
+
+    def chat(self, body):
+        fake = self.server_state
+        model = body.get("model", "")
+        prompt_count, prompt_seconds = fake.prompt_eval(body)
+        stats = {"prompt_eval_count": prompt_count, "prompt_eval_duration": int(prompt_seconds * 1e9), "eval_count": fake.tokens}
+        time.sleep(prompt_seconds)
+        if not body.get("stream", True):
+            time.sleep(fake.token_interval * fake.tokens)
+            content = " ".join(f"tok{i}" for i in range(fake.tokens))
+            prompt = (body.get("messages") or [{}])[-1].get("content") or ""
+            if "extract ONE key fact" in prompt:
+                # Memory extraction prompt: remember the user's line, like a cooperative model would
+                user_line = next((line[6:] for line in prompt.splitlines() if line.startswith("User: ")), "")
+                content = json.dumps({"content": f"The user said: {user_line}", "category": "General"}) if len(user_line) > 10 else "NULL"
+            self.send_json({"model": model, "message": {"role": "assistant", "content": content}, "done": True, **stats})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i in range(fake.tokens):
+            time.sleep(fake.token_interval)
+            line = json.dumps({"model": model, "created_at": time.time(), "message": {"role": "assistant", "content": f"tok{i} "}, "done": False}) + "\n"
+            self.write_chunk(line.encode("utf-8"))
+        line = json.dumps({"model": model, "message": {"role": "assistant", "content": ""}, "done": True, **stats}) + "\n"
+        self.write_chunk(line.encode("utf-8"))
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def write_chunk(self, data):
+        self.wfile.write(b"%X\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Ollama server for offline benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--models", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="extra seconds per embedding request")
+    parser.add_argument("--token-interval", type=float, default=0.01, help="seconds between streamed tokens")
+    parser.add_argument("--tokens", type=int, default=32)
+    parser.add_argument("--prompt-interval", type=float, default=0.0, help="seconds per prompt token not in the KV cache")
+    args = parser.parse_args()
+    fake = FakeOllama(args.dim, args.models, args.latency, args.embed_latency, args.token_interval, args.tokens,
+                      prompt_interval=args.prompt_interval)
+    print(f"Fake Ollama listening on {fake.start(args.host, args.port)}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
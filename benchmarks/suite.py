@@ -0,0 +1,345 @@
+"""
+Offline benchmark suite: runs scripted scenarios against OllamaHandler with
+a FakeOllama backend and writes latency percentiles, throughput and peak
+RSS to a JSON file that can be compared between commits.
+
+Each scenario runs the server (and its load generator) in a fresh Python
+process with its own memory.db, so peak RSS is per scenario; the fake
+Ollama runs in this process. Scenarios:
+
+    chat_streams     concurrent streaming /api/chat (time to first byte, whole stream)
+    rag_query        POST /api/rag/query against N stored memories, once per --rag-sizes entry
+    add_memory       POST /api/rag/add ingestion rate
+    model_discovery  cold /api/models, /api/rag/status, /api/models/tool-capable, /api/models/details
+    static           GET /, /styles.css and /app.js
+
+    python3 benchmarks/suite.py --out before.json
+    python3 benchmarks/suite.py --scenarios rag_query --rag-sizes 1000,1000000 --out big.json
+    python3 benchmarks/suite.py --compare before.json after.json
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_ollama import FakeOllama
+
+SCENARIOS = ("chat_streams", "rag_query", "add_memory", "model_discovery", "static")
+EMBED_MODEL = "nomic-embed-text:latest"
+
+
+# --- Measurement helpers (used in the scenario process) ---
+
+def summarize(latencies, wall, errors=0):
+    """Percentiles in ms and completed requests per second."""
+    ms = np.asarray(latencies, dtype=np.float64) * 1000
+    if not ms.size:
+        return {"requests": 0, "errors": errors, "p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None, "throughput_per_s": 0.0}
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "requests": int(ms.size),
+        "errors": errors,
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "throughput_per_s": round(ms.size / wall, 2) if wall > 0 else None,
+    }
+
+
+def drive(fn, count, concurrency):
+    """Calls fn(i) for i in range(count) on `concurrency` threads. Returns (latencies, wall seconds, errors)."""
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            fn(i)
+        except Exception as e:
+            with lock:
+                errors.append(e)
+            return
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, range(count)))
+    return latencies, time.perf_counter() - start, len(errors)
+
+
+def call(port, method, path, payload=None, headers=None):
+    """One request on a fresh connection; returns (status, body). Raises on a 5xx."""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+    body = json.dumps(payload).encode("utf-8") if payload is not None else None
+    conn.request(method, path, body=body, headers={"Content-Type": "application/json", **(headers or {})})
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    if response.status >= 500:
+        raise RuntimeError(f"{method} {path}: HTTP {response.status}")
+    return response.status, data
+
+
+def peak_rss_mb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+# --- Scenarios (each runs in its own process) ---
+
+def scenario_chat_streams(server, port, config):
+    ttfb = []
+    lock = threading.Lock()
+    chat = {"model": "llama3.1:8b", "stream": True, "messages": [{"role": "user", "content": "hi"}]}
+
+    def stream(i):
+        start = time.perf_counter()
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+        conn.request("POST", "/api/chat", body=json.dumps(chat).encode("utf-8"), headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        first = response.read1(65536)
+        with lock:
+            ttfb.append(time.perf_counter() - start)
+        while first:
+            first = response.read1(65536)
+        conn.close()
+
+    latencies, wall, errors = drive(stream, config["streams"] * config["rounds"], config["streams"])
+    result = summarize(latencies, wall, errors)
+    result["first_byte"] = summarize(ttfb, wall)
+    result["tokens_per_s"] = round(len(latencies) * config["tokens"] / wall, 1)
+    return result
+
+
+def scenario_rag_query(server, port, config):
+    rows, dim = config["rows"], config["dim"]
+    rng = np.random.default_rng(0)
+    conn = server.get_db_connection()
+    start = time.perf_counter()
+    for offset in range(0, rows, 50000):
+        count = min(50000, rows - offset)
+        vectors = rng.standard_normal((count, dim)).astype(np.float32)
+        with conn:
+            conn.executemany(
+                "INSERT INTO memories (content, category, embedding, embed_model, embed_dim) VALUES (?, ?, ?, ?, ?)",
+                ((f"memory {offset + i}", "General", vectors[i].tobytes(), EMBED_MODEL, dim) for i in range(count)))
+    server.MEMORY_INDEX.invalidate()
+    server.MEMORY_INDEX.ensure_loaded()
+    setup = time.perf_counter() - start
+
+    def query(i):
+        call(port, "POST", "/api/rag/query", {"query": f"benchmark question {i}", "limit": 5, "threshold": 0.0})
+
+    latencies, wall, errors = drive(query, config["queries"], config["concurrency"])
+    result = summarize(latencies, wall, errors)
+    result.update(rows=rows, dim=dim, load_seconds=round(setup, 2), index_mb=round(server.MEMORY_INDEX.snapshot()["vector_bytes"] / 1e6, 1))
+    return result
+
+
+def scenario_add_memory(server, port, config):
+    def add(i):
+        call(port, "POST", "/api/rag/add", {"content": f"benchmark memory number {i} about subject {i % 97}", "category": "Bench"})
+
+    latencies, wall, errors = drive(add, config["items"], config["concurrency"])
+    result = summarize(latencies, wall, errors)
+    result["stored"] = server.MEMORY_INDEX.size()
+    return result
+
+
+def scenario_model_discovery(server, port, config):
+    paths = ["/api/models", "/api/rag/status", "/api/models/tool-capable", "/api/models/details"]
+    latencies, wall, errors = [], 0.0, 0
+    for _ in range(config["rounds"]):
+        # Every round starts cold, as after a restart
+        server.MODEL_REGISTRY.clear()
+        server.SHARED_CALLS.clear()
+        server.CACHED_EMBED_MODEL = None
+        round_latencies, round_wall, round_errors = drive(
+            lambda i: call(port, "GET", paths[i % len(paths)]), config["clients"] * len(paths), config["clients"] * len(paths))
+        latencies += round_latencies
+        wall += round_wall
+        errors += round_errors
+    return summarize(latencies, wall, errors)
+
+
+def scenario_static(server, port, config):
+    assets = ["/", "/styles.css", "/app.js"]
+    sent = []
+    lock = threading.Lock()
+
+    def load(i):
+        _, data = call(port, "GET", assets[i % len(assets)], headers={"Accept-Encoding": "gzip, br"})
+        with lock:
+            sent.append(len(data))
+
+    latencies, wall, errors = drive(load, config["requests"], config["concurrency"])
+    result = summarize(latencies, wall, errors)
+    result["kb_per_page"] = round(sum(sent) / max(1, len(sent)) * len(assets) / 1024, 1)
+    return result
+
+
+def run_child(name, config):
+    """Scenario process: starts the threaded server against the fake Ollama and prints one JSON result."""
+    import server
+    server.OllamaHandler.log_message = lambda *a: None
+    httpd = server.make_server("threaded", host="127.0.0.1", port=0)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    started = time.perf_counter()
+    result = globals()[f"scenario_{name}"](server, httpd.server_address[1], config)
+    result["elapsed_seconds"] = round(time.perf_counter() - started, 2)
+    result["peak_rss_mb"] = peak_rss_mb()
+    httpd.shutdown()
+    httpd.server_close()
+    print(json.dumps(result))
+
+
+# --- Orchestration ---
+
+def plan(args):
+    """[(result key, scenario, config, fake settings)] for the selected scenarios."""
+    runs = []
+    fake = {"dim": args.dim, "models": args.models, "latency": args.latency, "embed_latency": args.embed_latency,
+            "token_interval": args.token_interval, "tokens": args.tokens}
+    for name in args.scenarios:
+        if name == "chat_streams":
+            runs.append((name, name, {"streams": args.streams, "rounds": args.rounds, "tokens": args.tokens}, fake))
+        elif name == "rag_query":
+            for rows in args.rag_sizes:
+                runs.append((f"rag_query_{rows}", name, {"rows": rows, "dim": args.dim, "queries": args.queries, "concurrency": args.concurrency}, fake))
+        elif name == "add_memory":
+            runs.append((name, name, {"items": args.items, "concurrency": args.concurrency}, fake))
+        elif name == "model_discovery":
+            runs.append((name, name, {"rounds": args.rounds, "clients": args.streams}, fake))
+        elif name == "static":
+            runs.append((name, name, {"requests": args.requests, "concurrency": args.concurrency}, fake))
+    return runs
+
+
+def run_scenario(key, name, config, fake_settings, workers):
+    fake = FakeOllama(**fake_settings)
+    env = dict(os.environ,
+               OLLAMA_BASE_URL=fake.start(),
+               MEMORY_DB_PATH=os.path.join(tempfile.mkdtemp(prefix="ollama-studio-bench-"), "memory.db"),
+               SERVER_WORKERS=str(workers))
+    try:
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", name, "--config", json.dumps(config)],
+                             env=env, cwd=ROOT, capture_output=True, text=True)
+    finally:
+        fake.stop()
+    if out.returncode != 0:
+        return {"error": (out.stderr.strip().splitlines() or ["failed"])[-1]}
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result["config"] = config
+    return result
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True, timeout=30)
+        return out.stdout.strip() + ("-dirty" if dirty.stdout.strip() else "") if out.returncode == 0 else None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_results(results):
+    print(f"{'scenario':>20} {'reqs':>7} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'per s':>9} {'RSS MB':>8}")
+    for key, r in results.items():
+        if "error" in r:
+            print(f"{key:>20} failed: {r['error']}")
+            continue
+        print(f"{key:>20} {r['requests']:>7} {r['errors']:>4} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} "
+              f"{r['throughput_per_s']:>9} {r['peak_rss_mb']:>8}")
+
+
+def compare(base_path, new_path):
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{base['meta'].get('commit')} -> {new['meta'].get('commit')}  (change in %, negative latency / positive throughput is better)\n")
+    metrics = ("p50_ms", "p95_ms", "p99_ms", "throughput_per_s", "peak_rss_mb")
+    print(f"{'scenario':>20} " + " ".join(f"{m:>17}" for m in metrics))
+    for key in new["scenarios"]:
+        before, after = base["scenarios"].get(key), new["scenarios"][key]
+        if not before or "error" in before or "error" in after:
+            continue
+        cells = []
+        for m in metrics:
+            a, b = before.get(m), after.get(m)
+            change = f"{(b - a) / a * 100:+.1f}%" if a and b is not None else "-"
+            cells.append(f"{b!s:>9} {change:>7}")
+        print(f"{key:>20} " + " ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="print the change between two result files")
+    parser.add_argument("--rag-sizes", type=lambda s: [int(n) for n in s.split(",")], default=[1000, 10000, 100000])
+    parser.add_argument("--dim", type=int, default=384, help="fake embedding dimension")
+    parser.add_argument("--models", type=int, default=6, help="models the fake Ollama lists")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the fake adds to every request")
+    parser.add_argument("--embed-latency", type=float, default=0.005, help="extra seconds per embedding request")
+    parser.add_argument("--tokens", type=int, default=64, help="tokens per streamed chat")
+    parser.add_argument("--token-interval", type=float, default=0.01, help="seconds between streamed tokens")
+    parser.add_argument("--streams", type=int, default=16, help="concurrent chat streams (and discovery clients)")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--config", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, json.loads(args.config))
+        return
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    workers = max(16, args.streams + args.concurrency + 4)
+    results = {}
+    for key, name, config, fake_settings in plan(args):
+        print(f"running {key} ...", flush=True)
+        results[key] = run_scenario(key, name, config, fake_settings, workers)
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("child", "config", "compare")},
+        },
+        "scenarios": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print()
+    print_results(results)
+    print(f"\nWrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,445 @@
+import argparse
+import asyncio
+import base64
+import codecs
+import copy
+import bisect
+import glob
+import gzip
+import hashlib
+import http.client
+import io
 import json
 import os
+import re
+import select
 import sqlite3
+import ssl
+import struct
+import sys
+import threading
 import numpy as np
 import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from itertools import repeat
 from http import HTTPStatus
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from urllib.error import HTTPError, URLError
 from urllib.parse import urlparse, parse_qs
-from urllib.request import Request, urlopen
 try:
     from duckduckgo_search import DDGS
 except ImportError:
     DDGS = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434").rstrip("/")
-DB_PATH = os.path.join(BASE_DIR, "memory.db")
+DB_PATH = os.environ.get("MEMORY_DB_PATH", os.path.join(BASE_DIR, "memory.db"))
+
+# Vector index used by search_memory: "exact" (brute force) or "ivf" (approximate)
+RAG_INDEX = os.environ.get("RAG_INDEX", "exact").lower()
+# Number of IVF lists; 0 picks sqrt(rows) when the index is built
+RAG_IVF_NLIST = int(os.environ.get("RAG_IVF_NLIST", "0"))
+RAG_IVF_NPROBE = int(os.environ.get("RAG_IVF_NPROBE", "8"))
+# Below this many rows the exact scan is already fast, so the IVF index is not used
+RAG_IVF_MIN_ROWS = int(os.environ.get("RAG_IVF_MIN_ROWS", "20000"))
+IVF_PATH = os.path.splitext(DB_PATH)[0] + ".ivf.npz"
+# Memory-mapped copy of the index next to memory.db (memory.<model>.<dim>.vec) for fast startup
+RAG_VECTOR_FILE = os.environ.get("RAG_VECTOR_FILE", "1") != "0"
+VECTOR_FILE_BASE = os.path.splitext(DB_PATH)[0]
+# Default /api/rag/query mode: vector | lexical | hybrid
+RAG_SEARCH_MODE = os.environ.get("RAG_SEARCH_MODE", "vector").lower()
+# Reciprocal rank fusion constant for hybrid search
+RAG_RRF_K = int(os.environ.get("RAG_RRF_K", "60"))
+# How new vectors are stored: float32 | float16 | int8 (per-row scale); int8 also keeps the index in int8
+RAG_VECTOR_ENCODING = os.environ.get("RAG_VECTOR_ENCODING", "float32").lower()
+
+# Embedding cache: entries kept in process, and whether/how many are persisted in memory.db
+EMBED_CACHE_SIZE = int(os.environ.get("EMBED_CACHE_SIZE", "2048"))
+EMBED_CACHE_PERSIST = os.environ.get("EMBED_CACHE_PERSIST", "1") != "0"
+EMBED_CACHE_MAX_ROWS = int(os.environ.get("EMBED_CACHE_MAX_ROWS", "50000"))
+# Texts per /api/embed call when embedding in bulk
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "32"))
+# Background re-embedding when the embed model or its dimension changes (0 turns it off): memories are
+# re-embedded in EMBED_BATCH_SIZE batches, RAG_REEMBED_WORKERS requests at a time, while queries keep
+# using the old model and vectors until every row has a new vector and they are swapped in at once
+RAG_REEMBED = os.environ.get("RAG_REEMBED", "1") != "0"
+RAG_REEMBED_WORKERS = int(os.environ.get("RAG_REEMBED_WORKERS", "2"))
+
+# Keep-alive connections to Ollama: idle connections kept, and connect / read timeouts in seconds.
+# The read timeout stays at 5 minutes for slower models like DeepSeek.
+OLLAMA_POOL_SIZE = int(os.environ.get("OLLAMA_POOL_SIZE", "8"))
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.environ.get("OLLAMA_READ_TIMEOUT", "300"))
+
+# Model metadata: seconds the /api/tags listing and per-model /api/show details are reused
+MODEL_TAGS_TTL = float(os.environ.get("MODEL_TAGS_TTL", "30"))
+MODEL_DETAILS_TTL = float(os.environ.get("MODEL_DETAILS_TTL", "600"))
+
+# Streaming /api/chat relay: bytes per upstream read, and an optional window (ms) to merge
+# tokens arriving close together into one downstream chunk. 0 forwards every read at once.
+CHAT_RELAY_READ_SIZE = int(os.environ.get("CHAT_RELAY_READ_SIZE", "65536"))
+CHAT_COALESCE_MS = float(os.environ.get("CHAT_COALESCE_MS", "0"))
+
+# Background memory extraction queue (POST /api/rag/extract)
+MEMORY_QUEUE_SIZE = int(os.environ.get("MEMORY_QUEUE_SIZE", "200"))
+MEMORY_QUEUE_BATCH = int(os.environ.get("MEMORY_QUEUE_BATCH", "8"))
+# Extraction only runs once no chat has been proxied for this many seconds
+MEMORY_QUEUE_IDLE_SECONDS = float(os.environ.get("MEMORY_QUEUE_IDLE_SECONDS", "3"))
+
+# Web search tool: results cached per (normalized query, max_results) for WEB_SEARCH_CACHE_TTL seconds.
+# WEB_SEARCH_MODE "fallback" tries the DDGS backends in order, "race" queries them all at once.
+# A backend that fails WEB_SEARCH_FAILURES times in a row is skipped for WEB_SEARCH_COOLDOWN seconds.
+WEB_SEARCH_BACKENDS = [b.strip() for b in os.environ.get("WEB_SEARCH_BACKENDS", "api,html,lite").split(",") if b.strip()]
+WEB_SEARCH_MODE = os.environ.get("WEB_SEARCH_MODE", "fallback").lower()
+WEB_SEARCH_CACHE_TTL = float(os.environ.get("WEB_SEARCH_CACHE_TTL", "600"))
+WEB_SEARCH_CACHE_SIZE = int(os.environ.get("WEB_SEARCH_CACHE_SIZE", "256"))
+WEB_SEARCH_FAILURES = int(os.environ.get("WEB_SEARCH_FAILURES", "2"))
+WEB_SEARCH_COOLDOWN = float(os.environ.get("WEB_SEARCH_COOLDOWN", "120"))
+
+# Static assets: Cache-Control max-age in seconds; 0 makes browsers revalidate with If-None-Match
+STATIC_MAX_AGE = int(os.environ.get("STATIC_MAX_AGE", "0"))
+
+# Document ingestion (/api/rag/ingest): chunk budget, overlap between chunks and the budget unit,
+# "tokens" (estimated: one per CJK character, one per four other characters) or "chars"
+RAG_CHUNK_SIZE = int(os.environ.get("RAG_CHUNK_SIZE", "400"))
+RAG_CHUNK_OVERLAP = int(os.environ.get("RAG_CHUNK_OVERLAP", "50"))
+RAG_CHUNK_UNIT = os.environ.get("RAG_CHUNK_UNIT", "tokens").lower()
+
+# Content-addressed attachment store (PUT /api/blobs): directory, total size kept (least recently
+# used blobs are evicted beyond it) and the largest single upload accepted, in MB
+BLOB_DIR = os.environ.get("BLOB_DIR", os.path.join(os.path.dirname(DB_PATH), "blobs"))
+BLOB_STORE_MAX_MB = float(os.environ.get("BLOB_STORE_MAX_MB", "1024"))
+BLOB_MAX_MB = float(os.environ.get("BLOB_MAX_MB", "32"))
+
+# Shared backend calls: identical concurrent requests (model listing and details, embed / tool model
+# discovery, deterministic chats) wait for one upstream call. Idempotent results are then reused for
+# RESPONSE_CACHE_TTL seconds, and non-streaming /api/chat responses that set options.seed and
+# options.temperature 0 for CHAT_CACHE_TTL seconds (0 disables either); RESPONSE_CACHE_SIZE entries are kept.
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "5"))
+CHAT_CACHE_TTL = float(os.environ.get("CHAT_CACHE_TTL", "300"))
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "256"))
+
+# Budgeted /api/chat (the "budget" request field): share of num_ctx kept for the reply when
+# options.num_predict is not set, the model writing rolling summaries (default: the chat's own),
+# and how many per-message token estimates and summaries are cached
+CONTEXT_RESERVE = float(os.environ.get("CONTEXT_RESERVE", "0.25"))
+CONTEXT_SUMMARY_MODEL = os.environ.get("CONTEXT_SUMMARY_MODEL", "")
+CONTEXT_CACHE_SIZE = int(os.environ.get("CONTEXT_CACHE_SIZE", "4096"))
+
+# Optional per-request timing log (one JSON object per line): a file path, or "-" for stdout
+REQUEST_TIMING_LOG = os.environ.get("REQUEST_TIMING_LOG", "")
+
+# How run() serves requests: "single" (one at a time), "threaded" (bounded worker pool) or "asyncio"
+SERVER_MODE = os.environ.get("SERVER_MODE", "threaded").lower()
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", "16"))
+# Seconds the threaded accept loop waits for a free worker before answering 503
+SERVER_QUEUE_TIMEOUT = float(os.environ.get("SERVER_QUEUE_TIMEOUT", "30"))
+
+# --- Metrics ---
+
+class Metrics:
+    """
+    Counters, gauges and latency histograms exposed at /metrics in the
+    Prometheus text format. Series are keyed by name and label values;
+    gauges mirroring state kept elsewhere (index rows, queue depth, pool
+    usage) are read through callbacks at scrape time. While a request is in
+    progress on a thread, every observed duration is also summed into that
+    request's timing record, which is written to REQUEST_TIMING_LOG.
+    """
+
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+    MAX_ROUTES = 64
+
+    def __init__(self, log_path=""):
+        self.lock = threading.Lock()
+        self.kinds = {}  # name -> (type, help)
+        self.values = {}  # (name, labels) -> value, for counters and gauges
+        self.histograms = {}  # (name, labels) -> [count per bucket..., +Inf count, sum]
+        self.callbacks = {}  # name -> fn returning a value or {labels: value}
+        self.routes = set()
+        self.local = threading.local()
+        self.log_path = log_path
+        self.log_lock = threading.Lock()
+        self.log_file = None
+
+    def define(self, name, kind, help_text, callback=None):
+        self.kinds[name] = (kind, help_text)
+        if callback is not None:
+            self.callbacks[name] = callback
+
+    @staticmethod
+    def _labels(labels):
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def route(self, path):
+        """Label for a request path: API paths as-is (up to MAX_ROUTES of them), everything else "static"."""
+        path = re.sub(r"/[0-9a-f]{64}$", "/:hash", urlparse(path).path)
+        if not path.startswith("/api/") and path != "/metrics":
+            return "static"
+        with self.lock:
+            if path in self.routes or len(self.routes) < self.MAX_ROUTES:
+                self.routes.add(path)
+                return path
+        return "other"
+
+    def inc(self, name, value=1, **labels):
+        key = (name, self._labels(labels))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[(name, self._labels(labels))] = value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, self._labels(labels))
+        index = bisect.bisect_left(self.BUCKETS, seconds)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(self.BUCKETS) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += seconds
+        stages = getattr(self.local, "stages", None)
+        if stages is not None:
+            stage = ".".join([name.removeprefix("ollama_studio_").removesuffix("_seconds"), *map(str, labels.values())])
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def begin_request(self):
+        self.local.stages = {}
+
+    def end_request(self, record):
+        """Closes the thread's timing record and writes it, with its stages, to the timing log."""
+        stages = getattr(self.local, "stages", None) or {}
+        self.local.stages = None
+        self.log_request(record, stages)
+
+    def log_request(self, record, stages):
+        if not self.log_path:
+            return
+        record["stages"] = {stage: round(seconds, 6) for stage, seconds in stages.items()}
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.log_lock:
+            try:
+                if self.log_path == "-":
+                    sys.stdout.write(line)
+                    sys.stdout.flush()
+                    return
+                if self.log_file is None:
+                    self.log_file = open(self.log_path, "a", encoding="utf-8", buffering=1)
+                self.log_file.write(line)
+            except OSError as e:
+                print(f"Error writing timing log: {e}")
+
+    def collect(self, fn, *args):
+        """Runs fn on this thread with its own timing record; returns (result, stages)."""
+        self.begin_request()
+        try:
+            return fn(*args), self.local.stages
+        finally:
+            self.local.stages = None
+
+    def merge_stages(self, stages):
+        current = getattr(self.local, "stages", None)
+        if current is not None:
+            for stage, seconds in stages.items():
+                current[stage] = current.get(stage, 0.0) + seconds
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self):
+        series = {}
+        for name, callback in list(self.callbacks.items()):
+            try:
+                value = callback()
+            except Exception as e:
+                print(f"Error reading metric {name}: {e}")
+                continue
+            items = value.items() if isinstance(value, dict) else [((), value)]
+            series[name] = [(self._labels(dict(labels)), v) for labels, v in items]
+        with self.lock:
+            for (name, labels), value in self.values.items():
+                series.setdefault(name, []).append((labels, value))
+            histograms = {key: list(value) for key, value in self.histograms.items()}
+        for (name, labels), histogram in histograms.items():
+            series.setdefault(name, []).append((labels, histogram))
+
+        lines = []
+        for name in sorted(set(series) | set(self.kinds)):
+            kind, help_text = self.kinds.get(name, ("untyped", ""))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(series.get(name, []), key=lambda item: item[0]):
+                if kind != "histogram":
+                    lines.append(f"{name}{self._format_labels(labels)} {float(value):g}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.BUCKETS + (float("inf"),), value[:-1]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f"{name}_bucket{self._format_labels(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {value[-1]:.6f}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics(REQUEST_TIMING_LOG)
+METRICS.define("ollama_studio_http_requests_total", "counter", "HTTP requests handled, by method, route and status.")
+METRICS.define("ollama_studio_http_request_seconds", "histogram", "Time to handle an HTTP request, by method and route.")
+METRICS.define("ollama_studio_http_requests_in_flight", "gauge", "HTTP requests currently being handled.")
+METRICS.define("ollama_studio_http_rejected_total", "counter", "Connections answered with 503 because every worker stayed busy for SERVER_QUEUE_TIMEOUT.")
+METRICS.define("ollama_studio_chat_first_byte_seconds", "histogram", "Time from receiving a streaming /api/chat request to relaying the first upstream bytes.")
+METRICS.define("ollama_studio_chat_relayed_bytes_total", "counter", "Bytes of streamed /api/chat responses relayed from Ollama.")
+METRICS.define("ollama_studio_chat_relay_fallbacks_total", "counter", "Streamed /api/chat requests the asyncio relay handed to a worker thread because preparing them failed.")
+METRICS.define("ollama_studio_ollama_request_seconds", "histogram", "Ollama API calls, until the response body is read (headers only for streams).")
+METRICS.define("ollama_studio_ollama_requests_total", "counter", "Ollama API calls, by path and status.")
+METRICS.define("ollama_studio_embedding_seconds", "histogram", "Embedding lookups, by source (cache or ollama).")
+METRICS.define("ollama_studio_rag_search_seconds", "histogram", "search_memory calls, by mode.")
+METRICS.define("ollama_studio_rag_stage_seconds", "histogram", "search_memory stages: filter, embed, vector, lexical and fetch of the matched rows.")
+METRICS.define("ollama_studio_web_search_seconds", "histogram", "Web searches, by outcome (cached, ok or error).")
+
+# --- Shared backend calls ---
+
+class SharedCalls:
+    """
+    Single-flight layer with a short-TTL result cache for idempotent backend
+    calls. A caller asking for a key that is already being computed waits
+    for that call and gets the same result (or exception) instead of issuing
+    its own; results that `keep` accepts are then reused for `ttl` seconds.
+    Keys are tuples whose first element names the kind of call, and hit
+    rates are reported per kind.
+    """
+
+    def __init__(self, size=256):
+        self.lock = threading.Lock()
+        self.size = size
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.flights = {}  # key -> {"done": Event, "value": ..., "error": ...}
+        self.stats = {}  # kind -> counters
+
+    def _counters(self, kind):
+        counters = self.stats.get(kind)
+        if counters is None:
+            counters = self.stats[kind] = {"hits": 0, "shared": 0, "calls": 0, "errors": 0, "evictions": 0}
+        return counters
+
+    def call(self, key, fn, ttl=0.0, keep=None):
+        """Returns (value, source), where source is "hit", "shared" or "miss" (this caller ran fn)."""
+        with self.lock:
+            counters = self._counters(key[0])
+            entry = self.entries.get(key)
+            if entry is not None:
+                if time.monotonic() < entry[0]:
+                    self.entries.move_to_end(key)
+                    counters["hits"] += 1
+                    return entry[1], "hit"
+                del self.entries[key]
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = {"done": threading.Event(), "value": None, "error": None}
+                counters["calls"] += 1
+                leader = True
+            else:
+                counters["shared"] += 1
+                leader = False
+
+        if not leader:
+            flight["done"].wait()
+            if flight["error"] is not None:
+                raise flight["error"]
+            return flight["value"], "shared"
+
+        try:
+            flight["value"] = fn()
+        except BaseException as e:
+            flight["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+                if flight["error"] is not None:
+                    counters["errors"] += 1
+                elif ttl > 0 and self.size > 0 and (keep is None or keep(flight["value"])):
+                    self.entries[key] = (time.monotonic() + ttl, flight["value"])
+                    self.entries.move_to_end(key)
+                    while len(self.entries) > self.size:
+                        evicted, _ = self.entries.popitem(last=False)
+                        self._counters(evicted[0])["evictions"] += 1
+            flight["done"].set()
+        return flight["value"], "miss"
+
+    def forget(self, kind):
+        """Drops cached results of one kind; calls in flight are unaffected."""
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == kind]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def snapshot(self):
+        with self.lock:
+            kinds = {kind: dict(counters) for kind, counters in self.stats.items()}
+            entries = len(self.entries)
+            in_flight = len(self.flights)
+        for counters in kinds.values():
+            lookups = counters["hits"] + counters["shared"] + counters["calls"]
+            # Both cache hits and callers that joined an in-flight call avoided an upstream request
+            counters["hit_rate"] = (counters["hits"] + counters["shared"]) / lookups if lookups else 0.0
+        return {"entries": entries, "in_flight": in_flight, "kinds": kinds}
+
+
+SHARED_CALLS = SharedCalls(RESPONSE_CACHE_SIZE)
 
 # --- Database & RAG Setup ---
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
+_db_local = threading.local()
+
+def get_db_connection():
+    """
+    Returns this thread's long-lived connection to memory.db. Connections
+    run in WAL mode so readers never block the writer, and are reused for
+    the life of the worker thread instead of being reopened per operation.
+    Callers commit through `with conn:` and must not close it.
+    """
+    conn = getattr(_db_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=5)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-20000")
+        conn.execute("PRAGMA mmap_size=268435456")
+        _db_local.conn = conn
+    return conn
+
+def _table_columns(conn, table):
+    return {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+def _migrate_memories_table(conn):
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS memories (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             content TEXT NOT NULL,
@@ -31,101 +448,577 @@ def init_db():
             created_at TEXT DEFAULT (datetime('now', 'localtime'))
         )
     ''')
-    
-    # Check if category column exists (migration)
+    # Databases from before categories existed
+    if "category" not in _table_columns(conn, "memories"):
+        conn.execute("ALTER TABLE memories ADD COLUMN category TEXT DEFAULT 'General'")
+
+def _migrate_embedding_cache(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            model TEXT NOT NULL,
+            text_hash TEXT NOT NULL,
+            embedding BLOB NOT NULL,
+            last_used REAL NOT NULL,
+            PRIMARY KEY (model, text_hash)
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache (last_used)")
+
+def _migrate_memories_v2(conn):
+    # Record which model produced each vector; rows from before this stay NULL (unknown model)
+    columns = _table_columns(conn, "memories")
+    if "embed_model" not in columns:
+        conn.execute("ALTER TABLE memories ADD COLUMN embed_model TEXT")
+    if "embed_dim" not in columns:
+        conn.execute("ALTER TABLE memories ADD COLUMN embed_dim INTEGER")
+    conn.execute("UPDATE memories SET embed_dim = length(embedding) / 4 WHERE embed_dim IS NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_memories_created_at ON memories (created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_memories_category ON memories (category)")
+
+def _migrate_memories_fts(conn):
+    # External-content FTS5 index over memories.content, kept in sync by triggers.
+    # The trigram tokenizer matches substrings, so identifiers and CJK text without
+    # word breaks are searchable; query terms need at least three characters.
     try:
-        c.execute("SELECT category FROM memories LIMIT 1")
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts USING fts5(content, content='memories', content_rowid='id', tokenize='trigram')")
     except sqlite3.OperationalError:
-        print("Migrating database: adding category column")
-        c.execute("ALTER TABLE memories ADD COLUMN category TEXT DEFAULT 'General'")
-        
-    conn.commit()
-    conn.close()
+        # SQLite built without FTS5; fts_available() tries again at every startup
+        return
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS memories_fts_insert AFTER INSERT ON memories BEGIN
+            INSERT INTO memories_fts (rowid, content) VALUES (new.id, new.content);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS memories_fts_delete AFTER DELETE ON memories BEGIN
+            INSERT INTO memories_fts (memories_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS memories_fts_update AFTER UPDATE OF content ON memories BEGIN
+            INSERT INTO memories_fts (memories_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO memories_fts (rowid, content) VALUES (new.id, new.content);
+        END
+    ''')
+    conn.execute("INSERT INTO memories_fts (memories_fts) VALUES ('rebuild')")
+
+def _migrate_vector_encoding(conn):
+    # NULL encoding means float32, which is what every row before this was
+    columns = _table_columns(conn, "memories")
+    if "embed_encoding" not in columns:
+        conn.execute("ALTER TABLE memories ADD COLUMN embed_encoding TEXT")
+    if "embed_scale" not in columns:
+        conn.execute("ALTER TABLE memories ADD COLUMN embed_scale REAL")
+
+def _migrate_vector_sync(conn):
+    # Bumped by every write that changes stored vectors. The .vec sidecar files record
+    # the value they were last synced at, so a mismatch at startup means a rebuild.
+    conn.execute("CREATE TABLE IF NOT EXISTS vector_sync (id INTEGER PRIMARY KEY CHECK (id = 1), changes INTEGER NOT NULL)")
+    conn.execute("INSERT OR IGNORE INTO vector_sync (id, changes) VALUES (1, 0)")
+    for name, event in (("insert", "INSERT"), ("delete", "DELETE"), ("update", "UPDATE OF embedding, embed_model")):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS memories_vector_sync_{name} AFTER {event} ON memories BEGIN
+                UPDATE vector_sync SET changes = changes + 1 WHERE id = 1;
+            END
+        ''')
+
+def _migrate_memory_jobs(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS memory_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            model TEXT NOT NULL,
+            user_text TEXT NOT NULL,
+            assistant_text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            result TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_memory_jobs_status ON memory_jobs (status, id)")
+
+def _migrate_documents(conn):
+    # Ingested documents are stored as memories, one row per chunk, tied back to the document
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS documents (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            content_hash TEXT,
+            size INTEGER NOT NULL DEFAULT 0,
+            chunks INTEGER NOT NULL DEFAULT 0,
+            chunk_size INTEGER,
+            chunk_overlap INTEGER,
+            chunk_unit TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    columns = _table_columns(conn, "memories")
+    for column, kind in (("doc_id", "TEXT"), ("chunk_index", "INTEGER"), ("start_offset", "INTEGER"), ("end_offset", "INTEGER"), ("chunk_hash", "TEXT")):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE memories ADD COLUMN {column} {kind}")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_memories_doc ON memories (doc_id, chunk_index)")
+
+def _migrate_reembed(conn):
+    # Vectors from a new embed model wait in reembed_vectors until every memory has one; a row whose
+    # content changes or that is deleted meanwhile loses its staged vector and is embedded again
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS reembed_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_model TEXT,
+            source_dim INTEGER,
+            target_model TEXT NOT NULL,
+            target_dim INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            total INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            finished_at REAL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS reembed_vectors (
+            job_id INTEGER NOT NULL,
+            memory_id INTEGER NOT NULL,
+            embedding BLOB NOT NULL,
+            embed_dim INTEGER NOT NULL,
+            embed_encoding TEXT,
+            embed_scale REAL,
+            PRIMARY KEY (job_id, memory_id)
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reembed_vectors_memory ON reembed_vectors (memory_id)")
+    for name, event in (("delete", "DELETE"), ("update", "UPDATE OF content")):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS memories_reembed_{name} AFTER {event} ON memories BEGIN
+                DELETE FROM reembed_vectors WHERE memory_id = old.id;
+            END
+        ''')
+
+def _migrate_memory_listing(conn):
+    # Keyset pagination walks (created_at, id) newest first, so every row needs a created_at;
+    # a category filter gets its own (category, created_at) order
+    conn.execute("UPDATE memories SET created_at = datetime('now', 'localtime') WHERE created_at IS NULL")
+    conn.execute("UPDATE memories SET category = 'General' WHERE category IS NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_memories_category_created_at ON memories (category, created_at)")
+
+def _migrate_reembed_failures(conn):
+    # Failed re-embedding attempts per memory; a row that keeps failing is given up on so the job can finish.
+    # Editing the content gives it a fresh start, like a staged vector
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS reembed_failures (
+            job_id INTEGER NOT NULL,
+            memory_id INTEGER NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            PRIMARY KEY (job_id, memory_id)
+        )
+    ''')
+    for name, event in (("delete", "DELETE"), ("update", "UPDATE OF content")):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS memories_reembed_failures_{name} AFTER {event} ON memories BEGIN
+                DELETE FROM reembed_failures WHERE memory_id = old.id;
+            END
+        ''')
+
+# Applied in order; PRAGMA user_version records how many have run
+SCHEMA_MIGRATIONS = [
+    _migrate_memories_table,
+    _migrate_embedding_cache,
+    _migrate_memories_v2,
+    _migrate_memories_fts,
+    _migrate_vector_encoding,
+    _migrate_vector_sync,
+    _migrate_memory_jobs,
+    _migrate_documents,
+    _migrate_reembed,
+    _migrate_memory_listing,
+    _migrate_reembed_failures,
+]
+
+def init_db():
+    conn = get_db_connection()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number in range(version + 1, len(SCHEMA_MIGRATIONS) + 1):
+        if version:
+            print(f"Migrating database to schema version {number}")
+        conn.execute("BEGIN")
+        try:
+            SCHEMA_MIGRATIONS[number - 1](conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
 
 init_db()
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+def fts_available():
+    """
+    Whether the memories_fts index exists. A database migrated while SQLite
+    lacked FTS5 gets the index (built from the stored memories) at the first
+    startup where FTS5 is available.
+    """
+    conn = get_db_connection()
+    exists = "SELECT 1 FROM sqlite_master WHERE name = 'memories_fts'"
+    if conn.execute(exists).fetchone() is None:
+        conn.execute("BEGIN")
+        try:
+            _migrate_memories_fts(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    if conn.execute(exists).fetchone() is None:
+        print("FTS5 unavailable, lexical search disabled")
+        return False
+    return True
 
-def get_embedding(text, model):
-    url = f"{OLLAMA_BASE_URL}/api/embeddings"
+FTS_ENABLED = fts_available()
+
+def fetch_embedding(text, model):
     payload = {"model": model, "prompt": text}
-    headers = {"Content-Type": "application/json"}
-    
-    req = Request(url, data=json.dumps(payload).encode("utf-8"), method="POST", headers=headers)
     try:
-        with urlopen(req, timeout=300) as response:
-            if response.status == 200:
-                data = json.loads(response.read().decode("utf-8"))
-                return data.get("embedding")
+        status, data, _ = fetch_ollama("/api/embeddings", method="POST", body=json.dumps(payload).encode("utf-8"))
+        if status == 200:
+            return json.loads(data.decode("utf-8")).get("embedding")
+        print(f"Error getting embedding: HTTP {status}")
     except Exception as e:
         print(f"Error getting embedding: {e}")
     return None
 
-# Global cache for embed model
-CACHED_EMBED_MODEL = None
-
-def get_model_details(model_name):
+def fetch_embeddings(texts, model):
+    """Embeds several texts with one /api/embed call, falling back to /api/embeddings per text on older Ollama."""
+    payload = {"model": model, "input": texts}
     try:
-        status, data, _ = fetch_ollama("/api/show", method="POST", body=json.dumps({"name": model_name}).encode("utf-8"))
+        status, data, _ = fetch_ollama("/api/embed", method="POST", body=json.dumps(payload).encode("utf-8"))
         if status == 200:
-            return json.loads(data.decode("utf-8"))
+            embeddings = json.loads(data.decode("utf-8")).get("embeddings") or []
+            if len(embeddings) == len(texts):
+                return embeddings
+        elif status != HTTPStatus.NOT_FOUND:
+            print(f"Error getting embeddings: HTTP {status}")
+            return [None] * len(texts)
     except Exception as e:
-        print(f"Error getting model details for {model_name}: {e}")
+        print(f"Error getting embeddings: {e}")
+        return [None] * len(texts)
+    return [fetch_embedding(text, model) for text in texts]
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache keyed by (model, sha256(text)).
+    An in-process LRU sits in front of an optional embedding_cache table in
+    memory.db, so a string is only sent to Ollama once per embed model.
+    """
+
+    def __init__(self, size, persist, max_rows):
+        self.lock = threading.Lock()
+        self.size = size
+        self.persist = persist
+        self.max_rows = max_rows
+        self.entries = OrderedDict()
+        self.inserts_since_trim = 0
+        self.stats = {"hits": 0, "persistent_hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def key(text, model):
+        return model, hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vec):
+        self.entries[key] = vec
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def get(self, text, model):
+        return self.get_many([text], model)[0]
+
+    def get_many(self, texts, model):
+        keys = [self.key(text, model) for text in texts]
+        vectors = [None] * len(keys)
+        with self.lock:
+            for i, key in enumerate(keys):
+                vec = self.entries.get(key)
+                if vec is not None:
+                    self.entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    vectors[i] = vec
+        missing = [i for i, vec in enumerate(vectors) if vec is None]
+        if missing and self.persist:
+            try:
+                conn = get_db_connection()
+                now = time.time()
+                with conn:
+                    c = conn.cursor()
+                    for i in missing:
+                        c.execute("SELECT embedding FROM embedding_cache WHERE model = ? AND text_hash = ?", keys[i])
+                        row = c.fetchone()
+                        if row is not None:
+                            c.execute("UPDATE embedding_cache SET last_used = ? WHERE model = ? AND text_hash = ?", (now, *keys[i]))
+                            vectors[i] = np.frombuffer(row["embedding"], dtype=np.float32).tolist()
+            except Exception as e:
+                print(f"Error reading embedding cache: {e}")
+        with self.lock:
+            for i in missing:
+                if vectors[i] is not None:
+                    self._remember(keys[i], vectors[i])
+                    self.stats["persistent_hits"] += 1
+                else:
+                    self.stats["misses"] += 1
+        return vectors
+
+    def put(self, text, model, vec):
+        self.put_many([text], model, [vec])
+
+    def put_many(self, texts, model, vectors):
+        keys = [self.key(text, model) for text in texts]
+        with self.lock:
+            for key, vec in zip(keys, vectors):
+                self._remember(key, vec)
+            self.inserts_since_trim += len(keys)
+            trim = self.inserts_since_trim >= 100
+            if trim:
+                self.inserts_since_trim = 0
+        if not self.persist:
+            return
+        try:
+            conn = get_db_connection()
+            now = time.time()
+            with conn:
+                c = conn.cursor()
+                c.executemany("INSERT OR REPLACE INTO embedding_cache (model, text_hash, embedding, last_used) VALUES (?, ?, ?, ?)",
+                              [(*key, np.array(vec, dtype=np.float32).tobytes(), now) for key, vec in zip(keys, vectors)])
+                if trim:
+                    # Drop the least recently used rows beyond the configured cap
+                    c.execute("DELETE FROM embedding_cache WHERE rowid IN (SELECT rowid FROM embedding_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                              (self.max_rows,))
+                    with self.lock:
+                        self.stats["evictions"] += c.rowcount
+        except Exception as e:
+            print(f"Error writing embedding cache: {e}")
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self.entries)
+        lookups = stats["hits"] + stats["persistent_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["persistent_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+EMBEDDING_CACHE = EmbeddingCache(EMBED_CACHE_SIZE, EMBED_CACHE_PERSIST, EMBED_CACHE_MAX_ROWS)
+
+def get_embedding(text, model):
+    started = time.perf_counter()
+    vec = EMBEDDING_CACHE.get(text, model)
+    if vec is not None:
+        METRICS.observe("ollama_studio_embedding_seconds", time.perf_counter() - started, source="cache")
+        return vec
+    with METRICS.timer("ollama_studio_embedding_seconds", source="ollama"):
+        vec = fetch_embedding(text, model)
+        if vec:
+            EMBEDDING_CACHE.put(text, model, vec)
+    return vec
+
+def get_embeddings(texts, model):
+    """Batched get_embedding: only cache misses are sent to Ollama, in one request."""
+    vectors = EMBEDDING_CACHE.get_many(texts, model)
+    missing = [i for i, vec in enumerate(vectors) if vec is None]
+    if missing:
+        with METRICS.timer("ollama_studio_embedding_seconds", source="ollama"):
+            fetched = fetch_embeddings([texts[i] for i in missing], model)
+        stored = [i for i, vec in zip(missing, fetched) if vec]
+        for i, vec in zip(missing, fetched):
+            if vec:
+                vectors[i] = vec
+        if stored:
+            EMBEDDING_CACHE.put_many([texts[i] for i in stored], model, [vectors[i] for i in stored])
+    return vectors
+
+# Global cache for embed model, and when the choice was last checked against the stored vectors
+CACHED_EMBED_MODEL = None
+EMBED_MODEL_CHECKED_AT = 0.0
+
+class ModelRegistry:
+    """
+    Cached view of the models Ollama has pulled. The /api/tags listing is
+    reused for MODEL_TAGS_TTL seconds; /api/show details are fetched for many
+    models concurrently and kept until the model's digest or modified_at
+    changes in /api/tags, or MODEL_DETAILS_TTL expires.
+    """
+
+    def __init__(self, tags_ttl, details_ttl, workers=8):
+        self.lock = threading.Lock()
+        self.tags_ttl = tags_ttl
+        self.details_ttl = details_ttl
+        self.workers = workers
+        self.tags = None
+        self.tags_at = 0.0
+        self.details = {}  # name -> (version, fetched_at, details)
+
+    @staticmethod
+    def _version(model):
+        return model.get("digest"), model.get("modified_at")
+
+    def list_tags(self, force=False):
+        """Returns (status, models, error_body); models is the /api/tags list when status is 200."""
+        with self.lock:
+            if not force and self.tags is not None and time.time() - self.tags_at < self.tags_ttl:
+                return HTTPStatus.OK, self.tags, None
+        (status, data, _), _ = SHARED_CALLS.call(("tags",), lambda: fetch_ollama("/api/tags"))
+        if status != 200:
+            return status, None, data
+        try:
+            models = [m for m in json.loads(data.decode("utf-8")).get("models", []) if m.get("name")]
+        except (json.JSONDecodeError, AttributeError):
+            return HTTPStatus.BAD_GATEWAY, None, data
+        with self.lock:
+            self.tags = models
+            self.tags_at = time.time()
+            versions = {m["name"]: self._version(m) for m in models}
+            # Forget details of models that were removed or re-pulled
+            for name in [n for n, entry in self.details.items() if entry[0] != versions.get(n)]:
+                del self.details[name]
+        return HTTPStatus.OK, models, None
+
+    def version(self, name):
+        """(digest, modified_at) of a pulled model from the cached listing, or None."""
+        with self.lock:
+            return next((self._version(m) for m in self.tags or [] if m["name"] == name), None)
+
+    def model_names(self):
+        status, models, _ = self.list_tags()
+        return [m["name"] for m in models] if status == HTTPStatus.OK else []
+
+    def _fetch_details(self, name):
+        try:
+            body = json.dumps({"name": name}).encode("utf-8")
+            (status, data, _), _ = SHARED_CALLS.call(("show", name), lambda: fetch_ollama("/api/show", method="POST", body=body))
+            if status == 200:
+                return json.loads(data.decode("utf-8"))
+        except Exception as e:
+            print(f"Error getting model details for {name}: {e}")
+        return None
+
+    def get_many(self, names):
+        """Returns {name: details or None}, fetching uncached models in parallel."""
+        now = time.time()
+        result = {}
+        missing = []
+        with self.lock:
+            versions = {m["name"]: self._version(m) for m in (self.tags or [])}
+            for name in names:
+                entry = self.details.get(name)
+                if entry and entry[0] == versions.get(name) and now - entry[1] < self.details_ttl:
+                    result[name] = entry[2]
+                else:
+                    missing.append(name)
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(missing))) as pool:
+                fetched = list(pool.map(self._fetch_details, missing))
+            with self.lock:
+                for name, details in zip(missing, fetched):
+                    if details is not None:
+                        self.details[name] = (versions.get(name), time.time(), details)
+                    result[name] = details
+        return result
+
+    def get(self, name):
+        return self.get_many([name]).get(name)
+
+    def all_details(self):
+        """Returns [(name, details)] for every pulled model, in /api/tags order."""
+        names = self.model_names()
+        details = self.get_many(names)
+        return [(name, details.get(name)) for name in names]
+
+    def clear(self):
+        with self.lock:
+            self.tags = None
+            self.details = {}
+
+
+MODEL_REGISTRY = ModelRegistry(MODEL_TAGS_TTL, MODEL_DETAILS_TTL)
+
+def get_model_details(model_name):
+    return MODEL_REGISTRY.get(model_name)
+
+def model_is_embedding(details):
+    model_info = details.get("model_info", {})
+    families = model_info.get("families", [])
+    if "bert" in families or "nomic-bert" in families:
+        return True
+    # 'capabilities' is reported at the top level by newer Ollama versions
+    return "embedding" in details.get("capabilities", [])
+
+def model_has_tool_template(details):
+    template = details.get("template", "")
+    return "{{ .Tools }}" in template or "{{.Tools}}" in template
+
+def model_context_length(details):
+    for key, value in details.get("model_info", {}).items():
+        if key.endswith(".context_length"):
+            return value
     return None
 
+def describe_models():
+    """Per-model capability summary served by /api/models/details."""
+    described = []
+    for name, details in MODEL_REGISTRY.all_details():
+        if details is None:
+            described.append({"name": name})
+            continue
+        described.append({
+            "name": name,
+            "tools": model_has_tool_template(details) or "tools" in details.get("capabilities", []),
+            "embedding": model_is_embedding(details),
+            "context_length": model_context_length(details),
+            "family": details.get("details", {}).get("family"),
+            "parameter_size": details.get("details", {}).get("parameter_size")
+        })
+    return described
+
 def find_best_embed_model():
     try:
-        status, data, _ = fetch_ollama("/api/tags")
-        if status == 200:
-            payload = json.loads(data.decode("utf-8"))
-            models = [m.get("name") for m in payload.get("models", [])]
-            
-            # 1. Check for models with specific embedding families or capabilities
-            for m in models:
-                details = get_model_details(m)
-                if details:
-                    # Check model_info for families
-                    model_info = details.get("model_info", {})
-                    families = model_info.get("families", [])
-                    if "bert" in families or "nomic-bert" in families:
-                        return m
-                    
-                    # Check capabilities (if available in newer Ollama versions)
-                    # Note: 'capabilities' field might be at top level or inside details depending on version
-                    # My curl check showed it at top level
-                    capabilities = details.get("capabilities", []) 
-                    if "embedding" in capabilities:
-                        return m
-            
-            # 2. Fallback to name matching
-            priorities = ["nomic-embed-text", "mxbai-embed-large", "all-minilm", "snowflake-arctic-embed"]
-            for p in priorities:
-                for m in models:
-                    if p in m:
-                        return m
-            
+        models = MODEL_REGISTRY.model_names()
+        
+        # 1. Check for models with specific embedding families or capabilities
+        for m, details in MODEL_REGISTRY.all_details():
+            if details and model_is_embedding(details):
+                return m
+        
+        # 2. Fallback to name matching
+        priorities = ["nomic-embed-text", "mxbai-embed-large", "all-minilm", "snowflake-arctic-embed"]
+        for p in priorities:
             for m in models:
-                if "embed" in m or "embedding" in m:
+                if p in m:
                     return m
-            
-            # 3. Last resort: use the first available model (not ideal but works)
-            if models:
-                return models[0]
+        
+        for m in models:
+            if "embed" in m or "embedding" in m:
+                return m
+        
+        # 3. Last resort: use the first available model (not ideal but works)
+        if models:
+            return models[0]
     except Exception as e:
         print(f"Error finding embed model: {e}")
     return None
 
 def get_embed_model():
-    global CACHED_EMBED_MODEL
-    if CACHED_EMBED_MODEL:
+    global CACHED_EMBED_MODEL, EMBED_MODEL_CHECKED_AT
+    # With re-embedding on, a newly pulled embed model is noticed when the model list is next refreshed
+    if CACHED_EMBED_MODEL and not (RAG_REEMBED and time.time() - EMBED_MODEL_CHECKED_AT > MODEL_TAGS_TTL):
         return CACHED_EMBED_MODEL
     
-    model = find_best_embed_model()
+    # Concurrent cold lookups share one scan of the model list
+    model, _ = SHARED_CALLS.call(("embed_model",), lambda: REEMBED.resolve(find_best_embed_model()))
     if model:
         CACHED_EMBED_MODEL = model
+        EMBED_MODEL_CHECKED_AT = time.time()
     return model
 
 # --- Model Capabilities Logic ---
@@ -136,12 +1029,11 @@ def find_best_tool_model():
     Prioritizes known good models.
     """
     try:
-        status, data, _ = fetch_ollama("/api/tags")
-        if status != 200:
+        models = MODEL_REGISTRY.model_names()
+        if not models:
             return None
-            
-        payload = json.loads(data.decode("utf-8"))
-        models = [m.get("name") for m in payload.get("models", [])]
+        # Details for every model come from one parallel, cached fetch
+        details_by_name = dict(MODEL_REGISTRY.all_details())
         
         # Priority list of known tool-supporting models
         # Llama 3.1, Mistral, Qwen 2.5, Gemma 2 (some versions), Firefunction
@@ -154,14 +1046,10 @@ def find_best_tool_model():
         for p in priorities:
             for m in models:
                 if p in m.lower():
-                    # Double check details to be safe? 
-                    # For performance, we assume these known families support tools if they are recent versions.
-                    # But ideally we should check model details.
-                    details = get_model_details(m)
+                    details = details_by_name.get(m)
                     if details:
                          # Check template for tool definitions
-                         template = details.get("template", "")
-                         if "{{ .Tools }}" in template or "{{.Tools}}" in template or "<tool>" in template:
+                         if model_has_tool_template(details) or "<tool>" in details.get("template", ""):
                              return m
                          # Fallback: if it's llama3.1, it definitely supports tools
                          if "llama3.1" in m:
@@ -169,11 +1057,9 @@ def find_best_tool_model():
         
         # 2. General scan of all models
         for m in models:
-            details = get_model_details(m)
-            if details:
-                template = details.get("template", "")
-                if "{{ .Tools }}" in template or "{{.Tools}}" in template:
-                    return m
+            details = details_by_name.get(m)
+            if details and model_has_tool_template(details):
+                return m
                     
     except Exception as e:
         print(f"Error finding tool model: {e}")
@@ -191,120 +1077,1172 @@ def cosine_similarity(v1, v2):
     
     return np.dot(v1, v2) / (norm1 * norm2)
 
-def search_memory(query_text, limit=5, threshold=0.35):
-    model = get_embed_model()
-    if not model:
-        return []
-    
-    query_vec = get_embedding(query_text, model)
-    if not query_vec:
-        return []
-    
-    query_vec = np.array(query_vec)
-    
-    try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("SELECT id, content, embedding, created_at FROM memories")
-        rows = c.fetchall()
-        conn.close()
-        
-        results = []
-        for row in rows:
-            try:
-                vec_bytes = row["embedding"]
-                vec = np.frombuffer(vec_bytes, dtype=np.float32)
-                score = cosine_similarity(query_vec, vec)
-                if score >= threshold:
-                    results.append({
-                        "id": row["id"],
-                        "content": row["content"],
-                        "score": float(score),
-                        "created_at": row["created_at"]
-                    })
-            except Exception as e:
-                print(f"Error processing memory row {row.get('id', 'unknown')}: {e}")
-                continue
-        
-        results.sort(key=lambda x: x["score"], reverse=True)
-        return results[:limit]
-    except Exception as e:
-        print(f"Error searching memories: {e}")
-        return []
+def _top_hits(ids, scores, limit, threshold):
+    hits = np.flatnonzero(scores >= threshold)
+    if hits.size > limit:
+        hits = hits[np.argpartition(-scores[hits], limit - 1)[:limit]]
+    # Highest score first; ties keep insertion (id) order like the old row scan
+    hits = hits[np.lexsort((ids[hits], -scores[hits]))]
+    return [(int(ids[i]), float(scores[i])) for i in hits]
 
-def add_memory(content, category="General"):
-    # Validate content
-    if not content or not content.strip():
-        print("Skipping empty memory content")
-        return False
-    
-    content = content.strip()
-    category = category.strip() if category else "General"
-    
-    if len(content) < 10:
-        print("Skipping too short memory content")
-        return False
-    
-    model = get_embed_model()
-    if not model:
-        print("No embedding model available")
-        return False
-    
-    # Check for duplicates using vector similarity
-    # Use a high threshold (e.g., 0.9) to detect near-duplicates
-    existing = search_memory(content, limit=1, threshold=0.9)
-    if existing:
-        print(f"Skipping duplicate memory (score: {existing[0]['score']:.2f})")
-        return False
-    
-    vec = get_embedding(content, model)
-    if not vec:
-        print("Failed to generate embedding")
-        return False
-    
-    vec_bytes = np.array(vec, dtype=np.float32).tobytes()
-    
-    try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("INSERT INTO memories (content, category, embedding) VALUES (?, ?, ?)", (content, category, vec_bytes))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Error adding memory to database: {e}")
-        return False
+VECTOR_ENCODINGS = ("float32", "float16", "int8")
 
-def clear_all_memories():
-    try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("DELETE FROM memories")
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Error clearing memories: {e}")
-        return False
+if RAG_VECTOR_ENCODING not in VECTOR_ENCODINGS:
+    print(f"Unknown RAG_VECTOR_ENCODING {RAG_VECTOR_ENCODING!r}, using float32")
+    RAG_VECTOR_ENCODING = "float32"
 
-def delete_memory(memory_id):
-    try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("DELETE FROM memories WHERE id = ?", (memory_id,))
-        conn.commit()
-        deleted = c.rowcount > 0
-        conn.close()
-        return deleted
-    except Exception as e:
-        print(f"Error deleting memory: {e}")
-        return False
+def encode_vector(vec, encoding=None):
+    """Returns (blob, scale) for the embedding / embed_scale columns. int8 stores round(v / scale) with scale = max|v| / 127."""
+    encoding = encoding or RAG_VECTOR_ENCODING
+    vec = np.asarray(vec, dtype=np.float32).ravel()
+    if encoding == "float16":
+        return vec.astype(np.float16).tobytes(), None
+    if encoding == "int8":
+        peak = float(np.abs(vec).max()) if vec.size else 0.0
+        scale = peak / 127 if peak else 1.0
+        return np.round(vec / scale).astype(np.int8).tobytes(), scale
+    return vec.tobytes(), None
 
-def update_memory(memory_id, content):
-    # Validate content
-    if not content or not content.strip():
-        print("Cannot update with empty content")
-        return False
+def decode_vector(blob, encoding=None, scale=None):
+    if encoding == "float16":
+        return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+    if encoding == "int8":
+        return np.frombuffer(blob, dtype=np.int8).astype(np.float32) * np.float32(scale or 1.0)
+    return np.frombuffer(blob, dtype=np.float32)
+
+def vector_columns(vec, model):
+    """Values for (embedding, embed_model, embed_dim, embed_encoding, embed_scale) of a new or updated row."""
+    blob, scale = encode_vector(vec)
+    return blob, model, len(vec), RAG_VECTOR_ENCODING, scale
+
+def _nearest_centroid(vectors, centroids, batch=4096):
+    assign = np.empty(vectors.shape[0], dtype=np.int32)
+    for start in range(0, vectors.shape[0], batch):
+        assign[start:start + batch] = (vectors[start:start + batch] @ centroids.T).argmax(axis=1)
+    return assign
+
+def train_ivf_centroids(vectors, nlist, iterations=10, seed=0):
+    """Spherical k-means over a sample of normalized vectors."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(vectors.shape[0], nlist * 32)
+    sample = vectors[rng.choice(vectors.shape[0], sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _nearest_centroid(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # Reseed empty lists with random sample points
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+class IVFIndex:
+    """
+    IVF-flat approximate index: vectors are bucketed by their nearest k-means
+    centroid and a query only scores the buckets of its nprobe closest
+    centroids. Vectors themselves stay in MemoryIndex; lists only hold ids.
+    """
+
+    def __init__(self, centroids, model=None):
+        self.centroids = centroids
+        self.key = (model, centroids.shape[1])
+        self.lists = [set() for _ in range(centroids.shape[0])]
+        self.assignment = {}  # memory id -> list number
+        self.trained_size = 0
+        self.changes = 0
+
+    def add(self, memory_id, vec):
+        self.discard(memory_id)
+        list_no = int((self.centroids @ vec).argmax())
+        self.lists[list_no].add(memory_id)
+        self.assignment[memory_id] = list_no
+        self.changes += 1
+
+    def add_many(self, ids, vectors):
+        for memory_id, list_no in zip(ids.tolist(), _nearest_centroid(vectors, self.centroids).tolist()):
+            self.discard(memory_id)
+            self.lists[list_no].add(memory_id)
+            self.assignment[memory_id] = list_no
+
+    def discard(self, memory_id):
+        list_no = self.assignment.pop(memory_id, None)
+        if list_no is not None:
+            self.lists[list_no].discard(memory_id)
+            self.changes += 1
+
+    def probe(self, query, nprobe):
+        scores = self.centroids @ query
+        nprobe = min(nprobe, scores.shape[0])
+        chosen = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        candidates = []
+        for list_no in chosen:
+            candidates.extend(self.lists[list_no])
+        return candidates
+
+    def save(self, path):
+        ids = np.fromiter(self.assignment.keys(), dtype=np.int64, count=len(self.assignment))
+        lists = np.fromiter(self.assignment.values(), dtype=np.int32, count=len(self.assignment))
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, centroids=self.centroids, ids=ids, lists=lists, trained_size=self.trained_size, model=self.key[0] or "")
+        os.replace(tmp_path, path)
+        self.changes = 0
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            model = str(data["model"]) if "model" in data.files else ""
+            index = cls(data["centroids"].astype(np.float32), model=model or None)
+            for memory_id, list_no in zip(data["ids"].tolist(), data["lists"].tolist()):
+                index.lists[list_no].add(memory_id)
+                index.assignment[memory_id] = list_no
+            index.trained_size = int(data["trained_size"])
+        return index
+
+
+class VectorBlock:
+    """
+    Rows of one (embed model, dimension) group in arrival order, as
+    L2-normalized float32 or as int8 with a per-row scale. Deleting a row
+    leaves a tombstone (id -1) in place until compact() drops them.
+    """
+
+    SCORE_CHUNK = 4096
+
+    def __init__(self, key, encoding, capacity=16):
+        self.key = key
+        self.encoding = encoding
+        self.count = 0
+        self.dead = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        dtype = np.int8 if self.encoding == "int8" else np.float32
+        ids = np.empty(capacity, dtype=np.int64)
+        matrix = np.empty((capacity, self.key[1]), dtype=dtype)
+        scales = np.ones(capacity, dtype=np.float32)
+        n = self.count
+        if n:
+            ids[:n], matrix[:n], scales[:n] = self.ids[:n], self.matrix[:n], self.scales[:n]
+        self.ids, self.matrix, self.scales = ids, matrix, scales
+
+    def _grow(self):
+        self._allocate(self.ids.shape[0] * 2)
+
+    @property
+    def live(self):
+        return self.count - self.dead
+
+    def append(self, memory_id, vec):
+        if self.count == self.ids.shape[0]:
+            self._grow()
+        row = self.count
+        self.ids[row] = memory_id
+        self.put(row, vec)
+        self.count = row + 1
+        return row
+
+    def put(self, row, vec):
+        if self.encoding == "int8":
+            peak = float(np.abs(vec).max()) if vec.size else 0.0
+            scale = peak / 127 if peak else 1.0
+            self.matrix[row] = np.round(vec / scale)
+            self.scales[row] = scale
+        else:
+            self.matrix[row] = vec
+
+    def kill(self, row):
+        self.ids[row] = -1
+        self.dead += 1
+
+    def live_rows(self):
+        return np.flatnonzero(self.ids[:self.count] >= 0)
+
+    def rows(self, rows):
+        """Decoded float32 copies of the given rows (a slice or index array)."""
+        if self.encoding == "int8":
+            return self.matrix[rows].astype(np.float32) * self.scales[rows][:, None]
+        return self.matrix[rows]
+
+    def score(self, rows, query):
+        if self.encoding != "int8":
+            return self.matrix[rows] @ query
+        matrix, scales = self.matrix[rows], self.scales[rows]
+        scores = np.empty(matrix.shape[0], dtype=np.float32)
+        for start in range(0, matrix.shape[0], self.SCORE_CHUNK):
+            scores[start:start + self.SCORE_CHUNK] = matrix[start:start + self.SCORE_CHUNK].astype(np.float32) @ query
+        return scores * scales
+
+    def needs_compaction(self):
+        return self.dead > max(1024, self.count // 4)
+
+    def compact(self):
+        """Drops tombstoned rows. Returns the live ids in their new row order."""
+        live = self.live_rows()
+        ids, matrix, scales = self.ids[live], self.matrix[live], self.scales[live]
+        self.count = self.dead = 0
+        self._allocate(max(16, live.size))
+        n = live.size
+        self.ids[:n], self.matrix[:n], self.scales[:n] = ids, matrix, scales
+        self.count = n
+        return ids
+
+    def sync(self, changes):
+        pass
+
+    def close(self):
+        pass
+
+    def delete(self):
+        pass
+
+
+class VectorFile(VectorBlock):
+    """
+    VectorBlock kept in a memory-mapped sidecar next to memory.db, so startup
+    maps vectors instead of deserializing every BLOB. Layout: a 4 KiB header
+    (magic, dimension, dtype, model, SQLite change counter, row count), then
+    fixed-size records (id, scale, vector). Rows are appended by extending
+    and remapping the file; deletes write a tombstone id in place.
+    """
+
+    MAGIC = b"OSVEC001"
+    HEADER = struct.Struct("<8sIIIqq")  # magic, dim, dtype code, model length, changes, count
+    HEADER_SIZE = 4096
+    DTYPE_CODES = {"float32": 0, "int8": 1}
+
+    def __init__(self, path, key, encoding, changes=0, count=None):
+        self.path = path
+        self.key = key
+        self.encoding = encoding
+        self.changes = changes
+        self.record = np.dtype([("id", "<i8"), ("scale", "<f4"), ("pad", "<u4"),
+                                ("vec", "<i1" if encoding == "int8" else "<f4", (key[1],))])
+        if count is None:
+            with open(path, "wb") as f:
+                f.write(b"\0" * self.HEADER_SIZE)
+            self.count = 0
+            self._map(16)
+            self._write_header()
+        else:
+            self.count = count
+            self._map((os.path.getsize(path) - self.HEADER_SIZE) // self.record.itemsize)
+            if self.count > self.ids.shape[0]:
+                raise ValueError("row count exceeds file size")
+        self.dead = self.count - int(np.count_nonzero(self.ids[:self.count] >= 0))
+
+    @classmethod
+    def open(cls, path):
+        with open(path, "rb") as f:
+            header = f.read(cls.HEADER_SIZE)
+        if len(header) < cls.HEADER_SIZE:
+            raise ValueError("truncated header")
+        magic, dim, dtype_code, model_length, changes, count = cls.HEADER.unpack_from(header)
+        if magic != cls.MAGIC:
+            raise ValueError("not a vector file")
+        encoding = {code: name for name, code in cls.DTYPE_CODES.items()}.get(dtype_code)
+        if encoding is None:
+            raise ValueError(f"unknown dtype code {dtype_code}")
+        model = header[cls.HEADER.size:cls.HEADER.size + model_length].decode("utf-8") if model_length else None
+        return cls(path, (model, dim), encoding, changes=changes, count=count)
+
+    def _map(self, capacity):
+        size = self.HEADER_SIZE + capacity * self.record.itemsize
+        if os.path.getsize(self.path) < size:
+            with open(self.path, "r+b") as f:
+                f.truncate(size)
+        self.header = np.memmap(self.path, dtype=np.uint8, mode="r+", shape=(self.HEADER_SIZE,))
+        self.records = np.memmap(self.path, dtype=self.record, mode="r+", offset=self.HEADER_SIZE, shape=(capacity,))
+        self.ids, self.scales, self.matrix = self.records["id"], self.records["scale"], self.records["vec"]
+
+    def _write_header(self):
+        model = (self.key[0] or "").encode("utf-8")
+        self.HEADER.pack_into(self.header, 0, self.MAGIC, self.key[1], self.DTYPE_CODES[self.encoding],
+                              len(model), self.changes, self.count)
+        self.header[self.HEADER.size:self.HEADER.size + len(model)] = np.frombuffer(model, dtype=np.uint8)
+
+    def _grow(self):
+        # Extending the file and mapping it again copies nothing
+        capacity = self.ids.shape[0]
+        self._map(capacity + max(1024, capacity // 2))
+
+    def sync(self, changes):
+        """Records that the file now reflects SQLite up to the given change counter."""
+        self.changes = changes
+        self._write_header()
+
+    def compact(self):
+        live = self.live_rows()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"\0" * self.HEADER_SIZE)
+            for start in range(0, live.size, 65536):
+                f.write(self.records[live[start:start + 65536]].tobytes())
+        self.close()
+        os.replace(tmp_path, self.path)
+        self.count, self.dead = int(live.size), 0
+        self._map(max(16, self.count))
+        self._write_header()
+        return self.ids[:self.count].copy()
+
+    def close(self):
+        if getattr(self, "records", None) is not None:
+            self.header.flush()
+            self.records.flush()
+        self.header = self.records = self.ids = self.scales = self.matrix = None
+
+    def delete(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class MemoryIndex:
+    """
+    Resident copy of every stored embedding, kept L2-normalized in float32,
+    or as int8 with a per-row scale when the encoding is int8 (a quarter of
+    the memory, scored in cache-sized float32 chunks). float16 storage is
+    decoded to float32 here, as numpy has no fast float16 matrix product.
+    Rows are grouped into VectorBlocks by (embed model, dimension) so a
+    query is only scored against vectors from the same model. Rows stored
+    before the model was recorded have model None and match any model of
+    their dimension. Loaded lazily on first use and kept in sync by
+    add_memory / update_memory / delete_memory / clear_all_memories.
+    With RAG_VECTOR_FILE each block lives in a memory-mapped .vec file that
+    is mapped at load time and rebuilt from SQLite when it falls out of sync.
+    With RAG_INDEX=ivf an IVFIndex over the largest block is used for large
+    stores; exact scoring remains the fallback while it is being built.
+    """
+
+    def __init__(self, encoding=None, vector_file=None):
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.encoding = "int8" if (encoding or RAG_VECTOR_ENCODING) == "int8" else "float32"
+        # Sidecar path prefix ("<prefix>.<model>.<dim>.vec"), or None to keep blocks in RAM only
+        if vector_file is None:
+            vector_file = VECTOR_FILE_BASE if RAG_VECTOR_FILE else None
+        self.vector_base = vector_file or None
+        self.blocks = {}  # (model, dim) -> VectorBlock
+        self.offsets = {}  # memory id -> ((model, dim), row)
+        self.ivf = None
+        self.ivf_building = False
+        self.load_source = None  # "vector_file" | "sqlite" once loaded
+        self.load_seconds = None
+        self.generation = 0  # bumped by every write, so cached filter results know they are stale
+        self.filters = OrderedDict()  # (conditions, params) -> (generation, sorted ids)
+
+    def _normalize(self, vec):
+        vec = np.asarray(vec, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vec)
+        if norm == 0:
+            # Zero vectors score 0 against everything, same as cosine_similarity
+            return vec
+        return vec / norm
+
+    def _vector_path(self, key):
+        model, dim = key
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "-", model or "unknown")
+        digest = hashlib.sha1((model or "").encode("utf-8")).hexdigest()[:8]
+        return f"{self.vector_base}.{slug}-{digest}.{dim}.vec"
+
+    def _block(self, key):
+        block = self.blocks.get(key)
+        if block is None:
+            if self.vector_base:
+                block = VectorFile(self._vector_path(key), key, self.encoding)
+            else:
+                block = VectorBlock(key, self.encoding)
+            self.blocks[key] = block
+        return block
+
+    def _append(self, memory_id, vec, model):
+        key = (model, vec.shape[0])
+        row = self._block(key).append(memory_id, vec)
+        self.offsets[memory_id] = (key, row)
+        if self.ivf is not None and self.ivf.key == key:
+            self.ivf.add(memory_id, vec)
+
+    def _remove(self, memory_id):
+        location = self.offsets.pop(memory_id, None)
+        if location is None:
+            return
+        key, row = location
+        if self.ivf is not None:
+            self.ivf.discard(memory_id)
+        block = self.blocks[key]
+        block.kill(row)
+        if block.needs_compaction():
+            self._compact(key)
+
+    def _compact(self, key):
+        ids = self.blocks[key].compact()
+        self.offsets.update(zip(ids.tolist(), zip(repeat(key), range(ids.shape[0]))))
+
+    def _sync_files(self):
+        if self.vector_base:
+            changes = get_db_connection().execute("SELECT changes FROM vector_sync").fetchone()[0]
+            for block in self.blocks.values():
+                block.sync(changes)
+
+    def ensure_loaded(self):
+        with self.lock:
+            if self.loaded:
+                return
+            self.blocks = {}
+            self.offsets = {}
+            started = time.perf_counter()
+            if self.vector_base and self._map_vector_files():
+                self.load_source = "vector_file"
+            else:
+                self._load_from_sqlite()
+                self.load_source = "sqlite"
+            self.load_seconds = round(time.perf_counter() - started, 3)
+            self.loaded = True
+            if RAG_INDEX == "ivf":
+                self._load_ivf()
+
+    def _load_from_sqlite(self):
+        c = get_db_connection().cursor()
+        c.execute("SELECT id, embedding, embed_model, embed_encoding, embed_scale FROM memories ORDER BY id")
+        for row in c:
+            vec = decode_vector(row["embedding"], row["embed_encoding"], row["embed_scale"])
+            if vec.size:
+                self._append(row["id"], self._normalize(vec), row["embed_model"])
+        self._sync_files()
+
+    def _map_vector_files(self):
+        """
+        Maps the .vec files when they agree with SQLite: same change counter,
+        same encoding and as many live rows as memories. Otherwise removes them
+        and returns False so the index is rebuilt from SQLite.
+        """
+        conn = get_db_connection()
+        changes = conn.execute("SELECT changes FROM vector_sync").fetchone()[0]
+        total = conn.execute("SELECT COUNT(*) FROM memories").fetchone()[0]
+        paths = glob.glob(glob.escape(self.vector_base) + ".*.vec")
+        blocks = {}
+        consistent = True
+        for path in paths:
+            try:
+                block = VectorFile.open(path)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable vector file {path}: {e}")
+                consistent = False
+                continue
+            blocks[block.key] = block
+            if block.changes != changes or block.encoding != self.encoding or block.key[1] == 0:
+                consistent = False
+        if consistent and sum(block.live for block in blocks.values()) != total:
+            consistent = False
+        if not consistent:
+            if paths:
+                print("Vector files are out of sync with memory.db, rebuilding from SQLite")
+            for block in blocks.values():
+                block.close()
+            for path in paths:
+                os.remove(path)
+            return False
+        for key, block in blocks.items():
+            if block.needs_compaction():
+                block.compact()
+            live = block.live_rows()
+            self.offsets.update(zip(block.ids[live].tolist(), zip(repeat(key), live.tolist())))
+        self.blocks = blocks
+        return True
+
+    def _load_ivf(self):
+        if not os.path.exists(IVF_PATH):
+            return
+        try:
+            ivf = IVFIndex.load(IVF_PATH)
+        except Exception as e:
+            print(f"Ignoring unreadable IVF index: {e}")
+            return
+        block = self.blocks.get(ivf.key)
+        if block is None:
+            return
+        # Reconcile with SQLite: drop ids that are gone, assign ids added since the last save
+        rows = block.live_rows()
+        live = block.ids[rows]
+        live_set = set(live.tolist())
+        for memory_id in [i for i in ivf.assignment if i not in live_set]:
+            ivf.discard(memory_id)
+        missing = np.array([i not in ivf.assignment for i in live.tolist()], dtype=bool)
+        if missing.any():
+            ivf.add_many(live[missing], block.rows(rows[missing]))
+        self.ivf = ivf
+
+    def build_ivf(self, nlist=None):
+        """Trains IVF centroids on the largest block and assigns every row. Returns the index."""
+        self.ensure_loaded()
+        with self.lock:
+            if not self.blocks:
+                return None
+            key = max(self.blocks, key=lambda k: self.blocks[k].live)
+            rows = self.blocks[key].live_rows()
+            vectors = np.array(self.blocks[key].rows(rows), dtype=np.float32)
+        n = rows.size
+        if not n:
+            return None
+        nlist = nlist or RAG_IVF_NLIST or max(1, int(np.sqrt(n)))
+        ivf = IVFIndex(train_ivf_centroids(vectors, min(nlist, n)), model=key[0])
+        ivf.trained_size = n
+        with self.lock:
+            # Rows may have changed while training; assign from the current state
+            block = self.blocks.get(key)
+            if block is not None:
+                rows = block.live_rows()
+                ivf.add_many(block.ids[rows], block.rows(rows))
+            ivf.changes = 0
+            self.ivf = ivf
+        try:
+            ivf.save(IVF_PATH)
+        except Exception as e:
+            print(f"Error saving IVF index: {e}")
+        return ivf
+
+    def _build_ivf_in_background(self):
+        def worker():
+            try:
+                self.build_ivf()
+            except Exception as e:
+                print(f"Error building IVF index: {e}")
+            finally:
+                self.ivf_building = False
+
+        self.ivf_building = True
+        threading.Thread(target=worker, daemon=True).start()
+
+    def _ivf_for(self, key, count):
+        """Returns the IVF index to use for a query, scheduling (re)builds when needed."""
+        if RAG_INDEX != "ivf" or count < RAG_IVF_MIN_ROWS:
+            return None
+        ivf = self.ivf
+        stale = ivf is None or ivf.key != key or count > 4 * max(ivf.trained_size, 1)
+        if stale and not self.ivf_building:
+            self._build_ivf_in_background()
+        if ivf is None or ivf.key != key:
+            return None
+        if ivf.changes >= 1000:
+            try:
+                ivf.save(IVF_PATH)
+            except Exception as e:
+                print(f"Error saving IVF index: {e}")
+        return ivf
+
+    def upsert(self, memory_id, vec, model=None):
+        self.upsert_many([(memory_id, vec, model)])
+
+    def upsert_many(self, items):
+        """Adds or replaces (memory id, vector, model) items, syncing the .vec files once at the end."""
+        with self.lock:
+            self.generation += 1
+            if not self.loaded:
+                return
+            for memory_id, vec, model in items:
+                memory_id = int(memory_id)
+                vec = self._normalize(vec)
+                location = self.offsets.get(memory_id)
+                if location and location[0] == (model, vec.shape[0]):
+                    self.blocks[location[0]].put(location[1], vec)
+                    if self.ivf is not None and self.ivf.key == location[0]:
+                        self.ivf.add(memory_id, vec)
+                else:
+                    self._remove(memory_id)
+                    self._append(memory_id, vec, model)
+            self._sync_files()
+
+    def remove(self, memory_id):
+        with self.lock:
+            self.generation += 1
+            if self.loaded:
+                self._remove(int(memory_id))
+                self._sync_files()
+
+    def remove_many(self, memory_ids):
+        with self.lock:
+            self.generation += 1
+            if self.loaded:
+                for memory_id in memory_ids:
+                    self._remove(int(memory_id))
+                self._sync_files()
+
+    def vectors(self, memory_ids):
+        """float32 copies of the normalized vectors of the given ids, which must all be indexed."""
+        with self.lock:
+            return np.array([self.blocks[key].rows(np.array([row]))[0] for key, row in map(self.offsets.__getitem__, memory_ids)],
+                            dtype=np.float32)
+
+    def live_vectors(self, key):
+        """(ids, float32 copies of the normalized vectors) of one block's live rows."""
+        with self.lock:
+            block = self.blocks.get(key)
+            if block is None:
+                return np.empty(0, dtype=np.int64), np.empty((0, key[1]), dtype=np.float32)
+            rows = block.live_rows()
+            return block.ids[rows].copy(), np.array(block.rows(rows), dtype=np.float32)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            for block in self.blocks.values():
+                block.delete()
+            self.blocks = {}
+            self.offsets = {}
+            if self.ivf is not None:
+                self.ivf = IVFIndex(self.ivf.centroids, model=self.ivf.key[0])
+
+    def compact(self):
+        """Drops tombstoned rows from every block. Returns how many were reclaimed."""
+        self.ensure_loaded()
+        with self.lock:
+            reclaimed = 0
+            for key, block in list(self.blocks.items()):
+                if block.dead:
+                    reclaimed += block.dead
+                    self._compact(key)
+            self._sync_files()
+            return reclaimed
+
+    def verify(self):
+        """
+        Compares every indexed id, model and dimension with SQLite. Returns a
+        list of differences; empty means the index matches the database.
+        """
+        self.ensure_loaded()
+        with self.lock:
+            indexed = dict(self.offsets)
+            rows = get_db_connection().execute("SELECT id, embed_model, embed_dim FROM memories").fetchall()
+        problems = []
+        for row in rows:
+            location = indexed.pop(row["id"], None)
+            if location is None:
+                problems.append(f"memory {row['id']} is missing from the index")
+            elif row["embed_dim"] is not None and location[0] != (row["embed_model"], row["embed_dim"]):
+                problems.append(f"memory {row['id']} is indexed as {location[0]}, stored as {(row['embed_model'], row['embed_dim'])}")
+        problems.extend(f"memory {memory_id} is indexed but not stored" for memory_id in indexed)
+        return problems
+
+    def rebuild(self):
+        """Discards the loaded index and its .vec files and reloads everything from SQLite."""
+        with self.lock:
+            self.generation += 1
+            for block in self.blocks.values():
+                block.delete()
+            if self.vector_base:
+                for path in glob.glob(glob.escape(self.vector_base) + ".*.vec"):
+                    os.remove(path)
+            self.loaded = False
+            self.ivf = None
+            self.ensure_loaded()
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            for block in self.blocks.values():
+                block.close()
+            self.loaded = False
+            self.blocks = {}
+            self.offsets = {}
+            self.ivf = None
+
+    def size(self):
+        with self.lock:
+            return len(self.offsets)
+
+    def filtered_ids(self, conditions, params, keep=32):
+        """
+        Sorted ids of the memories matching memory_filters conditions. The
+        result is reused until the next write, so repeated searches with one
+        filter read SQLite once.
+        """
+        key = (tuple(conditions), tuple(params))
+        with self.lock:
+            generation = self.generation
+            cached = self.filters.get(key)
+            if cached is not None and cached[0] == generation:
+                self.filters.move_to_end(key)
+                return cached[1]
+        rows = get_db_connection().execute(f"SELECT id FROM memories WHERE {' AND '.join(conditions)} ORDER BY id", params)
+        ids = np.fromiter((row[0] for row in rows), dtype=np.int64)
+        with self.lock:
+            self.filters[key] = (generation, ids)
+            self.filters.move_to_end(key)
+            while len(self.filters) > keep:
+                self.filters.popitem(last=False)
+        return ids
+
+    def key_counts(self):
+        """Live rows per (embed model, dimension), or None while the index is not loaded."""
+        # Checked before taking the lock, which is held for the whole initial load
+        if not self.loaded:
+            return None
+        with self.lock:
+            return {key: block.live for key, block in self.blocks.items() if block.live}
+
+    def snapshot(self):
+        with self.lock:
+            used = sum(block.count * (block.matrix.itemsize * key[1] + 12) for key, block in self.blocks.items())
+            return {
+                "rows": len(self.offsets),
+                "tombstones": sum(block.dead for block in self.blocks.values()),
+                "encoding": self.encoding,
+                "vector_bytes": used,
+                "vector_files": [block.path for block in self.blocks.values() if isinstance(block, VectorFile)],
+                "loaded_from": self.load_source,
+                "load_seconds": self.load_seconds
+            }
+
+    def _matching_keys(self, model, dim):
+        # model None (benchmarks, legacy callers) compares against every block of the dimension
+        return [key for key, block in self.blocks.items()
+                if key[1] == dim and block.live and (model is None or key[0] in (model, None))]
+
+    def _filtered_rows(self, key, block, ids):
+        """Rows of `block` holding any of the given memory ids."""
+        if ids.size * 8 < block.count:
+            rows = [location[1] for location in map(self.offsets.get, ids.tolist()) if location and location[0] == key]
+            return np.array(rows, dtype=np.int64)
+        return np.flatnonzero(np.isin(block.ids[:block.count], ids))
+
+    def search(self, query_vec, limit=5, threshold=0.35, exact=False, model=None, ids=None):
+        """
+        Returns [(memory_id, score)] best first, using one matrix-vector
+        product per block. With `ids`, only those memories are scored (exactly).
+        The rows to score are picked under the lock; the scoring itself runs
+        outside it, so concurrent queries do not wait for each other.
+        """
+        self.ensure_loaded()
+        query = self._normalize(query_vec)
+        if ids is not None:
+            ids = np.unique(np.asarray(ids, dtype=np.int64))
+        with self.lock:
+            keys = self._matching_keys(model, query.shape[0])
+            if not keys or limit <= 0:
+                return []
+            work = []  # (block snapshot, rows to score or None for all, their ids)
+            for key in keys:
+                block = self.blocks[key]
+                ivf = None if exact or ids is not None or len(keys) > 1 else self._ivf_for(key, block.live)
+                if ids is not None:
+                    rows = self._filtered_rows(key, block, ids)
+                elif ivf is not None:
+                    candidates = ivf.probe(query, RAG_IVF_NPROBE)
+                    if not candidates:
+                        return []
+                    rows = np.fromiter((self.offsets[i][1] for i in candidates), dtype=np.int64, count=len(candidates))
+                else:
+                    rows = None
+                # A shallow copy keeps the block's current arrays: growing, compacting or closing
+                # it swaps in new ones, and the old ones (or mappings) live on until scored
+                block_ids = block.ids[:block.count].copy() if rows is None else block.ids[rows]
+                work.append((copy.copy(block), rows, block_ids))
+        all_ids, all_scores = [], []
+        for block, rows, block_ids in work:
+            if rows is None:
+                scores = block.score(slice(0, block_ids.shape[0]), query)
+                if block.dead:
+                    scores[block_ids < 0] = -np.inf
+            else:
+                scores = block.score(rows, query)
+            all_ids.append(block_ids)
+            all_scores.append(scores)
+        hit_ids = all_ids[0] if len(all_ids) == 1 else np.concatenate(all_ids)
+        scores = all_scores[0] if len(all_scores) == 1 else np.concatenate(all_scores)
+        return _top_hits(hit_ids, scores, limit, threshold)
+
+
+MEMORY_INDEX = MemoryIndex()
+
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+
+_CJK = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+
+def lexical_terms(query_text, max_terms=32):
+    """
+    Splits a query into FTS5 trigram terms. Identifier-like runs (hostnames,
+    error codes, package names) are kept whole; CJK runs, which have no word
+    breaks, are split into overlapping three-character windows. Terms shorter
+    than three characters cannot match a trigram index and are dropped.
+    """
+    terms = []
+    for run in re.findall(r"[\w.\-:/@]+", query_text):
+        run = run.strip(".-:/@")
+        if _CJK.search(run) and len(run) > 3:
+            terms.extend(run[i:i + 3] for i in range(len(run) - 2))
+        elif len(run) >= 3:
+            terms.append(run)
+    return list(dict.fromkeys(terms))[:max_terms]
+
+def lexical_hits(query_text, limit, where=None):
+    """
+    BM25-ranked [(id, score)] from the FTS5 index. bm25() values are not
+    comparable across queries (they shrink toward zero on small stores), so
+    the reported score is the fraction of query terms the memory contains.
+    `where` is (conditions, params) from memory_filters, checked in the same query.
+    """
+    terms = lexical_terms(query_text)
+    if not FTS_ENABLED or not terms:
+        return []
+    match = " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+    with METRICS.timer("ollama_studio_rag_stage_seconds", stage="lexical"):
+        if where:
+            conditions, params = where
+            rows = get_db_connection().execute(
+                "SELECT memories_fts.rowid AS rowid, memories_fts.content AS content FROM memories_fts "
+                f"JOIN memories ON memories.id = memories_fts.rowid WHERE memories_fts MATCH ? AND {' AND '.join(conditions)} "
+                "ORDER BY bm25(memories_fts) LIMIT ?",
+                (match, *params, int(limit))
+            ).fetchall()
+        else:
+            rows = get_db_connection().execute(
+                "SELECT rowid, content FROM memories_fts WHERE memories_fts MATCH ? ORDER BY bm25(memories_fts) LIMIT ?",
+                (match, int(limit))
+            ).fetchall()
+    lowered = [term.lower() for term in terms]
+    hits = []
+    for row in rows:
+        content = row["content"].lower()
+        hits.append((row["rowid"], sum(term in content for term in lowered) / len(lowered)))
+    return hits
+
+def vector_hits(query_text, limit, threshold, where=None):
+    ids = None
+    if where:
+        with METRICS.timer("ollama_studio_rag_stage_seconds", stage="filter"):
+            ids = filtered_memory_ids(*where)
+        if not ids.size:
+            return []
+    model = get_embed_model()
+    if not model:
+        return []
+    with METRICS.timer("ollama_studio_rag_stage_seconds", stage="embed"):
+        query_vec = get_embedding(query_text, model)
+    if not query_vec:
+        return []
+    with METRICS.timer("ollama_studio_rag_stage_seconds", stage="vector"):
+        return MEMORY_INDEX.search(query_vec, limit=int(limit), threshold=float(threshold), model=model, ids=ids)
+
+def fuse_hits(ranked_lists, limit, k=None):
+    """Reciprocal rank fusion: each list contributes 1 / (k + rank) for every id it ranks."""
+    k = RAG_RRF_K if k is None else k
+    fused = {}
+    for hits in ranked_lists:
+        for rank, (memory_id, _) in enumerate(hits, start=1):
+            fused[memory_id] = fused.get(memory_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+def search_memory(query_text, limit=5, threshold=0.35, mode=None, category=None, since=None, until=None):
+    """
+    Retrieves memories for a query. mode is "vector" (embedding similarity,
+    filtered by threshold), "lexical" (FTS5 BM25, no embedding call) or
+    "hybrid" (both lists fused by reciprocal rank; falls back to lexical
+    alone when no embedding model is available). category, since and until
+    (see memory_filters) select the memories to score before any scoring.
+    """
+    mode = mode or RAG_SEARCH_MODE
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"mode must be one of {', '.join(SEARCH_MODES)}")
+    conditions, params = memory_filters(category, since, until)
+    with METRICS.timer("ollama_studio_rag_search_seconds", mode=mode):
+        return _search_memory(query_text, int(limit), threshold, mode, (conditions, params) if conditions else None)
+
+def _search_memory(query_text, limit, threshold, mode, where=None):
+    try:
+        if mode == "vector":
+            hits = vector_hits(query_text, limit, threshold, where)
+            scores = {"vector_score": dict(hits)}
+        elif mode == "lexical":
+            hits = lexical_hits(query_text, limit, where)
+            scores = {"lexical_score": dict(hits)}
+        else:
+            # Fuse the two top-`limit` lists; deeper lists let weak matches that happen to
+            # appear in both outrank a strong match found by only one of them.
+            # Lexical goes first so exact matches win ties.
+            vector = vector_hits(query_text, limit, threshold, where)
+            lexical = lexical_hits(query_text, limit, where)
+            # Scaled so ranking first in both lists scores 1.0, the top of the other modes' range
+            best = 2.0 / (RAG_RRF_K + 1)
+            hits = [(memory_id, score / best) for memory_id, score in fuse_hits([lexical, vector], limit)]
+            scores = {"vector_score": dict(vector), "lexical_score": dict(lexical)}
+        if not hits:
+            return []
+        
+        with METRICS.timer("ollama_studio_rag_stage_seconds", stage="fetch"):
+            c = get_db_connection().cursor()
+            placeholders = ",".join("?" for _ in hits)
+            c.execute(f"SELECT id, content, created_at FROM memories WHERE id IN ({placeholders})", [memory_id for memory_id, _ in hits])
+            rows = {row["id"]: row for row in c.fetchall()}
+        
+        results = []
+        for memory_id, score in hits:
+            row = rows.get(memory_id)
+            if row is None:
+                continue
+            result = {
+                "id": row["id"],
+                "content": row["content"],
+                "score": score,
+                "created_at": row["created_at"]
+            }
+            if mode == "hybrid":
+                for name, values in scores.items():
+                    if memory_id in values:
+                        result[name] = values[memory_id]
+            results.append(result)
+        return results
+    except Exception as e:
+        print(f"Error searching memories: {e}")
+        return []
+
+# Same wording the frontend uses when it injects memories itself
+RAG_CONTEXT_HEADER = "[系统提示：检索到以下相关历史记忆，请优先基于这些信息回答]"
+
+def format_rag_context(results):
+    memories = "\n\n".join(f"[记忆{i + 1}] (关联度: {r['score'] * 100:.0f}%)\n{r['content']}" for i, r in enumerate(results))
+    return f"{RAG_CONTEXT_HEADER}\n{memories}\n[记忆结束]\n"
+
+def apply_chat_rag(body_json):
+    """
+    Server-side retrieval for /api/chat. When the request carries a "rag"
+    field (true or {"limit", "threshold", "query", "mode", "category", "since",
+    "until"}), the memories matching
+    the query (default: the last user message) are inserted as a system
+    message after the leading system prompts. The field is removed before
+    the request goes to Ollama. Returns the results, or None when not asked.
+    """
+    options = body_json.pop("rag", None)
+    if not options:
+        return None
+    if not isinstance(options, dict):
+        options = {}
+    messages = body_json.get("messages") or []
+    query = options.get("query")
+    if not query:
+        for message in reversed(messages):
+            if message.get("role") == "user" and isinstance(message.get("content"), str):
+                query = message["content"]
+                break
+    if not query or not query.strip():
+        return []
+    results = search_memory(query, limit=options.get("limit", 5), threshold=options.get("threshold", 0.35), mode=options.get("mode"),
+                            category=options.get("category"), since=options.get("since"), until=options.get("until"))
+    if results:
+        position = 0
+        while position < len(messages) and messages[position].get("role") == "system":
+            position += 1
+        messages.insert(position, {"role": "system", "content": format_rag_context(results)})
+    return results
+
+def prepare_chat_request(body, body_json):
+    """
+    Applies server-side chat options and returns (body to forward, rag
+    results or None, context budget report or None).
+    """
+    expanded = b"blob:" in body and expand_blob_refs(body_json)
+    rag_results = apply_chat_rag(body_json)
+    context = CONTEXT_BUDGET.apply(body_json)
+    if rag_results is not None or context is not None or expanded:
+        body = json.dumps(body_json).encode("utf-8")
+    return body, rag_results, context
+
+def rag_response_headers(rag_results, context=None):
+    headers = {}
+    if rag_results is not None:
+        headers["X-RAG-Memories"] = ",".join(f"{r['id']}:{r['score']:.4f}" for r in rag_results)
+    if context is not None:
+        headers["X-Context-Budget"] = ";".join(f"{name}={'' if value is None else value}" for name, value in context.items()
+                                               if not isinstance(value, (dict, list)) and name != "error")
+    if headers:
+        headers["Access-Control-Expose-Headers"] = ", ".join(headers)
+    return headers
+
+def rag_stream_event(rag_results, context=None):
+    """Leading NDJSON lines announcing which memories were injected into a streamed chat and how its context was fitted."""
+    event = b""
+    if rag_results is not None:
+        results = [{"id": r["id"], "score": r["score"], "content": r["content"]} for r in rag_results]
+        event += json.dumps({"rag": {"results": results}}, ensure_ascii=False).encode("utf-8") + b"\n"
+    if context is not None:
+        event += json.dumps({"context": context}, ensure_ascii=False).encode("utf-8") + b"\n"
+    return event
+
+def add_memory(content, category="General"):
+    # Validate content
+    if not content or not content.strip():
+        print("Skipping empty memory content")
+        return False
+    
+    content = content.strip()
+    category = category.strip() if category else "General"
+    
+    if len(content) < 10:
+        print("Skipping too short memory content")
+        return False
+    
+    model = get_embed_model()
+    if not model:
+        print("No embedding model available")
+        return False
+    
+    vec = get_embedding(content, model)
+    if not vec:
+        print("Failed to generate embedding")
+        return False
+    
+    # Check for duplicates using vector similarity
+    # Use a high threshold (e.g., 0.9) to detect near-duplicates
+    existing = MEMORY_INDEX.search(vec, limit=1, threshold=0.9, model=model)
+    if existing:
+        print(f"Skipping duplicate memory (score: {existing[0][1]:.2f})")
+        return False
+    
+    try:
+        conn = get_db_connection()
+        # Held across the write so the index (and its .vec files) apply changes in commit order
+        with MEMORY_INDEX.lock:
+            with conn:
+                c = conn.execute("INSERT INTO memories (content, category, embedding, embed_model, embed_dim, embed_encoding, embed_scale) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                 (content, category, *vector_columns(vec, model)))
+            MEMORY_INDEX.upsert(c.lastrowid, vec, model)
+        return True
+    except Exception as e:
+        print(f"Error adding memory to database: {e}")
+        return False
+
+def bulk_add_memories(items, batch_size=None):
+    """
+    Adds many memories at once. Items are embedded in batches through
+    /api/embed, deduplicated against each other and against the store at the
+    same 0.9 similarity add_memory uses, and inserted in a single transaction.
+    Returns a summary with one result per input item.
+    """
+    started = time.time()
+    batch_size = max(1, int(batch_size or EMBED_BATCH_SIZE))
+    results = []
+    model = get_embed_model()
+    if not model:
+        return {"error": "No embedding model available"}
+    
+    pending = []  # (result, content, category)
+    for index, item in enumerate(items):
+        result = {"index": index, "status": "invalid"}
+        results.append(result)
+        if not isinstance(item, dict):
+            result["reason"] = "item must be an object"
+            continue
+        content = item.get("content")
+        if not isinstance(content, str) or len(content.strip()) < 10:
+            result["reason"] = "content is empty or too short"
+            continue
+        category = item.get("category")
+        category = category.strip() if isinstance(category, str) and category.strip() else "General"
+        pending.append((result, content.strip(), category))
+    
+    rows = []
+    accepted = None  # normalized vectors accepted so far in this request, grown by doubling
+    count = 0
+    seen = set()
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        vectors = get_embeddings([content for _, content, _ in batch], model)
+        for (result, content, category), vec in zip(batch, vectors):
+            if content in seen:
+                result.update(status="duplicate", reason="repeated in request")
+                continue
+            if not vec:
+                result.update(status="error", reason="failed to generate embedding")
+                continue
+            existing = MEMORY_INDEX.search(vec, limit=1, threshold=0.9, model=model)
+            if existing:
+                result.update(status="duplicate", reason="already stored", id=existing[0][0], score=existing[0][1])
+                continue
+            unit = MEMORY_INDEX._normalize(vec)
+            if accepted is None:
+                accepted = np.empty((min(len(pending), 64), unit.shape[0]), dtype=np.float32)
+            if unit.shape[0] == accepted.shape[1]:
+                if count:
+                    score = float(np.max(accepted[:count] @ unit))
+                    if score >= 0.9:
+                        result.update(status="duplicate", reason="near-duplicate in request", score=score)
+                        continue
+                if count == accepted.shape[0]:
+                    accepted = np.concatenate([accepted, np.empty_like(accepted)])
+                accepted[count] = unit
+                count += 1
+            seen.add(content)
+            rows.append((result, content, category, vec))
+    
+    if rows:
+        try:
+            conn = get_db_connection()
+            c = conn.cursor()
+            with MEMORY_INDEX.lock:
+                c.execute("BEGIN IMMEDIATE")
+                try:
+                    new_ids = [c.execute("INSERT INTO memories (content, category, embedding, embed_model, embed_dim, embed_encoding, embed_scale) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                         (content, category, *vector_columns(vec, model))).lastrowid for _, content, category, vec in rows]
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                for (result, _, _, _), memory_id in zip(rows, new_ids):
+                    result.update(status="added", id=memory_id)
+                MEMORY_INDEX.upsert_many((memory_id, vec, model) for (_, _, _, vec), memory_id in zip(rows, new_ids))
+        except Exception as e:
+            print(f"Error bulk adding memories: {e}")
+            for result, _, _, _ in rows:
+                result.update(status="error", reason=str(e))
+    
+    elapsed = time.time() - started
+    added = sum(1 for r in results if r["status"] == "added")
+    return {
+        "results": results,
+        "added": added,
+        "skipped": len(results) - added,
+        "elapsed_seconds": round(elapsed, 3),
+        "items_per_second": round(len(results) / elapsed, 1) if elapsed > 0 else None
+    }
+
+def clear_all_memories():
+    try:
+        conn = get_db_connection()
+        with MEMORY_INDEX.lock:
+            with conn:
+                conn.execute("DELETE FROM memories")
+                conn.execute("DELETE FROM documents")
+            MEMORY_INDEX.clear()
+        return True
+    except Exception as e:
+        print(f"Error clearing memories: {e}")
+        return False
+
+def delete_memory(memory_id):
+    try:
+        conn = get_db_connection()
+        with MEMORY_INDEX.lock:
+            with conn:
+                deleted = conn.execute("DELETE FROM memories WHERE id = ?", (memory_id,)).rowcount > 0
+            if deleted:
+                MEMORY_INDEX.remove(memory_id)
+        return deleted
+    except Exception as e:
+        print(f"Error deleting memory: {e}")
+        return False
+
+def update_memory(memory_id, content):
+    # Validate content
+    if not content or not content.strip():
+        print("Cannot update with empty content")
+        return False
     
     content = content.strip()
     if len(content) < 10:
@@ -322,146 +2260,2497 @@ def update_memory(memory_id, content):
         print("Failed to generate embedding for update")
         return False
     
-    vec_bytes = np.array(vec, dtype=np.float32).tobytes()
-    
     try:
         conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("UPDATE memories SET content = ?, embedding = ? WHERE id = ?", 
-                  (content, vec_bytes, memory_id))
-        conn.commit()
-        updated = c.rowcount > 0
-        conn.close()
+        with MEMORY_INDEX.lock:
+            with conn:
+                updated = conn.execute("UPDATE memories SET content = ?, embedding = ?, embed_model = ?, embed_dim = ?, embed_encoding = ?, embed_scale = ? WHERE id = ?", 
+                                       (content, *vector_columns(vec, model), memory_id)).rowcount > 0
+            if updated:
+                MEMORY_INDEX.upsert(memory_id, vec, model)
         return updated
     except Exception as e:
         print(f"Error updating memory: {e}")
         return False
 
-def get_all_memories(limit=100):
+MEMORY_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2})?)?$")
+
+def memory_timestamp(value):
+    """A MEMORY_DATE string in the stored "YYYY-MM-DD HH:MM:SS" form, so timestamps sort as they compare."""
+    value = value.strip().replace("T", " ")
+    return value + " 00:00:00"[len(value) - 10:] if len(value) < 19 else value
+
+def memory_filters(category=None, since=None, until=None):
+    """
+    SQL conditions and parameters shared by listing, search and export.
+    category is a name, a comma-separated string or a list of names; since
+    (inclusive) and until (exclusive) are dates or local date-times, compared
+    with created_at as it is stored ("YYYY-MM-DD HH:MM:SS").
+    """
+    conditions, params = [], []
+    if category:
+        names = category if isinstance(category, list) else str(category).split(",")
+        names = [name.strip() for name in names if isinstance(name, str) and name.strip()]
+        if names:
+            conditions.append(f"category IN ({','.join('?' for _ in names)})")
+            params += names
+    for name, value, operator in (("since", since, ">="), ("until", until, "<")):
+        if not value:
+            continue
+        if not isinstance(value, str) or not MEMORY_DATE.match(value.strip()):
+            raise ValueError(f"{name} must be a date (YYYY-MM-DD) or a date-time (YYYY-MM-DD HH:MM[:SS])")
+        conditions.append(f"created_at {operator} ?")
+        params.append(memory_timestamp(value))
+    return conditions, params
+
+def filtered_memory_ids(conditions, params):
+    return MEMORY_INDEX.filtered_ids(conditions, params)
+
+def _encode_cursor(created_at, memory_id):
+    return base64.urlsafe_b64encode(json.dumps([created_at, memory_id]).encode("utf-8")).decode("ascii").rstrip("=")
+
+def _decode_cursor(cursor):
     try:
+        created_at, memory_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return [str(created_at), int(memory_id)]
+    except (ValueError, TypeError):
+        raise ValueError("invalid cursor")
+
+def list_memories(limit=100, cursor=None, category=None, since=None, until=None):
+    """
+    One page of memories, newest first, and the cursor for the next page
+    (None after the last). The cursor is the (created_at, id) of the page's
+    last row, so every page is a range scan of the created_at index however
+    deep it is, and rows added meanwhile do not shift later pages.
+    """
+    limit = max(1, min(int(limit), 1000))
+    conditions, params = memory_filters(category, since, until)
+    if cursor:
+        conditions.append("(created_at, id) < (?, ?)")
+        params += _decode_cursor(cursor)
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+    rows = get_db_connection().execute(
+        f"SELECT id, content, category, created_at FROM memories {where}ORDER BY created_at DESC, id DESC LIMIT ?",
+        (*params, limit + 1)).fetchall()
+    memories = [{"id": r["id"], "content": r["content"], "category": r["category"] or "General", "created_at": r["created_at"]}
+                for r in rows[:limit]]
+    next_cursor = _encode_cursor(rows[limit - 1]["created_at"], rows[limit - 1]["id"]) if len(rows) > limit else None
+    return {"memories": memories, "next_cursor": next_cursor}
+
+def reencode_memories(encoding, batch_size=500):
+    """
+    Converts every stored vector to the given encoding, one transaction per
+    batch so the server can keep running. Converting to a wider encoding does
+    not restore precision already lost. Returns counts and blob sizes.
+    """
+    if encoding not in VECTOR_ENCODINGS:
+        raise ValueError(f"encoding must be one of {', '.join(VECTOR_ENCODINGS)}")
+    started = time.time()
+    conn = get_db_connection()
+    ids = [row["id"] for row in conn.execute("SELECT id FROM memories WHERE COALESCE(embed_encoding, 'float32') != ? ORDER BY id", (encoding,))]
+    bytes_before = bytes_after = 0
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        placeholders = ",".join("?" for _ in batch)
+        rows = conn.execute(f"SELECT id, embedding, embed_encoding, embed_scale FROM memories WHERE id IN ({placeholders})", batch).fetchall()
+        updates = []
+        for row in rows:
+            blob, scale = encode_vector(decode_vector(row["embedding"], row["embed_encoding"], row["embed_scale"]), encoding)
+            bytes_before += len(row["embedding"])
+            bytes_after += len(blob)
+            updates.append((blob, encoding, scale, row["id"]))
+        with conn:
+            conn.executemany("UPDATE memories SET embedding = ?, embed_encoding = ?, embed_scale = ? WHERE id = ?", updates)
+    if ids:
+        MEMORY_INDEX.invalidate()
+    elapsed = time.time() - started
+    return {
+        "encoding": encoding,
+        "converted": len(ids),
+        "bytes_before": bytes_before,
+        "bytes_after": bytes_after,
+        "elapsed_seconds": round(elapsed, 3)
+    }
+
+# --- Export / import ---
+
+EXPORT_FORMAT = "ollama-studio-memories"
+EXPORT_ENCODINGS = ("float16", "float32")
+DOCUMENT_COLUMNS = ("id", "name", "content_hash", "size", "chunks", "chunk_size", "chunk_overlap", "chunk_unit", "created_at", "updated_at")
+CHUNK_COLUMNS = ("doc_id", "chunk_index", "start_offset", "end_offset", "chunk_hash")
+
+def export_memories(encoding="float16", category=None, since=None, until=None, batch_size=500):
+    """
+    Streams the store as NDJSON: a header line, the documents the exported
+    chunks belong to, then one line per memory with its vector in base64
+    (little-endian float16 or float32). Returns an iterator of byte blocks,
+    one per `batch_size` rows read with fetchmany, so memory use does not
+    grow with the store. Arguments are checked before anything is yielded.
+    """
+    if encoding not in EXPORT_ENCODINGS:
+        raise ValueError(f"encoding must be one of {', '.join(EXPORT_ENCODINGS)}")
+    conditions, params = memory_filters(category, since, until)
+    header = {"type": "header", "format": EXPORT_FORMAT, "version": 1, "encoding": encoding,
+              "exported_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "filters": {"category": category, "since": since, "until": until}}
+    return _export_lines(header, conditions, params, max(1, int(batch_size)))
+
+def _export_lines(header, conditions, params, batch_size):
+    dtype = np.dtype("<f2" if header["encoding"] == "float16" else "<f4")
+    conn = get_db_connection()
+    yield json.dumps(header, ensure_ascii=False).encode("utf-8") + b"\n"
+
+    chunk_filter = " AND ".join(conditions + ["doc_id IS NOT NULL"])
+    cursor = conn.execute(f"SELECT {', '.join(DOCUMENT_COLUMNS)} FROM documents "
+                          f"WHERE id IN (SELECT DISTINCT doc_id FROM memories WHERE {chunk_filter}) ORDER BY id", params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield b"".join(json.dumps({"type": "document", **dict(row)}, ensure_ascii=False).encode("utf-8") + b"\n" for row in rows)
+
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+    cursor = conn.execute(
+        "SELECT id, content, category, created_at, embedding, embed_model, embed_dim, embed_encoding, embed_scale, "
+        f"{', '.join(CHUNK_COLUMNS)} FROM memories {where}ORDER BY id", params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        lines = []
+        for row in rows:
+            item = {"type": "memory", "id": row["id"], "content": row["content"], "category": row["category"] or "General",
+                    "created_at": row["created_at"], "embed_model": row["embed_model"]}
+            if row["embedding"] is not None:
+                vec = decode_vector(row["embedding"], row["embed_encoding"], row["embed_scale"])
+                item["dim"] = int(vec.shape[0])
+                item["vector"] = base64.b64encode(vec.astype(dtype).tobytes()).decode("ascii")
+            if row["doc_id"] is not None:
+                item.update({column: row[column] for column in CHUNK_COLUMNS})
+            lines.append(json.dumps(item, ensure_ascii=False).encode("utf-8") + b"\n")
+        yield b"".join(lines)
+
+def _import_row(item, encoding):
+    content = item.get("content")
+    if not isinstance(content, str) or not content.strip():
+        raise ValueError("content is missing or empty")
+    category = item.get("category")
+    created_at = item.get("created_at")
+    row = {"content": content.strip(), "category": category.strip() if isinstance(category, str) and category.strip() else "General",
+           "created_at": memory_timestamp(created_at) if isinstance(created_at, str) and MEMORY_DATE.match(created_at.strip()) else None,
+           "model": item.get("embed_model") if isinstance(item.get("embed_model"), str) else None, "vec": None}
+    if item.get("vector") is not None:
+        vec = np.frombuffer(base64.b64decode(item["vector"], validate=True), dtype="<f2" if encoding == "float16" else "<f4")
+        if not vec.size or (item.get("dim") is not None and vec.shape[0] != item["dim"]):
+            raise ValueError("vector does not match dim")
+        row["vec"] = vec.astype(np.float32)
+    if isinstance(item.get("doc_id"), str):
+        row.update({column: item.get(column) for column in CHUNK_COLUMNS})
+    return row
+
+def _import_batch(rows, summary, skip_existing):
+    if skip_existing:
         conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("SELECT id, content, category, created_at FROM memories ORDER BY created_at DESC LIMIT ?", (limit,))
-        rows = c.fetchall()
-        conn.close()
-        return [{"id": r["id"], "content": r["content"], "category": r["category"] if "category" in r.keys() else "General", "created_at": r["created_at"]} for r in rows]
-    except Exception as e:
-        print(f"Error getting memories: {e}")
+        placeholders = ",".join("?" for _ in rows)
+        stored = {(r["content"], r["doc_id"]) for r in conn.execute(
+            f"SELECT content, doc_id FROM memories WHERE content IN ({placeholders})", [row["content"] for row in rows])}
+        fresh = []
+        for row in rows:
+            key = (row["content"], row.get("doc_id"))
+            if key in stored:
+                summary["skipped"] += 1
+                continue
+            stored.add(key)
+            fresh.append(row)
+        rows = fresh
+
+    missing = [row for row in rows if row["vec"] is None]
+    if missing:
+        model = get_embed_model()
+        vectors = get_embeddings([row["content"] for row in missing], model) if model else [None] * len(missing)
+        for row, vec in zip(missing, vectors):
+            if vec:
+                row["vec"], row["model"] = np.asarray(vec, dtype=np.float32), model
+                summary["embedded"] += 1
+        failed = sum(row["vec"] is None for row in missing)
+        if failed:
+            summary["errors"] += failed
+            if len(summary["error_samples"]) < 20:
+                summary["error_samples"].append({"error": f"{failed} memories without a vector could not be embedded"})
+        rows = [row for row in rows if row["vec"] is not None]
+    if not rows:
+        return
+
+    conn = get_db_connection()
+    c = conn.cursor()
+    insert = ("INSERT INTO memories (content, category, created_at, embedding, embed_model, embed_dim, embed_encoding, embed_scale, "
+              f"{', '.join(CHUNK_COLUMNS)}) VALUES (?, ?, COALESCE(?, datetime('now', 'localtime')), ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+    with MEMORY_INDEX.lock:
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            new_ids = [c.execute(insert, (row["content"], row["category"], row["created_at"], *vector_columns(row["vec"], row["model"]),
+                                          *(row.get(column) for column in CHUNK_COLUMNS))).lastrowid for row in rows]
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        MEMORY_INDEX.upsert_many((memory_id, row["vec"], row["model"]) for row, memory_id in zip(rows, new_ids))
+    summary["imported"] += len(rows)
+
+def import_memories(lines, batch_size=500, skip_existing=True):
+    """
+    Loads an export_memories stream from an iterable of NDJSON lines, one
+    transaction per `batch_size` memories, so memory use stays flat however
+    large the file is. Ids are assigned afresh; vectors keep the model that
+    made them (the background re-embedding converts a different model's),
+    and memories without one are embedded with the current model. With
+    skip_existing, memories whose content is already stored (in the same
+    document, for chunks) are skipped. Returns a summary.
+    """
+    started = time.time()
+    batch_size = max(1, min(int(batch_size), 500))
+    summary = {"imported": 0, "skipped": 0, "embedded": 0, "documents": 0, "errors": 0, "error_samples": []}
+    encoding = "float32"
+    batch = []
+    for line_no, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+            if not isinstance(item, dict):
+                raise ValueError("line is not a JSON object")
+            kind = item.get("type", "memory")
+            if kind == "header":
+                if item.get("format") != EXPORT_FORMAT or item.get("encoding") not in EXPORT_ENCODINGS:
+                    raise ValueError("not an ollama-studio-memories export")
+                encoding = item["encoding"]
+            elif kind == "document":
+                if not isinstance(item.get("id"), str) or not isinstance(item.get("name"), str):
+                    raise ValueError("document needs an id and a name")
+                now = time.time()
+                values = {**{column: item.get(column) for column in DOCUMENT_COLUMNS}, "size": item.get("size") or 0,
+                          "chunks": item.get("chunks") or 0, "created_at": item.get("created_at") or now, "updated_at": item.get("updated_at") or now}
+                with get_db_connection() as conn:
+                    added = conn.execute(
+                        f"INSERT OR IGNORE INTO documents ({', '.join(DOCUMENT_COLUMNS)}) VALUES ({', '.join('?' for _ in DOCUMENT_COLUMNS)})",
+                        [values[column] for column in DOCUMENT_COLUMNS]).rowcount
+                summary["documents"] += added
+            elif kind == "memory":
+                batch.append(_import_row(item, encoding))
+            else:
+                raise ValueError(f"unknown line type {kind!r}")
+        except (ValueError, TypeError, sqlite3.IntegrityError) as e:
+            summary["errors"] += 1
+            if len(summary["error_samples"]) < 20:
+                summary["error_samples"].append({"line": line_no, "error": str(e)})
+        if len(batch) >= batch_size:
+            _import_batch(batch, summary, skip_existing)
+            batch = []
+    if batch:
+        _import_batch(batch, summary, skip_existing)
+    elapsed = time.time() - started
+    summary["elapsed_seconds"] = round(elapsed, 3)
+    summary["memories_per_second"] = round(summary["imported"] / elapsed, 1) if elapsed > 0 else None
+    return summary
+
+# --- Near-duplicate compaction ---
+
+DEDUP_KEEP = ("oldest", "newest", "longest")
+
+def similar_pairs(vectors, threshold, block_rows=None):
+    """
+    (left, right, score) arrays of every pair left < right of normalized
+    vectors with cosine >= threshold. Rows are compared in blocks against
+    the rows from the block onward, so only the upper triangle is computed
+    and a block's score matrix stays around 64 MB.
+    """
+    n = vectors.shape[0]
+    block = block_rows or max(1, min(n, (1 << 24) // max(1, n)))
+    left, right, scores = [], [], []
+    for start in range(0, n, block):
+        stop = min(n, start + block)
+        sims = vectors[start:stop] @ vectors[start:].T
+        # Column c is row start + c, so pairs on or below the diagonal are repeats
+        sims[np.tril_indices(stop - start, 0, sims.shape[1])] = -np.inf
+        rows, cols = np.nonzero(sims >= threshold)
+        left.append(rows + start)
+        right.append(cols + start)
+        scores.append(sims[rows, cols])
+    if not left:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    return np.concatenate(left), np.concatenate(right), np.concatenate(scores)
+
+def duplicate_clusters(threshold):
+    """
+    Groups memories whose vectors are within `threshold` of each other
+    (transitively, so two members of a group can be far apart; see
+    dedup_memories). Document chunks are left out: neighbouring chunks
+    overlap by design. Each block of the index is compared exactly, or list
+    by list when an IVF index covers it, which is much faster on large
+    stores but can miss a few pairs. Returns ([sorted id lists], method).
+    """
+    MEMORY_INDEX.ensure_loaded()
+    conn = get_db_connection()
+    chunk_ids = np.array([row[0] for row in conn.execute("SELECT id FROM memories WHERE doc_id IS NOT NULL")], dtype=np.int64)
+    with MEMORY_INDEX.lock:
+        keys = list(MEMORY_INDEX.blocks)
+        ivf = MEMORY_INDEX.ivf
+    parent = {}
+
+    def find(x):
+        while parent.setdefault(x, x) != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    method = "exact"
+    for key in keys:
+        ids, vectors = MEMORY_INDEX.live_vectors(key)
+        keep = ~np.isin(ids, chunk_ids)
+        ids, vectors = ids[keep], vectors[keep]
+        if ivf is not None and ivf.key == key and ivf.centroids.shape[0] > 2:
+            # Near duplicates share one of their two nearest centroids, so rows are only compared
+            # within those lists; the second assignment catches pairs split by a list boundary
+            method = "ivf"
+            nearest = np.empty((ids.shape[0], 2), dtype=np.int64)
+            for start in range(0, ids.shape[0], 4096):
+                scores = vectors[start:start + 4096] @ ivf.centroids.T
+                nearest[start:start + 4096] = np.argpartition(-scores, 1, axis=1)[:, :2]
+            lists = nearest.ravel()
+            order = np.argsort(lists, kind="stable")
+            bounds = np.searchsorted(lists[order], np.arange(ivf.centroids.shape[0] + 1))
+            groups = [order[bounds[i]:bounds[i + 1]] // 2 for i in range(ivf.centroids.shape[0])]
+        else:
+            groups = [np.arange(ids.shape[0])]
+        for rows in groups:
+            if rows.size < 2:
+                continue
+            left, right, _ = similar_pairs(vectors[rows], threshold)
+            for a, b in zip(ids[rows[left]].tolist(), ids[rows[right]].tolist()):
+                root_a, root_b = find(a), find(b)
+                if root_a != root_b:
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+    clusters = {}
+    for memory_id in parent:
+        clusters.setdefault(find(memory_id), []).append(memory_id)
+    return [sorted(members) for members in clusters.values() if len(members) > 1], method
+
+def _scan_ms(queries=20):
+    """Median ms of an exact top-5 scan over the largest block, for before/after comparisons."""
+    with MEMORY_INDEX.lock:
+        if not MEMORY_INDEX.blocks:
+            return None
+        dim = max(MEMORY_INDEX.blocks, key=lambda key: MEMORY_INDEX.blocks[key].live)[1]
+    samples = []
+    for query in np.random.default_rng(0).standard_normal((queries, dim)).astype(np.float32):
+        started = time.perf_counter()
+        MEMORY_INDEX.search(query, limit=5, threshold=-1.0, exact=True)
+        samples.append((time.perf_counter() - started) * 1000)
+    return round(float(np.median(samples)), 3)
+
+def dedup_memories(threshold=0.9, dry_run=False, keep="oldest", sample=20):
+    """
+    Finds near-duplicate clusters and keeps one memory per cluster: the
+    oldest, the newest, or the longest text ("longest" also gives it the
+    cluster's earliest created_at). The rest are deleted in one transaction,
+    skipping any whose content changed since the scan. Reports the rows and
+    bytes removed and the exact scan time before and after.
+    """
+    if keep not in DEDUP_KEEP:
+        raise ValueError(f"keep must be one of {', '.join(DEDUP_KEEP)}")
+    threshold = float(threshold)
+    if not 0 < threshold <= 1:
+        raise ValueError("threshold must be in (0, 1]")
+    started = time.time()
+    clusters, method = duplicate_clusters(threshold)
+    conn = get_db_connection()
+    rows_before = MEMORY_INDEX.size()
+    bytes_before = conn.execute("SELECT COALESCE(SUM(LENGTH(content) + LENGTH(embedding)), 0) FROM memories").fetchone()[0]
+    scan_before = _scan_ms()
+
+    plan = []  # (keeper row, [duplicate rows])
+    for members in clusters:
+        placeholders = ",".join("?" for _ in members)
+        rows = conn.execute(f"SELECT id, content, category, created_at, LENGTH(content) + LENGTH(embedding) AS size "
+                            f"FROM memories WHERE id IN ({placeholders}) ORDER BY id", members).fetchall()
+        if len(rows) < 2:
+            continue
+        if keep == "oldest":
+            remaining = list(range(len(rows)))
+        elif keep == "newest":
+            remaining = list(range(len(rows) - 1, -1, -1))
+        else:
+            remaining = sorted(range(len(rows)), key=lambda i: (-len(rows[i]["content"]), rows[i]["id"]))
+        # Clusters are chained (A~B and B~C put A and C together however far apart they are), so a
+        # row is only removed for a keeper it is itself a duplicate of; the rest pick their own keeper
+        vectors = MEMORY_INDEX.vectors([row["id"] for row in rows])
+        while len(remaining) > 1:
+            keeper, others = remaining[0], np.array(remaining[1:])
+            close = vectors[others] @ vectors[keeper] >= threshold
+            if close.any():
+                plan.append((rows[keeper], [rows[i] for i in others[close]]))
+            remaining = others[~close].tolist()
+
+    summary = {
+        "threshold": threshold,
+        "keep": keep,
+        "method": method,
+        "dry_run": bool(dry_run),
+        "clusters": len(plan),
+        "rows_before": rows_before,
+        "bytes_before": bytes_before,
+        "scan_ms_before": scan_before,
+        "sample": [{"keep": {"id": keeper["id"], "content": keeper["content"]},
+                    "remove": [{"id": row["id"], "content": row["content"]} for row in duplicates]}
+                   for keeper, duplicates in plan[:sample]]
+    }
+    if dry_run:
+        removable = sum(len(duplicates) for _, duplicates in plan)
+        summary.update(removed=removable, rows_after=rows_before - removable,
+                       bytes_after=bytes_before - sum(row["size"] for _, duplicates in plan for row in duplicates),
+                       elapsed_seconds=round(time.time() - started, 3))
+        return summary
+
+    removed = []
+    with MEMORY_INDEX.lock:
+        with conn:
+            for keeper, duplicates in plan:
+                for row in duplicates:
+                    if conn.execute("DELETE FROM memories WHERE id = ? AND content = ?", (row["id"], row["content"])).rowcount:
+                        removed.append(row["id"])
+                if keep == "longest":
+                    earliest = min(row["created_at"] for row in (keeper, *duplicates))
+                    conn.execute("UPDATE memories SET created_at = ? WHERE id = ?", (earliest, keeper["id"]))
+        MEMORY_INDEX.remove_many(removed)
+    # Drop the tombstones now so scans get the benefit straight away
+    MEMORY_INDEX.compact()
+    summary.update(
+        removed=len(removed),
+        rows_after=MEMORY_INDEX.size(),
+        bytes_after=conn.execute("SELECT COALESCE(SUM(LENGTH(content) + LENGTH(embedding)), 0) FROM memories").fetchone()[0],
+        scan_ms_after=_scan_ms(),
+        elapsed_seconds=round(time.time() - started, 3)
+    )
+    if scan_before and summary["scan_ms_after"]:
+        summary["scan_speedup"] = round(scan_before / summary["scan_ms_after"], 2)
+    return summary
+
+# --- Re-embedding after a model change ---
+
+class EmbeddingMigration:
+    """
+    Re-embeds memories stored with another model, or another dimension,
+    than the one find_best_embed_model picks. While a job runs, queries and
+    new memories keep using the model most stored vectors came from (when
+    Ollama still has it), so scores stay comparable. New vectors are staged
+    in reembed_vectors one transaction per batch; the staged rows are the
+    checkpoint a restarted server resumes from. Once every memory has one,
+    they replace the old vectors in a single transaction and the index is
+    reloaded under its lock, so a query sees either the old model and
+    vectors or the new ones. Batches are embedded `workers` requests at a
+    time and wait while chats are being proxied, for up to MAX_DEFER
+    seconds. A memory the new model fails to embed MAX_ATTEMPTS times is
+    given up on: it keeps its old model and vector (only searchable by that
+    model) and no longer counts as stale for the target, until its content
+    changes.
+    """
+
+    PROBE_TEXT = "embedding dimension probe"
+    MAX_ATTEMPTS = 3
+    MAX_DEFER = 30.0
+    PENDING = (
+        "SELECT m.id, m.content FROM memories m "
+        "LEFT JOIN reembed_vectors s ON s.job_id = ? AND s.memory_id = m.id "
+        "LEFT JOIN reembed_failures f ON f.job_id = ? AND f.memory_id = m.id "
+        "WHERE s.memory_id IS NULL AND COALESCE(f.attempts, 0) < ? "
+        "AND NOT (m.embed_dim = ? AND (m.embed_model = ? OR m.embed_model IS NULL)) "
+        "ORDER BY m.id LIMIT ?"
+    )
+
+    def __init__(self, workers, batch_size):
+        self.lock = threading.Lock()
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.thread = None
+        self.job = None  # the running reembed_jobs row, as a dict
+        self.serving = None  # model answering queries while the job runs
+        self.last_error = None
+        self.rounds = deque(maxlen=50)  # (rows embedded, seconds) per round
+        self.dims = {}  # (model, (digest, modified_at)) -> embedding dimension
+        self.stats = {"embedded": 0, "failed": 0, "given_up": 0, "jobs_finished": 0, "jobs_cancelled": 0}
+
+    @staticmethod
+    def _stored_counts():
+        counts = MEMORY_INDEX.key_counts()
+        if counts is None:
+            rows = get_db_connection().execute(
+                "SELECT embed_model, embed_dim, COUNT(*) FROM memories WHERE LENGTH(embedding) > 0 GROUP BY embed_model, embed_dim").fetchall()
+            counts = {(row[0], row[1]): row[2] for row in rows}
+        return counts
+
+    def dimension(self, model):
+        """Embedding dimension of `model`, probed once per pulled version of it."""
+        key = (model, MODEL_REGISTRY.version(model))
+        with self.lock:
+            dim = self.dims.get(key)
+        if dim is None:
+            # Not through the embedding cache: a re-pulled model may have changed dimension under the same name
+            probe = fetch_embedding(self.PROBE_TEXT, model)
+            if not probe:
+                return None
+            dim = len(probe)
+            with self.lock:
+                self.dims[key] = dim
+        return dim
+
+    def resolve(self, preferred):
+        """
+        Returns the model queries and new memories should use, starting (or
+        resuming) a job when stored vectors disagree with `preferred`.
+        """
+        if not preferred or not RAG_REEMBED:
+            return preferred
+        dim = self.dimension(preferred)
+        if not dim:
+            return preferred
+        target = (preferred, dim)
+        counts = self._stored_counts()
+        stale = {key: n for key, n in counts.items() if not (key[1] == target[1] and key[0] in (preferred, None))}
+        conn = get_db_connection()
+        # Memories an earlier job for this target gave up on are not worth another job by themselves
+        for row in conn.execute(
+                "SELECT m.embed_model, m.embed_dim, COUNT(DISTINCT m.id) FROM reembed_failures f "
+                "JOIN reembed_jobs j ON j.id = f.job_id JOIN memories m ON m.id = f.memory_id "
+                "WHERE j.target_model = ? AND j.target_dim = ? AND j.status = 'done' AND f.attempts >= ? "
+                "GROUP BY m.embed_model, m.embed_dim", (*target, self.MAX_ATTEMPTS)):
+            key = (row[0], row[1])
+            if key in stale:
+                stale[key] -= row[2]
+                if stale[key] <= 0:
+                    del stale[key]
+        with self.lock:
+            job = self.job
+            if job is None:
+                row = conn.execute("SELECT * FROM reembed_jobs WHERE status = 'running' ORDER BY id DESC LIMIT 1").fetchone()
+                job = dict(row) if row else None
+            if job is not None and (job["target_model"], job["target_dim"]) != target:
+                with conn:
+                    conn.execute("UPDATE reembed_jobs SET status = 'cancelled', finished_at = ? WHERE id = ?", (time.time(), job["id"]))
+                    conn.execute("DELETE FROM reembed_vectors WHERE job_id = ?", (job["id"],))
+                    conn.execute("DELETE FROM reembed_failures WHERE job_id = ?", (job["id"],))
+                self.stats["jobs_cancelled"] += 1
+                job = None
+            if job is None and stale:
+                source = max(stale, key=stale.get)
+                now = time.time()
+                with conn:
+                    job_id = conn.execute(
+                        "INSERT INTO reembed_jobs (source_model, source_dim, target_model, target_dim, total, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        (source[0], source[1], target[0], target[1], sum(stale.values()), now)).lastrowid
+                job = dict(conn.execute("SELECT * FROM reembed_jobs WHERE id = ?", (job_id,)).fetchone())
+                print(f"Embed model changed to {target[0]} ({target[1]} dims); re-embedding {job['total']} memories in the background")
+            self.job = job
+            self.serving = None
+            if stale:
+                # Keep answering with the model most stored vectors came from until they are swapped
+                current = max(counts, key=counts.get)[0]
+                self.serving = current if current and current in MODEL_REGISTRY.model_names() else preferred
+            if job is not None and (self.thread is None or not self.thread.is_alive()):
+                self.thread = threading.Thread(target=self._worker, name="reembed", daemon=True)
+                self.thread.start()
+            return self.serving or preferred
+
+    def _worker(self):
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="reembed-worker")
+        failures = 0
+        try:
+            while True:
+                with self.lock:
+                    job = self.job
+                if job is None:
+                    return
+                try:
+                    if self._round(job, executor) or self._swap(job):
+                        failures = 0
+                    with self.lock:
+                        self.last_error = None
+                except Exception as e:
+                    failures += 1
+                    with self.lock:
+                        self.last_error = str(e)
+                    print(f"Error re-embedding memories: {e}")
+                    time.sleep(min(60, 2 ** failures))
+        finally:
+            executor.shutdown(wait=False)
+
+    def _round(self, job, executor):
+        """Stages new vectors for up to workers x batch_size pending memories. Returns how many were staged."""
+        # Low priority, like memory extraction: chats being proxied go first, but a busy server cannot starve the job
+        CHAT_ACTIVITY.wait_idle(self.MAX_DEFER)
+        conn = get_db_connection()
+        model, dim = job["target_model"], job["target_dim"]
+        rows = conn.execute(self.PENDING, (job["id"], job["id"], self.MAX_ATTEMPTS, dim, model, self.batch_size * self.workers)).fetchall()
+        if not rows:
+            return 0
+        started = time.perf_counter()
+        batches = [rows[i:i + self.batch_size] for i in range(0, len(rows), self.batch_size)]
+        staged, failures = [], []
+        for batch, vectors in zip(batches, executor.map(lambda batch: self._embed_batch(batch, model), batches)):
+            for row, vec in zip(batch, vectors):
+                if not vec or len(vec) != dim:
+                    failures.append((job["id"], row["id"], "no embedding returned" if not vec else f"{len(vec)} dims, expected {dim}"))
+                    continue
+                blob, _, _, encoding, scale = vector_columns(vec, model)
+                staged.append((job["id"], row["id"], blob, dim, encoding, scale, row["id"], row["content"]))
+        if not staged and not fetch_embedding(self.PROBE_TEXT, model):
+            # The model is unreachable, not the rows at fault: retry later without counting an attempt
+            raise RuntimeError(f"{model} returned no embeddings")
+        with conn:
+            # Only staged if the content is still what was embedded; edits clear staged vectors by trigger
+            conn.executemany(
+                "INSERT OR REPLACE INTO reembed_vectors (job_id, memory_id, embedding, embed_dim, embed_encoding, embed_scale) "
+                "SELECT ?, ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM memories WHERE id = ? AND content = ?)", staged)
+            conn.executemany(
+                "INSERT INTO reembed_failures (job_id, memory_id, attempts, error) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (job_id, memory_id) DO UPDATE SET attempts = attempts + 1, error = excluded.error", failures)
+        with self.lock:
+            self.stats["embedded"] += len(staged)
+            self.stats["failed"] += len(failures)
+            self.rounds.append((len(staged), time.perf_counter() - started))
+        if not staged:
+            raise RuntimeError(f"no embeddings returned by {model} for {len(failures)} memories")
+        return len(staged)
+
+    @staticmethod
+    def _embed_batch(batch, model):
+        texts = [row["content"] for row in batch]
+        vectors = fetch_embeddings(texts, model)
+        if len(texts) > 1 and not any(vectors):
+            # One text Ollama rejects fails the whole /api/embed call; find it by embedding them one at a time
+            vectors = [fetch_embedding(text, model) for text in texts]
+        return vectors
+
+    def _swap(self, job):
+        """Replaces the old vectors once every memory has a staged one. Returns False if rows are still pending."""
+        global CACHED_EMBED_MODEL, EMBED_MODEL_CHECKED_AT
+        conn = get_db_connection()
+        model, dim = job["target_model"], job["target_dim"]
+        # Writers hold the index lock across their commit, so nothing changes between the check and the swap
+        with MEMORY_INDEX.lock:
+            with self.lock:
+                cancelled = self.job is None or self.job["id"] != job["id"]
+            if cancelled or conn.execute(self.PENDING, (job["id"], job["id"], self.MAX_ATTEMPTS, dim, model, 1)).fetchone():
+                return False
+            with conn:
+                conn.execute(
+                    "UPDATE memories SET (embedding, embed_model, embed_dim, embed_encoding, embed_scale) = "
+                    "(SELECT s.embedding, ?, s.embed_dim, s.embed_encoding, s.embed_scale FROM reembed_vectors s "
+                    "WHERE s.job_id = ? AND s.memory_id = memories.id) "
+                    "WHERE id IN (SELECT memory_id FROM reembed_vectors WHERE job_id = ?)", (model, job["id"], job["id"]))
+                # Memories given up on keep their old vector; their reembed_failures rows stay as the record
+                given_up = conn.execute(
+                    "SELECT COUNT(*) FROM reembed_failures f JOIN memories m ON m.id = f.memory_id "
+                    "WHERE f.job_id = ? AND f.attempts >= ?", (job["id"], self.MAX_ATTEMPTS)).fetchone()[0]
+                conn.execute("DELETE FROM reembed_vectors")
+                conn.execute("UPDATE reembed_jobs SET status = 'done', finished_at = ? WHERE id = ?", (time.time(), job["id"]))
+            # Drops the old model's blocks and .vec files and loads the new vectors
+            MEMORY_INDEX.rebuild()
+            CACHED_EMBED_MODEL = model
+            EMBED_MODEL_CHECKED_AT = time.time()
+        with self.lock:
+            if self.job is not None and self.job["id"] == job["id"]:
+                self.job = None
+                self.serving = None
+            self.stats["jobs_finished"] += 1
+            self.stats["given_up"] = given_up
+        print(f"Re-embedding with {model} finished; {job['total'] - given_up} memories now use it"
+              + (f", {given_up} could not be embedded and keep their old vectors" if given_up else ""))
+        return True
+
+    def start(self):
+        """Resumes a job left running by the last process; called at startup."""
+        threading.Thread(target=get_embed_model, daemon=True).start()
+
+    def snapshot(self):
+        with self.lock:
+            job = dict(self.job) if self.job else None
+            stats = dict(self.stats)
+            stats["last_error"] = self.last_error
+            stats["serving_model"] = self.serving
+            rounds = list(self.rounds)
+        embedded, seconds = sum(n for n, _ in rounds), sum(t for _, t in rounds)
+        stats["rows_per_second"] = round(embedded / seconds, 1) if seconds else None
+        if job is None:
+            stats["status"] = "idle"
+            return stats
+        conn = get_db_connection()
+        staged = conn.execute("SELECT COUNT(*) FROM reembed_vectors WHERE job_id = ?", (job["id"],)).fetchone()[0]
+        failing = conn.execute("SELECT COUNT(*) FROM reembed_failures WHERE job_id = ? AND attempts >= ?",
+                               (job["id"], self.MAX_ATTEMPTS)).fetchone()[0]
+        remaining = max(0, job["total"] - staged - failing)
+        stats.update({
+            "status": "running",
+            "job_id": job["id"],
+            "source": {"model": job["source_model"], "dim": job["source_dim"]},
+            "target": {"model": job["target_model"], "dim": job["target_dim"]},
+            "total": job["total"],
+            "staged": staged,
+            "failed_rows": failing,
+            "remaining": remaining,
+            "progress": round(staged / job["total"], 4) if job["total"] else 1.0,
+            "eta_seconds": round(remaining / stats["rows_per_second"], 1) if stats["rows_per_second"] else None,
+            "started_at": job["created_at"]
+        })
+        return stats
+
+
+REEMBED = EmbeddingMigration(RAG_REEMBED_WORKERS, EMBED_BATCH_SIZE)
+
+# --- Attachment blobs ---
+
+class MissingBlobsError(ValueError):
+    def __init__(self, missing):
+        super().__init__(f"Unknown blob(s): {', '.join(missing)}")
+        self.missing = missing
+
+
+class BlobStore:
+    """
+    Content-addressed store for chat attachments, so the client uploads an
+    image or document once and then refers to it by its SHA-256. Blobs are
+    files under `root` (sharded by the first two hex digits); storing the same
+    bytes twice keeps one copy. Reading or re-uploading a blob bumps its
+    mtime, and once the store exceeds `max_bytes` the least recently used
+    blobs are deleted. The directory is scanned lazily on first use. The MIME
+    type given at upload is kept next to the blob (<hash>.type) and is what
+    GET serves; only types in SAFE_TYPES are served for display.
+    """
+
+    HASH = re.compile(r"^[0-9a-f]{64}$")
+    MIME = re.compile(r"^[a-z0-9][\w.+-]*/[a-z0-9][\w.+-]*$")
+    # Rendered inline by the UI. Anything else (HTML, SVG, scripts) would run on the studio's origin
+    SAFE_TYPES = re.compile(r"^(image/(png|jpeg|gif|webp|bmp|avif)|audio/[\w.+-]+|text/plain)$")
+
+    def __init__(self, root, max_bytes):
+        self.lock = threading.Lock()
+        self.root = root
+        self.max_bytes = max_bytes
+        self.entries = None  # hash -> size, least recently used first
+        self.total = 0
+        self.stats = {"puts": 0, "deduplicated": 0, "reads": 0, "evictions": 0, "expanded": 0}
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _load(self):
+        if self.entries is not None:
+            return
+        found = []
+        for path in glob.glob(os.path.join(self.root, "??", "*")):
+            digest = os.path.basename(path)
+            if self.HASH.match(digest):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, digest, stat.st_size))
+        self.entries = OrderedDict((digest, size) for _, digest, size in sorted(found))
+        self.total = sum(self.entries.values())
+
+    def _touch(self, digest):
+        self.entries.move_to_end(digest)
+        try:
+            os.utime(self._path(digest))
+        except OSError:
+            pass
+
+    def _evict(self, keep):
+        while self.total > self.max_bytes and len(self.entries) > 1:
+            digest, size = next(iter(self.entries.items()))
+            if digest == keep:
+                self.entries.move_to_end(digest)
+                continue
+            del self.entries[digest]
+            self.total -= size
+            self.stats["evictions"] += 1
+            for path in (self._path(digest), self._path(digest) + ".type"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _write(self, path, data):
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as file:
+            file.write(data)
+        os.replace(tmp, path)
+
+    def put(self, data, content_type=None):
+        """Stores bytes and returns (sha256 hex, whether they were already stored)."""
+        digest = hashlib.sha256(data).hexdigest()
+        content_type = (content_type or "").split(";")[0].strip().lower()
+        content_type = content_type if self.MIME.match(content_type) else None
+        with self.lock:
+            self._load()
+            self.stats["puts"] += 1
+            path = self._path(digest)
+            if digest in self.entries and os.path.exists(path):
+                self.stats["deduplicated"] += 1
+                self._touch(digest)
+                if content_type and not os.path.exists(path + ".type"):
+                    self._write(path + ".type", content_type.encode("ascii"))
+                return digest, True
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._write(path, data)
+            if content_type:
+                self._write(path + ".type", content_type.encode("ascii"))
+            self.total += len(data) - self.entries.get(digest, 0)
+            self.entries[digest] = len(data)
+            self._evict(keep=digest)
+        return digest, False
+
+    def get(self, digest):
+        """Returns the blob's bytes, or None when it is unknown or was evicted."""
+        if not self.HASH.match(digest or ""):
+            return None
+        try:
+            with open(self._path(digest), "rb") as file:
+                data = file.read()
+        except OSError:
+            return None
+        with self.lock:
+            self._load()
+            self.stats["reads"] += 1
+            if digest in self.entries:
+                self._touch(digest)
+        return data
+
+    def content_type(self, digest):
+        """The MIME type the blob was uploaded with, or None when it had none."""
+        if not self.HASH.match(digest or ""):
+            return None
+        try:
+            with open(self._path(digest) + ".type", "rb") as file:
+                return file.read().decode("ascii")
+        except (OSError, UnicodeDecodeError):
+            return None
+
+    def snapshot(self):
+        with self.lock:
+            self._load()
+            stats = dict(self.stats)
+            stats["blobs"] = len(self.entries)
+            stats["bytes"] = self.total
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+
+BLOB_STORE = BlobStore(BLOB_DIR, int(BLOB_STORE_MAX_MB * 1024 * 1024))
+
+BLOB_IMAGE_REF = re.compile(r"^blob:([0-9a-f]{64})$")
+BLOB_TEXT_REF = re.compile(r"\{\{blob:([0-9a-f]{64})\}\}")
+
+def expand_blob_refs(body_json):
+    """
+    Replaces attachment references in chat messages with the stored bytes:
+    an "images" entry "blob:<sha256>" becomes the blob's base64, and
+    "{{blob:<sha256>}}" inside a string content becomes the blob's UTF-8 text.
+    Returns True when anything was replaced; raises MissingBlobsError listing
+    every reference that is not in the store.
+    """
+    expanded, missing = {}, []
+
+    def load(digest):
+        if digest not in expanded:
+            data = BLOB_STORE.get(digest)
+            if data is None:
+                missing.append(digest)
+            expanded[digest] = data
+        return expanded[digest]
+
+    changed = False
+    for message in body_json.get("messages") or []:
+        if not isinstance(message, dict):
+            continue
+        images = message.get("images")
+        if isinstance(images, list):
+            for i, image in enumerate(images):
+                match = BLOB_IMAGE_REF.match(image) if isinstance(image, str) else None
+                if match:
+                    data = load(match.group(1))
+                    images[i] = base64.b64encode(data).decode("ascii") if data is not None else image
+                    changed = True
+        content = message.get("content")
+        if isinstance(content, str) and "{{blob:" in content:
+            def text(match):
+                data = load(match.group(1))
+                return data.decode("utf-8", errors="replace") if data is not None else match.group(0)
+            message["content"] = BLOB_TEXT_REF.sub(text, content)
+            changed = True
+    if missing:
+        raise MissingBlobsError(sorted(set(missing)))
+    if expanded:
+        with BLOB_STORE.lock:
+            BLOB_STORE.stats["expanded"] += len(expanded)
+    return changed
+
+# --- Document ingestion ---
+
+CHUNK_UNITS = ("tokens", "chars")
+# New chunks of a document being (re-)ingested are stored under doc_id + this suffix until the ingest commits
+STAGING_SUFFIX = "#staging"
+# Preferred places to end a chunk, best first; searched for in the last quarter of the budget
+CHUNK_BREAKS = ("\n\n", "\n", "。", ". ", "！", "？", "! ", "? ", "；", "; ", "，", ", ", " ")
+
+def _char_costs(text, unit):
+    """Per-character cost of `text` in the given unit; "tokens" counts CJK characters as 1 and others as 1/4."""
+    if unit == "chars":
+        return np.ones(len(text))
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    cjk = (((codes >= 0x3040) & (codes <= 0x30ff)) | ((codes >= 0x3400) & (codes <= 0x9fff)) |
+           ((codes >= 0xac00) & (codes <= 0xd7af)) | ((codes >= 0xf900) & (codes <= 0xfaff)))
+    return np.where(cjk, 1.0, 0.25)
+
+def estimate_tokens(text):
+    return int(np.ceil(_char_costs(text, "tokens").sum())) if text else 0
+
+def _chunk_end(text, start, end):
+    floor = start + (end - start) * 3 // 4
+    for sep in CHUNK_BREAKS:
+        i = text.rfind(sep, floor, end)
+        if i >= 0:
+            return i + len(sep)
+    return end
+
+def _chunk_start(text, start, end):
+    # Begin an overlapping chunk after a break rather than mid-word
+    for sep in ("\n", "。", ". ", " "):
+        i = text.find(sep, start, end)
+        if i >= 0:
+            return i + len(sep)
+    return start
+
+def iter_chunks(pieces, size=None, overlap=None, unit=None):
+    """
+    Splits text arriving as an iterable of pieces into overlapping chunks of
+    at most `size` units, ending each at the best break in its last quarter.
+    Yields (start, end, text) with character offsets into the whole text.
+    Only a couple of chunks' worth of text is buffered at a time.
+    """
+    size = max(1, int(size or RAG_CHUNK_SIZE))
+    overlap = min(max(0, int(RAG_CHUNK_OVERLAP if overlap is None else overlap)), size // 2)
+    unit = unit or RAG_CHUNK_UNIT
+    if unit not in CHUNK_UNITS:
+        raise ValueError(f"unit must be one of {', '.join(CHUNK_UNITS)}")
+    pieces = iter(pieces)
+    buf, base, done = "", 0, False
+    while not done:
+        piece = next(pieces, None)
+        if piece is None:
+            done = True
+        else:
+            buf += piece
+        if not buf:
+            continue
+        cum = np.concatenate(([0.0], np.cumsum(_char_costs(buf, unit))))
+        start = 0
+        while start < len(buf):
+            remaining = cum[-1] - cum[start]
+            # Wait for more text until the next chunk can choose its break point
+            if not done and remaining < 2 * size:
+                break
+            end = max(start + 1, int(np.searchsorted(cum, cum[start] + size, side="right")) - 1)
+            if end >= len(buf):
+                yield base + start, base + len(buf), buf[start:]
+                start = len(buf)
+                break
+            end = _chunk_end(buf, start, end)
+            yield base + start, base + end, buf[start:end]
+            next_start = end
+            if overlap:
+                next_start = _chunk_start(buf, int(np.searchsorted(cum, cum[end] - overlap, side="left")), end)
+            start = max(next_start, start + 1)
+        buf = buf[start:]
+        base += start
+
+def iter_decoded(stream, length, read_size=65536):
+    """Reads `length` bytes of UTF-8 from a file-like object and yields decoded text pieces."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    remaining = length
+    while remaining > 0:
+        data = stream.read(min(read_size, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield decoder.decode(data)
+    yield decoder.decode(b"", final=True)
+
+def document_id(name):
+    return "doc-" + hashlib.sha256(name.encode("utf-8")).hexdigest()[:16]
+
+def _delete_chunks(conn, doc_id):
+    """Deletes the chunks stored under `doc_id` and drops them from the index."""
+    with MEMORY_INDEX.lock:
+        with conn:
+            ids = [row["id"] for row in conn.execute("SELECT id FROM memories WHERE doc_id = ?", (doc_id,))]
+            conn.execute("DELETE FROM memories WHERE doc_id = ?", (doc_id,))
+        for memory_id in ids:
+            MEMORY_INDEX.remove(memory_id)
+
+def ingest_document(pieces, name, doc_id=None, chunk_size=None, overlap=None, unit=None, category="Document", batch_size=None):
+    """
+    Chunks a document (text given as an iterable of pieces), embeds the
+    chunks in batches and stores each as a memory tied to the document by
+    doc_id, chunk_index and character offsets. Re-ingesting a document
+    (same doc_id, which defaults to one derived from the name) keeps chunks
+    whose SHA-256 is unchanged without embedding them again, stores the new
+    ones and deletes chunks that are gone. New chunks are written under a
+    staging doc_id as they are embedded and moved to the document in the
+    same transaction that deletes the old ones, so searches never see a mix
+    of both versions. Returns a summary.
+    """
+    started = time.time()
+    name = (name or "").strip() or "document"
+    doc_id = doc_id or document_id(name)
+    size = max(1, int(chunk_size or RAG_CHUNK_SIZE))
+    overlap = RAG_CHUNK_OVERLAP if overlap is None else int(overlap)
+    unit = unit or RAG_CHUNK_UNIT
+    batch_size = max(1, int(batch_size or EMBED_BATCH_SIZE))
+    model = get_embed_model()
+    if not model:
+        raise RuntimeError("No embedding model available")
+
+    conn = get_db_connection()
+    staging_id = doc_id + STAGING_SUFFIX
+    # Chunks left staged by an ingest that did not finish
+    _delete_chunks(conn, staging_id)
+    existing = {}  # chunk hash -> [ids] already stored for this document
+    for row in conn.execute("SELECT id, chunk_hash FROM memories WHERE doc_id = ? ORDER BY chunk_index", (doc_id,)):
+        existing.setdefault(row["chunk_hash"], []).append(row["id"])
+    summary = {"doc_id": doc_id, "name": name, "chunks": 0, "added": 0, "unchanged": 0, "removed": 0, "failed": 0}
+    kept = []  # (id, chunk_index, start, end) of unchanged chunks
+    pending = []  # (chunk_index, start, end, text, hash)
+    content_hash = hashlib.sha256()
+    total_chars = 0
+
+    def hashed(pieces):
+        nonlocal total_chars
+        for piece in pieces:
+            content_hash.update(piece.encode("utf-8"))
+            total_chars += len(piece)
+            yield piece
+
+    def store(batch):
+        vectors = get_embeddings([text for _, _, _, text, _ in batch], model)
+        rows = [(item, vec) for item, vec in zip(batch, vectors) if vec]
+        summary["failed"] += len(batch) - len(rows)
+        if not rows:
+            return
+        with MEMORY_INDEX.lock:
+            with conn:
+                ids = [conn.execute(
+                    "INSERT INTO memories (content, category, embedding, embed_model, embed_dim, embed_encoding, embed_scale, "
+                    "doc_id, chunk_index, start_offset, end_offset, chunk_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (text, category, *vector_columns(vec, model), staging_id, index, start, end, digest)).lastrowid
+                    for (index, start, end, text, digest), vec in rows]
+            MEMORY_INDEX.upsert_many((memory_id, vec, model) for memory_id, (_, vec) in zip(ids, rows))
+        summary["added"] += len(rows)
+
+    try:
+        for start, end, text in iter_chunks(hashed(pieces), size, overlap, unit):
+            if not text.strip():
+                continue
+            index = summary["chunks"]
+            digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            summary["chunks"] += 1
+            ids = existing.get(digest)
+            if ids:
+                kept.append((ids.pop(0), index, start, end))
+                summary["unchanged"] += 1
+                continue
+            pending.append((index, start, end, text, digest))
+            if len(pending) >= batch_size:
+                store(pending)
+                pending = []
+        if pending:
+            store(pending)
+    except BaseException:
+        _delete_chunks(conn, staging_id)
+        raise
+
+    stale = [memory_id for ids in existing.values() for memory_id in ids]
+    now = time.time()
+    with MEMORY_INDEX.lock:
+        with conn:
+            # Unchanged chunks may have moved within the document
+            conn.executemany("UPDATE memories SET chunk_index = ?, start_offset = ?, end_offset = ? WHERE id = ?",
+                             [(index, start, end, memory_id) for memory_id, index, start, end in kept])
+            conn.executemany("DELETE FROM memories WHERE id = ?", [(memory_id,) for memory_id in stale])
+            conn.execute("UPDATE memories SET doc_id = ? WHERE doc_id = ?", (doc_id, staging_id))
+            conn.execute(
+                "INSERT INTO documents (id, name, content_hash, size, chunks, chunk_size, chunk_overlap, chunk_unit, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET name = excluded.name, content_hash = excluded.content_hash, "
+                "size = excluded.size, chunks = excluded.chunks, chunk_size = excluded.chunk_size, chunk_overlap = excluded.chunk_overlap, "
+                "chunk_unit = excluded.chunk_unit, updated_at = excluded.updated_at",
+                (doc_id, name, content_hash.hexdigest(), total_chars, summary["chunks"], size, overlap, unit, now, now))
+        for memory_id in stale:
+            MEMORY_INDEX.remove(memory_id)
+    summary["removed"] = len(stale)
+    summary["elapsed_seconds"] = round(time.time() - started, 3)
+    return summary
+
+def search_document(query_text, doc_id, limit=5):
+    """
+    Scores only the chunks of one document against the query and returns
+    the best `limit` as [{"id", "content", "score", "chunk_index", "start",
+    "end"}], best first. Used by chat to include the relevant parts of a
+    large attachment instead of the whole text.
+    """
+    model = get_embed_model()
+    if not model or not query_text or not query_text.strip():
+        return []
+    conn = get_db_connection()
+    chunk_ids = [row["id"] for row in conn.execute("SELECT id FROM memories WHERE doc_id = ?", (doc_id,))]
+    query_vec = get_embedding(query_text, model) if chunk_ids else None
+    if not query_vec:
         return []
+    hits = MEMORY_INDEX.search(query_vec, limit=max(0, int(limit)), threshold=-np.inf, model=model, ids=chunk_ids)
+    if not hits:
+        return []
+    placeholders = ",".join("?" for _ in hits)
+    rows = {row["id"]: row for row in conn.execute(
+        f"SELECT id, content, chunk_index, start_offset, end_offset FROM memories WHERE id IN ({placeholders})",
+        [memory_id for memory_id, _ in hits])}
+    return [{
+        "id": memory_id,
+        "content": rows[memory_id]["content"],
+        "score": score,
+        "chunk_index": rows[memory_id]["chunk_index"],
+        "start": rows[memory_id]["start_offset"],
+        "end": rows[memory_id]["end_offset"]
+    } for memory_id, score in hits if memory_id in rows]
+
+def list_documents():
+    rows = get_db_connection().execute(
+        "SELECT id, name, content_hash, size, chunks, chunk_size, chunk_overlap, chunk_unit, created_at, updated_at "
+        "FROM documents ORDER BY updated_at DESC").fetchall()
+    return [dict(row) for row in rows]
+
+def delete_document(doc_id):
+    """Deletes a document and all of its chunks; returns the number of chunks removed."""
+    conn = get_db_connection()
+    with MEMORY_INDEX.lock:
+        with conn:
+            ids = [row["id"] for row in conn.execute("SELECT id FROM memories WHERE doc_id = ?", (doc_id,))]
+            conn.execute("DELETE FROM memories WHERE doc_id = ?", (doc_id,))
+            conn.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+        for memory_id in ids:
+            MEMORY_INDEX.remove(memory_id)
+    return len(ids)
+
+# --- Context budget ---
+
+CONTEXT_SUMMARY_HEADER = "[系统提示：以下是较早对话的摘要]"
+# Template tokens counted per message on top of its text, and what one attached image is counted as
+MESSAGE_TOKEN_OVERHEAD = 4
+IMAGE_TOKENS = 768
+CONTEXT_SUMMARY_PROMPT = """
+Summarize the earlier part of a conversation so the summary can replace those messages in later prompts.
+Keep facts, decisions, names, numbers, code identifiers, user preferences and open questions; drop greetings and repetition.
+Write short bullet points in the conversation's language, at most {words} words, and output only the summary.
+{previous}
+Conversation:
+{transcript}
+"""
+_PROMPT_EVAL_COUNT = re.compile(rb'"prompt_eval_count":\s*(\d+)')
+_PROMPT_EVAL_DURATION = re.compile(rb'"prompt_eval_duration":\s*(\d+)')
+
+def _message_digest(message):
+    return hashlib.sha256(json.dumps(message, sort_keys=True, ensure_ascii=False).encode("utf-8")).digest()
+
+def _chain(seed, digests):
+    """Running hashes: entry k identifies the seed and the first k messages."""
+    chain = [seed]
+    for digest in digests:
+        chain.append(hashlib.sha256(chain[-1] + digest).digest())
+    return chain
+
+def format_summary_context(summary):
+    return f"{CONTEXT_SUMMARY_HEADER}\n{summary}\n[摘要结束]\n"
+
+def chat_transcript(messages):
+    lines = []
+    for message in messages:
+        role = {"user": "User", "assistant": "Assistant", "tool": "Tool", "system": "System"}.get(message.get("role"), "Message")
+        content = message.get("content") if isinstance(message.get("content"), str) else ""
+        if message.get("tool_calls"):
+            content += "\n[tool calls] " + json.dumps(message["tool_calls"], ensure_ascii=False)
+        if message.get("images"):
+            content += f"\n[{len(message['images'])} image(s)]"
+        lines.append(f"{role}: {content.strip()}")
+    return "\n\n".join(lines)
+
+
+class ContextBudget:
+    """
+    Budgeted /api/chat. A request carrying a "budget" field (true or
+    {"tokens", "num_ctx", "summary_model"}) is fitted into num_ctx minus the
+    reply reserve. Leading system prompts stay first; retrieved-memory
+    messages, which change every turn, move down next to the current turn so
+    everything before them stays byte-identical and Ollama can reuse its KV
+    cache for it. Only when the history no longer fits are its older turns
+    replaced by a rolling summary, cut so the kept tail takes about half of
+    the free budget. The summary is cached under the hash of the messages it
+    covers and reused until the budget runs out again, so the prompt prefix
+    stays stable for several turns; the next summary folds the previous one
+    in. Per-message token estimates are cached by message hash.
+    """
+
+    def __init__(self, size, reserve=0.25, summary_model=""):
+        self.size = size
+        self.reserve = reserve
+        self.summary_model = summary_model
+        self.lock = threading.Lock()
+        self.tokens = OrderedDict()      # message digest -> estimated tokens
+        self.summaries = OrderedDict()   # (summary model, history chain hash) -> (text, tokens)
+        self.prompts = {}                # model -> {prompt chain hash: tokens up to it} of the last prompt sent
+        self.rates = {}                  # model -> seconds per prompt token, moving average
+        self.stats = {"requests": 0, "trimmed": 0, "over_budget": 0, "summaries_made": 0, "summaries_reused": 0,
+                      "summary_errors": 0, "tokens_before": 0, "tokens_after": 0, "reused_prefix_tokens": 0,
+                      "saved_tokens": 0, "saved_seconds": 0.0, "prompt_eval_tokens": 0, "prompt_eval_seconds": 0.0,
+                      "token_cache_hits": 0, "token_cache_misses": 0}
+
+    def _remember(self, cache, key, value):
+        with self.lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.size:
+                cache.popitem(last=False)
+
+    def message_tokens(self, message, digest):
+        with self.lock:
+            tokens = self.tokens.get(digest)
+            if tokens is not None:
+                self.tokens.move_to_end(digest)
+                self.stats["token_cache_hits"] += 1
+                return tokens
+            self.stats["token_cache_misses"] += 1
+        content = message.get("content")
+        tokens = MESSAGE_TOKEN_OVERHEAD + (estimate_tokens(content) if isinstance(content, str) else 0)
+        if message.get("tool_calls"):
+            tokens += estimate_tokens(json.dumps(message["tool_calls"], ensure_ascii=False))
+        tokens += IMAGE_TOKENS * len(message.get("images") or [])
+        self._remember(self.tokens, digest, tokens)
+        return tokens
+
+    def apply(self, body_json):
+        """
+        Fits body_json["messages"] into the budget in place. Returns the
+        report sent back to the client, or None when no budget was asked for.
+        """
+        options = body_json.pop("budget", None)
+        if not options:
+            return None
+        if not isinstance(options, dict):
+            options = {}
+        messages = body_json.get("messages")
+        if not isinstance(messages, list) or not all(isinstance(m, dict) for m in messages):
+            raise ValueError("messages must be a list of objects")
+        model = body_json.get("model") or ""
+        model_options = body_json.get("options") or {}
+        num_ctx = int(options.get("num_ctx") or model_options.get("num_ctx") or 2048)
+        num_predict = int(model_options.get("num_predict") or 0)
+        reserve = min(num_predict, num_ctx // 2) if num_predict > 0 else int(num_ctx * self.reserve)
+        budget = int(options.get("tokens") or num_ctx - reserve)
+        if budget <= 0:
+            raise ValueError("budget tokens must be positive")
+        summary_model = options.get("summary_model") or self.summary_model or model
+
+        start = 0
+        while start < len(messages) and messages[start].get("role") == "system":
+            start += 1
+        volatile = [m for m in messages[:start] if str(m.get("content", "")).startswith(RAG_CONTEXT_HEADER)]
+        head = [m for m in messages[:start] if not str(m.get("content", "")).startswith(RAG_CONTEXT_HEADER)]
+        history = messages[start:]
+        users = [i for i, m in enumerate(history) if m.get("role") == "user"]
+        turn = users[-1] if users else len(history)
+
+        head_digests = [_message_digest(m) for m in head]
+        volatile_digests = [_message_digest(m) for m in volatile]
+        history_digests = [_message_digest(m) for m in history]
+        history_tokens = [self.message_tokens(m, d) for m, d in zip(history, history_digests)]
+        tools = body_json.get("tools")
+        tools_json = json.dumps(tools, sort_keys=True, ensure_ascii=False) if tools else ""
+        fixed = (estimate_tokens(tools_json) + sum(self.message_tokens(m, d) for m, d in zip(head, head_digests)) +
+                 sum(self.message_tokens(m, d) for m, d in zip(volatile, volatile_digests)))
+        suffix = np.concatenate([np.cumsum(history_tokens[::-1])[::-1], [0]]).astype(int) if history else np.zeros(1, dtype=int)
+        before = fixed + int(suffix[0])
+        report = {"budget": budget, "num_ctx": num_ctx, "tokens_before": before, "tokens_after": before,
+                  "summarized_messages": 0, "summary": None}
+
+        cut, summary = 0, None
+        cuts = [i for i in users if 0 < i <= turn]
+        if before > budget and cuts:
+            chain = _chain(b"", history_digests)
+            with self.lock:
+                known = {c: self.summaries[(summary_model, chain[c])] for c in cuts if (summary_model, chain[c]) in self.summaries}
+            for c in reversed(cuts):
+                cached = known.get(c)
+                if cached and fixed + cached[1] + suffix[c] <= budget:
+                    cut, summary = c, cached
+                    report["summary"] = "cached"
+                    break
+            else:
+                allowance = max(64, min(512, budget // 8))
+                target = (budget - fixed - allowance) // 2
+                c = next((i for i in cuts if suffix[i] <= target), cuts[-1])
+                base = max((i for i in known if i < c), default=0)
+                previous = known[base][0] if base else None
+                started = time.perf_counter()
+                try:
+                    text, _ = SHARED_CALLS.call(("context_summary", summary_model, chain[c].hex()), lambda: self.summarize(
+                        summary_model, previous, history[base:c], num_ctx, allowance))
+                except Exception as e:
+                    report["error"] = f"summary failed: {e}"
+                    with self.lock:
+                        self.stats["summary_errors"] += 1
+                else:
+                    message = {"role": "system", "content": format_summary_context(text)}
+                    summary = (text, self.message_tokens(message, _message_digest(message)))
+                    self._remember(self.summaries, (summary_model, chain[c]), summary)
+                    cut = c
+                    report["summary"] = "new"
+                    report["summary_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+        out = list(head)
+        out_digests = list(head_digests)
+        if summary is not None:
+            message = {"role": "system", "content": format_summary_context(summary[0])}
+            out.append(message)
+            out_digests.append(_message_digest(message))
+        out += history[cut:turn] + volatile + history[turn:]
+        out_digests += history_digests[cut:turn] + volatile_digests + history_digests[turn:]
+        messages[:] = out
+        after = fixed + (summary[1] if summary else 0) + int(suffix[cut])
+
+        # Prompt prefix shared with the last prompt sent to this model, which Ollama can take from its KV cache
+        prompt_chain = _chain(hashlib.sha256(tools_json.encode("utf-8")).digest(), out_digests)
+        totals = np.cumsum([0] + [self.message_tokens(m, d) for m, d in zip(out, out_digests)]).tolist()
+        with self.lock:
+            last = self.prompts.get(model, {})
+            reused = next((totals[k] for k in range(len(out), 0, -1) if prompt_chain[k] in last), 0)
+            self.prompts[model] = dict(zip(prompt_chain[1:], totals[1:]))
+            rate = self.rates.get(model)
+        saved = max(0, min(before, num_ctx) - after) + reused
+        report.update({"tokens_after": after, "summarized_messages": cut, "reused_prefix_tokens": reused,
+                       "saved_tokens": saved, "saved_seconds": round(saved * rate, 3) if rate else None,
+                       "over_budget": after > budget})
+
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["trimmed"] += bool(cut)
+            self.stats["over_budget"] += after > budget
+            self.stats["summaries_made"] += report["summary"] == "new"
+            self.stats["summaries_reused"] += report["summary"] == "cached"
+            self.stats["tokens_before"] += before
+            self.stats["tokens_after"] += after
+            self.stats["reused_prefix_tokens"] += reused
+            self.stats["saved_tokens"] += saved
+            self.stats["saved_seconds"] += saved * rate if rate else 0.0
+        return report
+
+    def summarize(self, model, previous, messages, num_ctx, allowance):
+        """Folds `messages` into the previous summary, a piece at a time so each prompt fits num_ctx."""
+        limit = max(256, num_ctx - 2 * allowance - 256)
+        summary = previous
+        piece, piece_tokens = [], 0
+        for message in messages:
+            tokens = self.message_tokens(message, _message_digest(message))
+            if piece and piece_tokens + tokens > limit:
+                summary = self._summary_call(model, summary, piece, num_ctx, allowance)
+                piece, piece_tokens = [], 0
+            piece.append(message)
+            piece_tokens += tokens
+        if piece:
+            summary = self._summary_call(model, summary, piece, num_ctx, allowance)
+        return summary
+
+    def _summary_call(self, model, previous, messages, num_ctx, allowance):
+        prompt = CONTEXT_SUMMARY_PROMPT.format(
+            words=allowance * 3 // 4, transcript=chat_transcript(messages),
+            previous=f"\nSummary of the conversation before this part:\n{previous}\n" if previous else "")
+        payload = {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": False,
+            "options": {"temperature": 0, "num_ctx": num_ctx, "num_predict": allowance}
+        }
+        status, data, _ = fetch_ollama("/api/chat", method="POST", body=json.dumps(payload).encode("utf-8"))
+        if status != 200:
+            raise RuntimeError(f"HTTP {status}")
+        self.observe(model, data)
+        text = (json.loads(data.decode("utf-8")).get("message") or {}).get("content") or ""
+        text = re.sub(r"<think>.*?</think>", "", text, flags=re.S).strip()
+        if not text:
+            raise RuntimeError("empty reply")
+        return text
+
+    def observe(self, model, data):
+        """Learns the model's prompt-eval speed from the final stats at the end of an Ollama /api/chat response."""
+        counts = _PROMPT_EVAL_COUNT.findall(data[-4096:])
+        durations = _PROMPT_EVAL_DURATION.findall(data[-4096:])
+        if not counts or not durations:
+            return
+        count, seconds = int(counts[-1]), int(durations[-1]) / 1e9
+        with self.lock:
+            self.stats["prompt_eval_tokens"] += count
+            self.stats["prompt_eval_seconds"] += seconds
+            if count and seconds:
+                rate = self.rates.get(model)
+                self.rates[model] = seconds / count if rate is None else 0.7 * rate + 0.3 * seconds / count
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["saved_seconds"] = round(stats["saved_seconds"], 3)
+            stats["prompt_eval_seconds"] = round(stats["prompt_eval_seconds"], 3)
+            stats["cached_messages"] = len(self.tokens)
+            stats["cached_summaries"] = len(self.summaries)
+            stats["prompt_eval_ms_per_1k_tokens"] = {model: round(rate * 1e6, 1) for model, rate in self.rates.items()}
+        return stats
+
+
+CONTEXT_BUDGET = ContextBudget(CONTEXT_CACHE_SIZE, CONTEXT_RESERVE, CONTEXT_SUMMARY_MODEL)
+
+# --- Background memory extraction ---
+
+class ActivityTracker:
+    """Counts chats being proxied to Ollama so background work can wait for the backend to go idle."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.active = 0
+        self.last_finished = 0.0
+
+    def begin(self):
+        with self.lock:
+            self.active += 1
+
+    def end(self):
+        with self.lock:
+            self.active -= 1
+            self.last_finished = time.time()
+            if not self.active:
+                self.idle.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """Blocks until no chat is running, or `timeout` seconds pass. Returns True if idle."""
+        with self.lock:
+            return self.idle.wait_for(lambda: not self.active, timeout)
+
+    def idle_for(self):
+        """Seconds since the last chat finished, or 0 while one is running."""
+        with self.lock:
+            return 0.0 if self.active else time.time() - self.last_finished
+
+
+CHAT_ACTIVITY = ActivityTracker()
+
+def extract_memory(model, user_text, assistant_text):
+    """
+    Asks the chat model for one fact worth remembering from an exchange, with
+    the prompt app.js used to send itself. Returns {"content", "category"},
+    None when there is nothing to remember, and raises when Ollama fails.
+    """
+    prompt = f"""
+Analyze the following conversation and extract ONE key fact, user preference, or technical detail that is worth remembering for future context. 
+If nothing is worth remembering (e.g., casual greeting, simple question), return "NULL".
+Also categorize the memory into one of: "User Preference", "Technical", "General", "Project".
+
+Format the output as JSON: {{"content": "...", "category": "..."}}
+
+Conversation:
+User: {user_text}
+Assistant: {assistant_text}
+"""
+    payload = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "stream": False,
+        "options": {"temperature": 0.1}
+    }
+    status, data, _ = fetch_ollama("/api/chat", method="POST", body=json.dumps(payload).encode("utf-8"))
+    if status != 200:
+        raise RuntimeError(f"extraction failed: HTTP {status}")
+    text = (json.loads(data.decode("utf-8")).get("message") or {}).get("content") or ""
+    
+    # Clean up JSON markdown if present
+    text = text.replace("```json", "").replace("```", "").strip()
+    if text.strip('"') == "NULL":
+        return None
+    match = re.search(r"\{.*\}", text, re.S)
+    try:
+        result = json.loads(match.group(0) if match else text)
+    except json.JSONDecodeError:
+        return None
+    content = result.get("content") if isinstance(result, dict) else None
+    if not isinstance(content, str) or not content.strip() or content.strip() == "NULL":
+        return None
+    category = result.get("category")
+    return {"content": content, "category": category if isinstance(category, str) else "General"}
+
+def _percentiles(samples):
+    if not samples:
+        return None
+    p50, p95 = np.percentile(samples, [50, 95])
+    return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "max": round(float(max(samples)), 3)}
+
+
+class MemoryExtractionQueue:
+    """
+    Bounded, persistent queue of finished (user, assistant) exchanges waiting
+    for memory extraction. Jobs are rows in memory_jobs, so pending work
+    survives a restart; enqueue refuses new jobs once `capacity` are waiting.
+    One worker thread runs the extraction call only after chats have been
+    idle for `idle_seconds`, and stores a batch of extracted memories at once
+    through bulk_add_memories (batched embeddings, add_memory's dedup).
+    """
+
+    MAX_ATTEMPTS = 3
+    KEEP_FINISHED = 500
+
+    def __init__(self, capacity, batch_size, idle_seconds):
+        self.capacity = capacity
+        self.batch_size = max(1, batch_size)
+        self.idle_seconds = idle_seconds
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stats = {"enqueued": 0, "rejected": 0, "processed": 0, "added": 0, "duplicates": 0, "nothing_to_remember": 0, "failed": 0}
+        self.wait_seconds = deque(maxlen=200)
+        self.processing_seconds = deque(maxlen=200)
+
+    def start(self):
+        with self.condition:
+            if self.thread is not None:
+                return
+            # Jobs cut off by a restart go back to the queue
+            conn = get_db_connection()
+            with conn:
+                conn.execute("UPDATE memory_jobs SET status = 'pending' WHERE status = 'running'")
+            self.thread = threading.Thread(target=self._worker, name="memory-extraction", daemon=True)
+            self.thread.start()
+
+    def depth(self):
+        return get_db_connection().execute("SELECT COUNT(*) FROM memory_jobs WHERE status IN ('pending', 'running')").fetchone()[0]
+
+    def enqueue(self, model, user_text, assistant_text):
+        """Returns (job id, queue depth), or (None, depth) when the queue is full."""
+        self.start()
+        conn = get_db_connection()
+        with self.condition:
+            depth = self.depth()
+            if depth >= self.capacity:
+                self.stats["rejected"] += 1
+                return None, depth
+            with conn:
+                job_id = conn.execute("INSERT INTO memory_jobs (model, user_text, assistant_text, created_at) VALUES (?, ?, ?, ?)",
+                                      (model, user_text, assistant_text, time.time())).lastrowid
+            self.stats["enqueued"] += 1
+            self.condition.notify()
+        return job_id, depth + 1
+
+    def _wait_for_idle(self):
+        while True:
+            CHAT_ACTIVITY.wait_idle()
+            idle = CHAT_ACTIVITY.idle_for()
+            if idle >= self.idle_seconds:
+                return
+            time.sleep(max(0.1, self.idle_seconds - idle))
+
+    def _next_batch(self):
+        conn = get_db_connection()
+        with self.condition:
+            while True:
+                jobs = conn.execute("SELECT * FROM memory_jobs WHERE status = 'pending' ORDER BY id LIMIT ?", (self.batch_size,)).fetchall()
+                if jobs:
+                    return jobs
+                self.condition.wait()
+
+    def _worker(self):
+        while True:
+            try:
+                self._next_batch()
+                # Jobs that arrive while chats are running join the same batch
+                self._wait_for_idle()
+                self._process(self._next_batch())
+            except Exception as e:
+                print(f"Error in memory extraction worker: {e}")
+                time.sleep(max(1.0, self.idle_seconds))
+
+    def _retry(self, conn, job, reason):
+        attempts = job["attempts"] + 1
+        status = "failed" if attempts >= self.MAX_ATTEMPTS else "pending"
+        with conn:
+            conn.execute("UPDATE memory_jobs SET status = ?, attempts = ?, result = ? WHERE id = ?",
+                         (status, attempts, json.dumps({"error": reason}), job["id"]))
+        if status == "failed":
+            with self.condition:
+                self.stats["failed"] += 1
+        return attempts
+
+    def _process(self, jobs):
+        conn = get_db_connection()
+        extracted = []  # (job, started, item)
+        finished = []  # (job, started, outcome)
+        for job in jobs:
+            # Low priority: let the user's chats go first, also between jobs of one batch
+            self._wait_for_idle()
+            started = time.time()
+            with conn:
+                conn.execute("UPDATE memory_jobs SET status = 'running', started_at = ? WHERE id = ?", (started, job["id"]))
+            try:
+                item = extract_memory(job["model"], job["user_text"], job["assistant_text"])
+            except Exception as e:
+                attempts = self._retry(conn, job, str(e))
+                # Ollama is likely down or overloaded; back off before touching the queue again
+                time.sleep(min(60, self.idle_seconds * 2 ** attempts))
+                continue
+            if item is None:
+                finished.append((job, started, {"status": "nothing_to_remember"}))
+            else:
+                extracted.append((job, started, item))
+        
+        if extracted:
+            summary = bulk_add_memories([item for _, _, item in extracted])
+            if "error" in summary:
+                for job, _, _ in extracted:
+                    self._retry(conn, job, summary["error"])
+            else:
+                for (job, started, item), result in zip(extracted, summary["results"]):
+                    outcome = {key: value for key, value in result.items() if key != "index"}
+                    outcome["content"] = item["content"]
+                    if outcome["status"] == "error":
+                        self._retry(conn, job, outcome.get("reason", "error"))
+                    else:
+                        finished.append((job, started, outcome))
+        
+        if not finished:
+            return
+        now = time.time()
+        with conn:
+            conn.executemany("UPDATE memory_jobs SET status = 'done', result = ?, finished_at = ? WHERE id = ?",
+                             [(json.dumps(outcome, ensure_ascii=False), now, job["id"]) for job, _, outcome in finished])
+            conn.execute("DELETE FROM memory_jobs WHERE status IN ('done', 'failed') AND id NOT IN "
+                         "(SELECT id FROM memory_jobs WHERE status IN ('done', 'failed') ORDER BY id DESC LIMIT ?)", (self.KEEP_FINISHED,))
+        with self.condition:
+            for job, started, outcome in finished:
+                self.stats["processed"] += 1
+                key = {"added": "added", "duplicate": "duplicates"}.get(outcome["status"], "nothing_to_remember")
+                self.stats[key] += 1
+                self.wait_seconds.append(started - job["created_at"])
+                self.processing_seconds.append(now - started)
+
+    def snapshot(self):
+        conn = get_db_connection()
+        counts = {row[0]: row[1] for row in conn.execute("SELECT status, COUNT(*) FROM memory_jobs GROUP BY status")}
+        oldest = conn.execute("SELECT MIN(created_at) FROM memory_jobs WHERE status = 'pending'").fetchone()[0]
+        with self.condition:
+            stats = dict(self.stats)
+            wait_seconds, processing_seconds = list(self.wait_seconds), list(self.processing_seconds)
+        depth = counts.get("pending", 0) + counts.get("running", 0)
+        return {
+            "depth": depth,
+            "pending": counts.get("pending", 0),
+            "running": counts.get("running", 0),
+            "capacity": self.capacity,
+            "oldest_pending_seconds": round(time.time() - oldest, 1) if oldest else None,
+            "backend_busy": CHAT_ACTIVITY.idle_for() < self.idle_seconds,
+            **stats,
+            "wait_seconds": _percentiles(wait_seconds),
+            "processing_seconds": _percentiles(processing_seconds)
+        }
+
+
+MEMORY_QUEUE = MemoryExtractionQueue(MEMORY_QUEUE_SIZE, MEMORY_QUEUE_BATCH, MEMORY_QUEUE_IDLE_SECONDS)
 
 # --- Existing Server Code ---
 
 
+class OllamaConnectionPool:
+    """
+    Thread-safe pool of keep-alive HTTP connections to OLLAMA_BASE_URL.
+    Up to `size` idle connections are kept; extra connections are opened
+    when every pooled one is busy and closed again after use. A request on a
+    reused connection that the server has already closed is retried once on
+    a fresh connection. The asyncio front end keeps its own idle streams in
+    the same pool through open_stream()/stream_request()/release_stream().
+    """
+
+    def __init__(self, base_url, size, connect_timeout, read_timeout):
+        target = urlparse(base_url)
+        self.secure = target.scheme == "https"
+        self.host = target.hostname or "localhost"
+        self.port = target.port or (443 if self.secure else 80)
+        self.prefix = target.path.rstrip("/")
+        self.size = size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.lock = threading.Lock()
+        self.idle = []
+        self.idle_streams = []
+        self.in_use = 0
+        self.stats = {"requests": 0, "reused": 0, "connections_opened": 0, "stale_retries": 0, "connect_seconds": 0.0}
+
+    def _connect(self):
+        connection_class = http.client.HTTPSConnection if self.secure else http.client.HTTPConnection
+        conn = connection_class(self.host, self.port, timeout=self.connect_timeout)
+        started = time.perf_counter()
+        conn.connect()
+        elapsed = time.perf_counter() - started
+        conn.sock.settimeout(self.read_timeout)
+        with self.lock:
+            self.stats["connections_opened"] += 1
+            self.stats["connect_seconds"] += elapsed
+        return conn
+
+    def _acquire(self):
+        with self.lock:
+            self.in_use += 1
+            if self.idle:
+                return self.idle.pop(), True
+        try:
+            return self._connect(), False
+        except BaseException:
+            with self.lock:
+                self.in_use -= 1
+            raise
+
+    def release(self, conn, reusable=True):
+        with self.lock:
+            self.in_use -= 1
+            if reusable and len(self.idle) < self.size:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, path, body=None, headers=None):
+        """Sends a request and returns (conn, response); hand conn back with release() once the body is read."""
+        headers = headers or {"Content-Type": "application/json"}
+        while True:
+            conn, reused = self._acquire()
+            try:
+                conn.request(method, self.prefix + path, body=body, headers=headers)
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError, BrokenPipeError):
+                self.release(conn, reusable=False)
+                if reused:
+                    # Idle keep-alive connection was closed by Ollama; try again on a fresh one
+                    with self.lock:
+                        self.stats["stale_retries"] += 1
+                    continue
+                raise
+            except BaseException:
+                self.release(conn, reusable=False)
+                raise
+            with self.lock:
+                self.stats["requests"] += 1
+                if reused:
+                    self.stats["reused"] += 1
+            return conn, response
+
+    async def open_stream(self):
+        """Event-loop counterpart of _acquire(); returns (reader, writer, reused)."""
+        with self.lock:
+            self.in_use += 1
+            if self.idle_streams:
+                reader, writer = self.idle_streams.pop()
+                return reader, writer, True
+        started = time.perf_counter()
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(
+                self.host, self.port, ssl=ssl.create_default_context() if self.secure else None), self.connect_timeout)
+        except BaseException:
+            with self.lock:
+                self.in_use -= 1
+            raise
+        with self.lock:
+            self.stats["connections_opened"] += 1
+            self.stats["connect_seconds"] += time.perf_counter() - started
+        return reader, writer, False
+
+    def release_stream(self, reader, writer, reusable=True):
+        with self.lock:
+            self.in_use -= 1
+            if reusable and not reader.at_eof() and len(self.idle_streams) < self.size:
+                self.idle_streams.append((reader, writer))
+                return
+        writer.close()
+
+    async def stream_request(self, data):
+        """Sends a raw HTTP/1.1 request from the event loop and returns (reader, writer, head); hand the stream back with release_stream()."""
+        while True:
+            reader, writer, reused = await self.open_stream()
+            try:
+                writer.write(data)
+                await writer.drain()
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.read_timeout)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                self.release_stream(reader, writer, reusable=False)
+                if reused:
+                    with self.lock:
+                        self.stats["stale_retries"] += 1
+                    continue
+                raise
+            except BaseException:
+                self.release_stream(reader, writer, reusable=False)
+                raise
+            with self.lock:
+                self.stats["requests"] += 1
+                if reused:
+                    self.stats["reused"] += 1
+            return reader, writer, head
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["idle"] = len(self.idle) + len(self.idle_streams)
+            stats["in_use"] = self.in_use
+        stats["reuse_rate"] = stats["reused"] / stats["requests"] if stats["requests"] else 0.0
+        stats["connect_seconds"] = round(stats["connect_seconds"], 4)
+        return stats
+
+
+class PooledResponse:
+    """Streaming response that returns its connection to the pool once fully read, or closes it otherwise."""
+
+    def __init__(self, pool, conn, response):
+        self.pool = pool
+        self.conn = conn
+        self.response = response
+        self.status = response.status
+        self.headers = response.headers
+
+    def read(self, amt=None):
+        return self.response.read(amt)
+
+    def read1(self, amt=-1):
+        return self.response.read1(amt)
+
+    def readinto(self, buffer):
+        return self.response.readinto(buffer)
+
+    def fileno(self):
+        return self.conn.sock.fileno()
+
+    def close(self):
+        if self.conn is None:
+            return
+        reusable = self.response.isclosed() and not self.response.will_close
+        if not reusable:
+            self.response.close()
+        self.pool.release(self.conn, reusable=reusable)
+        self.conn = None
+
+
+OLLAMA_POOL = OllamaConnectionPool(OLLAMA_BASE_URL, OLLAMA_POOL_SIZE, OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT)
+
+def _record_ollama_call(path, started, status):
+    path = urlparse(path).path
+    METRICS.observe("ollama_studio_ollama_request_seconds", time.perf_counter() - started, path=path)
+    METRICS.inc("ollama_studio_ollama_requests_total", path=path, status=int(status))
+
 def fetch_ollama(path, method="GET", body=None):
-    url = f"{OLLAMA_BASE_URL}{path}"
-    headers = {"Content-Type": "application/json"}
-    request = Request(url, data=body, method=method, headers=headers)
+    started = time.perf_counter()
+    try:
+        conn, response = OLLAMA_POOL.request(method, path, body=body)
+    except (OSError, http.client.HTTPException) as error:
+        _record_ollama_call(path, started, HTTPStatus.BAD_GATEWAY)
+        payload = json.dumps({"error": str(error)}).encode("utf-8")
+        return HTTPStatus.BAD_GATEWAY, payload, "application/json"
     try:
-        # Increase timeout to 300s (5 minutes) for slower models like DeepSeek
-        with urlopen(request, timeout=300) as response:
-            return response.status, response.read(), response.headers.get("Content-Type", "application/json")
-    except HTTPError as error:
-        return error.code, error.read(), error.headers.get("Content-Type", "application/json")
-    except URLError as error:
+        data = response.read()
+    except (OSError, http.client.HTTPException) as error:
+        OLLAMA_POOL.release(conn, reusable=False)
+        _record_ollama_call(path, started, HTTPStatus.BAD_GATEWAY)
         payload = json.dumps({"error": str(error)}).encode("utf-8")
         return HTTPStatus.BAD_GATEWAY, payload, "application/json"
+    OLLAMA_POOL.release(conn, reusable=not response.will_close)
+    _record_ollama_call(path, started, response.status)
+    return response.status, data, response.headers.get("Content-Type", "application/json")
 
 
 def fetch_ollama_stream(path, method="POST", body=None):
-    url = f"{OLLAMA_BASE_URL}{path}"
-    headers = {"Content-Type": "application/json"}
-    request = Request(url, data=body, method=method, headers=headers)
+    started = time.perf_counter()
     try:
-        # Increase timeout to 300s (5 minutes) for slower models like DeepSeek
-        response = urlopen(request, timeout=300)
-        return response.status, response, response.headers.get("Content-Type", "application/json")
-    except HTTPError as error:
-        return error.code, error, error.headers.get("Content-Type", "application/json")
-    except URLError as error:
+        conn, response = OLLAMA_POOL.request(method, path, body=body)
+    except (OSError, http.client.HTTPException):
+        _record_ollama_call(path, started, HTTPStatus.BAD_GATEWAY)
         return None, None, None
+    _record_ollama_call(path, started, response.status)
+    return response.status, PooledResponse(OLLAMA_POOL, conn, response), response.headers.get("Content-Type", "application/json")
+
+
+def chat_is_deterministic(body_json):
+    """A non-streaming chat with a fixed seed and temperature 0 gives the same reply for the same request."""
+    options = body_json.get("options") or {}
+    return not body_json.get("stream", False) and options.get("seed") is not None and options.get("temperature") == 0
+
+
+def fetch_chat(body, body_json, headers):
+    """Non-streaming /api/chat; deterministic requests are shared and cached by the prepared body (X-Cache tells which)."""
+    if CHAT_CACHE_TTL <= 0 or not chat_is_deterministic(body_json):
+        return fetch_ollama("/api/chat", method="POST", body=body)
+    key = ("chat", hashlib.sha256(body).hexdigest())
+    result, source = SHARED_CALLS.call(key, lambda: fetch_ollama("/api/chat", method="POST", body=body),
+                                       ttl=CHAT_CACHE_TTL, keep=lambda result: result[0] == HTTPStatus.OK)
+    headers["X-Cache"] = source
+    headers["Access-Control-Expose-Headers"] = ", ".join(filter(None, (headers.get("Access-Control-Expose-Headers"), "X-Cache")))
+    return result
 
 
 # --- Web Search Logic ---
 
-def perform_web_search(query, max_results=5):
-    if not DDGS:
-        return {"error": "duckduckgo-search library not installed. Install with: pip install duckduckgo-search"}
-    
-    if not query or not query.strip():
-        return {"error": "Search query is required"}
-    
-    try:
-        results = []
-        # Try multiple backends if one fails or returns empty
-        backends = ['api', 'html', 'lite']
-        last_error = None
-        
+class WebSearch:
+    """
+    DuckDuckGo search for the web_search tool. Results are kept in an LRU
+    for `ttl` seconds, keyed by the normalized query and max_results, so the
+    tool loop repeating a query is answered without a round trip. Backends
+    are tried in order ("fallback") or all at once with the first non-empty
+    answer winning ("race"). Each backend has a circuit breaker: after
+    `failures` consecutive errors it is skipped for `cooldown` seconds, then
+    one request is let through to probe it again. `client_factory` builds the
+    DDGS-compatible client (anything with text(query, max_results, backend))
+    and defaults to DDGS, which makes the class easy to drive with a stub.
+    """
+
+    MODES = ("fallback", "race")
+
+    def __init__(self, backends, mode="fallback", ttl=600.0, size=256, failures=2, cooldown=120.0, client_factory=None):
+        self.lock = threading.Lock()
+        self.backends = list(backends)
+        self.mode = mode if mode in self.MODES else "fallback"
+        self.ttl = ttl
+        self.size = size
+        self.failures = max(1, failures)
+        self.cooldown = cooldown
+        self.client_factory = client_factory
+        self.entries = OrderedDict()  # (query, max_results) -> (stored_at, results)
+        self.breakers = {backend: {"failures": 0, "open_until": 0.0, "probing": False, "last_error": None} for backend in self.backends}
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, 2 * len(self.backends)), thread_name_prefix="web-search")
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "searches": 0, "backend_calls": 0, "backend_errors": 0, "skipped": 0}
+
+    @staticmethod
+    def normalize(query):
+        return " ".join(query.lower().split())
+
+    def _cached(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry[0] < self.ttl:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.stats["misses"] += 1
+            return None
+
+    def _remember(self, key, results):
+        if self.size <= 0 or self.ttl <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.time(), results)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def _client(self):
+        # One client per worker thread, reused across searches; dropped after an error
+        client = getattr(self.local, "client", None)
+        if client is None:
+            factory = self.client_factory or DDGS
+            client = self.local.client = factory()
+        return client
+
+    def _allow(self, backend):
+        """Whether the breaker lets a request through; a cooled-down breaker admits one probe."""
+        now = time.time()
+        with self.lock:
+            breaker = self.breakers[backend]
+            if breaker["failures"] < self.failures:
+                return True
+            if now < breaker["open_until"] or breaker["probing"]:
+                self.stats["skipped"] += 1
+                return False
+            breaker["probing"] = True
+            return True
+
+    def _record(self, backend, error=None):
+        with self.lock:
+            breaker = self.breakers[backend]
+            breaker["probing"] = False
+            if error is None:
+                breaker["failures"] = 0
+                return
+            self.stats["backend_errors"] += 1
+            breaker["failures"] += 1
+            breaker["last_error"] = error
+            if breaker["failures"] >= self.failures:
+                breaker["open_until"] = time.time() + self.cooldown
+
+    def _query_backend(self, backend, query, max_results):
+        """Returns the backend's results as a list (possibly empty); raises when it fails."""
+        with self.lock:
+            self.stats["backend_calls"] += 1
+        try:
+            raw = list(self._client().text(query, max_results=max_results, backend=backend) or [])
+        except Exception as e:
+            self.local.client = None
+            self._record(backend, str(e))
+            raise
+        self._record(backend)
+        return [{"title": r.get("title", ""), "href": r.get("href", ""), "body": r.get("body", "")} for r in raw]
+
+    def _fallback(self, backends, query, max_results):
+        """Tries backends in order; returns None when every breaker is open."""
+        last_error, admitted = None, False
         for backend in backends:
+            # Admitted just before the call, so a cooled-down breaker only spends its probe on a real request
+            if not self._allow(backend):
+                continue
+            admitted = True
             try:
-                with DDGS() as ddgs:
-                    search_results = ddgs.text(query, max_results=max_results, backend=backend)
-                    # Convert generator to list to check if empty
-                    search_results_list = list(search_results)
-                    
-                    if search_results_list:
-                        for r in search_results_list:
-                            results.append({
-                                "title": r.get("title", ""),
-                                "href": r.get("href", ""),
-                                "body": r.get("body", "")
-                            })
-                        break # Found results, stop trying backends
+                results = self._query_backend(backend, query, max_results)
             except Exception as e:
                 last_error = str(e)
-                continue # Try next backend
-                
+                continue
+            if results:
+                return results, None
+        return ([], last_error) if admitted else None
+
+    def _race(self, backends, query, max_results):
+        # Losing backends finish in the pool and still update their breakers
+        if not backends:
+            return None
+        futures = [self.executor.submit(self._query_backend, backend, query, max_results) for backend in backends]
+        last_error = None
+        for future in as_completed(futures):
+            try:
+                results = future.result()
+            except Exception as e:
+                last_error = str(e)
+                continue
+            if results:
+                return results, None
+        return [], last_error
+
+    def search(self, query, max_results=5, mode=None):
+        if not (self.client_factory or DDGS):
+            return {"error": "duckduckgo-search library not installed. Install with: pip install duckduckgo-search"}
+
+        if not query or not query.strip():
+            return {"error": "Search query is required"}
+
+        key = (self.normalize(query), max_results)
+        results = self._cached(key)
+        if results is not None:
+            return {"results": results, "cached": True}
+
+        with self.lock:
+            self.stats["searches"] += 1
+        try:
+            if (mode or self.mode) == "race" and len(self.backends) > 1:
+                # Every admitted backend is queried, so the breakers can all be checked up front
+                outcome = self._race([backend for backend in self.backends if self._allow(backend)], query, max_results)
+            else:
+                outcome = self._fallback(self.backends, query, max_results)
+        except Exception as e:
+            return {"error": f"Search failed: {str(e)}"}
+        if outcome is None:
+            return {"error": "All search backends are failing; retrying after a cooldown."}
+        results, last_error = outcome
+
         if not results:
             error_msg = "No search results found. The search service might be blocked or unavailable."
             if last_error:
                 error_msg += f" Last error: {last_error}"
             return {"error": error_msg}
-            
+
+        self._remember(key, results)
         return {"results": results}
-    except Exception as e:
-        return {"error": f"Search failed: {str(e)}"}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            for breaker in self.breakers.values():
+                breaker.update(failures=0, open_until=0.0, probing=False, last_error=None)
+
+    def snapshot(self):
+        now = time.time()
+        with self.lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self.entries)
+            stats["mode"] = self.mode
+            stats["backends"] = {
+                backend: {
+                    "failures": breaker["failures"],
+                    "open": breaker["failures"] >= self.failures and now < breaker["open_until"],
+                    "retry_in": round(max(0.0, breaker["open_until"] - now), 1) if breaker["failures"] >= self.failures else 0.0,
+                    "probing": breaker["probing"],
+                    "last_error": breaker["last_error"],
+                }
+                for backend, breaker in self.breakers.items()
+            }
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+WEB_SEARCH = WebSearch(WEB_SEARCH_BACKENDS, WEB_SEARCH_MODE, WEB_SEARCH_CACHE_TTL, WEB_SEARCH_CACHE_SIZE,
+                       WEB_SEARCH_FAILURES, WEB_SEARCH_COOLDOWN)
+
+def perform_web_search(query, max_results=5, mode=None):
+    started = time.perf_counter()
+    result = WEB_SEARCH.search(query, max_results=max_results, mode=mode)
+    outcome = "error" if "error" in result else "cached" if result.get("cached") else "ok"
+    METRICS.observe("ollama_studio_web_search_seconds", time.perf_counter() - started, outcome=outcome)
+    return result
+
+# --- Static assets ---
+
+class StaticAssets:
+    """
+    index.html, styles.css and app.js held in memory together with gzip and
+    (when the brotli package is installed) brotli copies compressed once at
+    the highest level. A file is re-read only when its mtime or size changes.
+    Each representation has a strong ETag derived from the file's hash.
+    """
+
+    CONTENT_TYPES = {
+        ".html": "text/html; charset=utf-8",
+        ".css": "text/css; charset=utf-8",
+        ".js": "application/javascript; charset=utf-8",
+    }
+
+    def __init__(self, root, names, max_age=0):
+        self.lock = threading.Lock()
+        self.root = root
+        self.names = set(names)
+        self.max_age = max_age
+        self.assets = {}  # name -> (mtime_ns, size, asset)
+        self.stats = {"loads": 0, "responses": 0, "not_modified": 0, "bytes_sent": 0, "bytes_uncompressed": 0}
+
+    @staticmethod
+    def _compress(data):
+        encoded = {"identity": data}
+        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(compressed) < len(data):
+            encoded["gzip"] = compressed
+        if brotli is not None:
+            compressed = brotli.compress(data, quality=11)
+            if len(compressed) < len(data):
+                encoded["br"] = compressed
+        return encoded
+
+    def _load(self, name, path):
+        with open(path, "rb") as file:
+            data = file.read()
+        digest = hashlib.sha256(data).hexdigest()[:20]
+        bodies = self._compress(data)
+        return {
+            "content_type": self.CONTENT_TYPES.get(os.path.splitext(name)[1], "text/plain"),
+            "bodies": bodies,
+            "etags": {coding: f'"{digest}"' if coding == "identity" else f'"{digest}-{coding}"' for coding in bodies},
+        }
+
+    def get(self, name):
+        """Returns the cached asset for `name`, reloading it if the file changed; None if it is missing."""
+        if name not in self.names:
+            return None
+        path = os.path.join(self.root, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.assets.get(name)
+        if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            return entry[2]
+        asset = self._load(name, path)
+        with self.lock:
+            self.assets[name] = (stat.st_mtime_ns, stat.st_size, asset)
+            self.stats["loads"] += 1
+        return asset
+
+    @staticmethod
+    def negotiate(accept_encoding, bodies):
+        """Picks br, then gzip, then identity among the codings the client accepts (q > 0)."""
+        accepted = {}
+        for part in (accept_encoding or "").split(","):
+            coding, _, params = part.strip().partition(";")
+            q = 1.0
+            params = params.strip()
+            if params.startswith("q="):
+                try:
+                    q = float(params[2:])
+                except ValueError:
+                    q = 0.0
+            if coding:
+                accepted[coding.strip().lower()] = q
+        for coding in ("br", "gzip"):
+            if coding in bodies and accepted.get(coding, accepted.get("*", 0.0)) > 0:
+                return coding
+        return "identity"
+
+    @staticmethod
+    def matches(if_none_match, etags):
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return not tags.isdisjoint(etags.values())
+
+    def headers(self, etag):
+        cache_control = f"public, max-age={self.max_age}" if self.max_age > 0 else "no-cache"
+        return {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+
+    def record(self, sent, uncompressed, not_modified=False):
+        with self.lock:
+            self.stats["responses"] += 1
+            self.stats["not_modified"] += not_modified
+            self.stats["bytes_sent"] += sent
+            self.stats["bytes_uncompressed"] += uncompressed
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["assets"] = {name: {coding: len(body) for coding, body in entry[2]["bodies"].items()} for name, entry in self.assets.items()}
+        stats["brotli"] = brotli is not None
+        return stats
+
+
+STATIC_ASSETS = StaticAssets(BASE_DIR, ["index.html", "styles.css", "app.js"], STATIC_MAX_AGE)
+
+# Gauges and counters mirrored from state the subsystems already keep, read when /metrics is scraped
+METRICS.define("ollama_studio_memory_rows", "gauge", "Memories in the vector index.", MEMORY_INDEX.size)
+METRICS.define("ollama_studio_memory_queue_depth", "gauge", "Memory extraction jobs pending or running.", MEMORY_QUEUE.depth)
+METRICS.define("ollama_studio_chats_active", "gauge", "Chats currently proxied to Ollama.", lambda: CHAT_ACTIVITY.active)
+METRICS.define("ollama_studio_ollama_pool_connections", "gauge", "Pooled Ollama connections, by state.", lambda: {
+    (("state", state),): OLLAMA_POOL.snapshot()[state] for state in ("idle", "in_use")})
+METRICS.define("ollama_studio_embedding_cache_lookups_total", "counter", "Embedding cache lookups, by result.", lambda: {
+    (("result", result),): value for result, value in EMBEDDING_CACHE.snapshot().items() if result in ("hits", "persistent_hits", "misses")})
+METRICS.define("ollama_studio_web_search_cache_lookups_total", "counter", "Web search cache lookups, by result.", lambda: {
+    (("result", result),): value for result, value in WEB_SEARCH.snapshot().items() if result in ("hits", "misses")})
+METRICS.define("ollama_studio_web_search_backend_open", "gauge", "1 while a search backend's circuit breaker is open.", lambda: {
+    (("backend", backend),): int(state["open"]) for backend, state in WEB_SEARCH.snapshot()["backends"].items()})
+METRICS.define("ollama_studio_shared_call_lookups_total", "counter", "Shared backend call lookups, by kind and result (hits, shared, calls).", lambda: {
+    (("kind", kind), ("result", result)): counters[result]
+    for kind, counters in SHARED_CALLS.snapshot()["kinds"].items() for result in ("hits", "shared", "calls")})
+METRICS.define("ollama_studio_context_tokens_total", "counter", "Estimated prompt tokens of budgeted chats, by kind (before and after fitting, reused prefix, saved).", lambda: {
+    (("kind", kind),): stats[key] for stats in [CONTEXT_BUDGET.snapshot()]
+    for kind, key in (("before", "tokens_before"), ("after", "tokens_after"), ("reused_prefix", "reused_prefix_tokens"), ("saved", "saved_tokens"))})
+METRICS.define("ollama_studio_reembed_remaining", "gauge", "Memories still to be re-embedded after an embed model change.",
+               lambda: REEMBED.snapshot().get("remaining", 0))
+METRICS.define("ollama_studio_blob_store_bytes", "gauge", "Bytes held in the attachment blob store.", lambda: BLOB_STORE.snapshot()["bytes"])
+METRICS.define("ollama_studio_static_bytes_sent_total", "counter", "Static asset bytes sent after compression.", lambda: STATIC_ASSETS.snapshot()["bytes_sent"])
+
+def instrumented(method):
+    """Wraps a do_* handler to count the request, time it and write its timing log entry."""
+    def handle(self):
+        self.started = time.perf_counter()
+        self.status_code = None
+        self.timing = {}
+        METRICS.begin_request()
+        METRICS.inc("ollama_studio_http_requests_in_flight")
+        try:
+            return method(self)
+        finally:
+            elapsed = time.perf_counter() - self.started
+            route = METRICS.route(self.path)
+            METRICS.end_request({"ts": round(time.time(), 3), "method": self.command, "route": route,
+                                 "status": self.status_code, "seconds": round(elapsed, 6), **self.timing})
+            METRICS.inc("ollama_studio_http_requests_in_flight", -1)
+            METRICS.inc("ollama_studio_http_requests_total", method=self.command, route=route, status=self.status_code or 0)
+            METRICS.observe("ollama_studio_http_request_seconds", elapsed, method=self.command, route=route)
+    handle.__name__ = method.__name__
+    handle.__doc__ = method.__doc__
+    return handle
 
 class OllamaHandler(BaseHTTPRequestHandler):
-    def send_bytes(self, status, content_type, data):
+    # Streamed tokens are small writes; don't let Nagle hold them back
+    disable_nagle_algorithm = True
+
+    def send_response(self, code, message=None):
+        self.status_code = int(code)
+        super().send_response(code, message)
+
+    def send_bytes(self, status, content_type, data, headers=None):
         self.send_response(status)
         self.send_header("Content-Type", content_type)
         self.send_header("Content-Length", str(len(data)))
         self.send_header("Access-Control-Allow-Origin", "*")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.end_headers()
         self.wfile.write(data)
 
-    def send_json(self, status, payload):
+    def send_json(self, status, payload, headers=None):
         data = json.dumps(payload).encode("utf-8")
-        self.send_bytes(status, "application/json", data)
+        self.send_bytes(status, "application/json", data, headers=headers)
+
+    def send_chunked(self, status, content_type, blocks, headers=None):
+        """
+        Sends an iterable of byte blocks with chunked encoding as they are
+        produced. An error mid-stream leaves out the terminating chunk, so
+        the client sees a truncated body rather than a complete one.
+        """
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            for block in blocks:
+                if block:
+                    self.wfile.write(b"%X\r\n%s\r\n" % (len(block), block))
+        except Exception as e:
+            print(f"Error streaming {self.path}: {e}")
+            self.close_connection = True
+            return
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def iter_body_lines(self):
+        """Yields the request body line by line without reading it all into memory."""
+        remaining = int(self.headers.get("Content-Length", "0"))
+        while remaining > 0:
+            line = self.rfile.readline(remaining)
+            if not line:
+                break
+            remaining -= len(line)
+            yield line
+
+    def relay_chunked(self, response, observe=None):
+        """
+        Forwards a streaming upstream body as chunked encoding. read1 returns
+        whatever has arrived instead of waiting for a full block, and each
+        chunk is framed in one reused buffer and sent with a single write.
+        With CHAT_COALESCE_MS set, reads that arrive within the window are
+        merged into one chunk. Time to the first upstream bytes and the bytes
+        relayed are recorded in METRICS. `observe`, when given, is called with
+        the last few KB of the body once it is relayed.
+        """
+        window = CHAT_COALESCE_MS / 1000
+        frame = bytearray()
+        payload = bytearray()
+        tail = b""
+        deadline = None
+        relayed = 0
+        try:
+            while True:
+                data = response.read1(CHAT_RELAY_READ_SIZE)
+                if observe is not None:
+                    tail = (tail + data)[-4096:]
+                if data:
+                    if not relayed:
+                        first_byte = time.perf_counter() - self.started
+                        METRICS.observe("ollama_studio_chat_first_byte_seconds", first_byte)
+                        self.timing["first_byte_seconds"] = round(first_byte, 6)
+                    relayed += len(data)
+                    if not window:
+                        frame.clear()
+                        frame += b"%X\r\n" % len(data)
+                        frame += data
+                        frame += b"\r\n"
+                        self.wfile.write(frame)
+                        continue
+                    payload += data
+                    if deadline is None:
+                        deadline = time.monotonic() + window
+                    remaining = deadline - time.monotonic()
+                    # Keep reading while more bytes show up before the window closes
+                    if remaining > 0 and select.select([response], [], [], remaining)[0]:
+                        continue
+                if payload:
+                    frame.clear()
+                    frame += b"%X\r\n" % len(payload)
+                    frame += payload
+                    frame += b"\r\n"
+                    self.wfile.write(frame)
+                    payload.clear()
+                    deadline = None
+                if not data:
+                    break
+        finally:
+            METRICS.inc("ollama_studio_chat_relayed_bytes_total", relayed)
+            self.timing["relayed_bytes"] = relayed
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+        if observe is not None:
+            observe(tail)
+
+    def read_json_items(self):
+        """Reads a request body that is either a JSON array or NDJSON (one object per line)."""
+        remaining = int(self.headers.get("Content-Length", "0"))
+        content_type = self.headers.get("Content-Type", "")
+        if "ndjson" not in content_type and "jsonl" not in content_type:
+            body = self.rfile.read(remaining) if remaining else b""
+            try:
+                items = json.loads(body) if body else []
+            except json.JSONDecodeError:
+                raise ValueError("Invalid JSON")
+            if not isinstance(items, list):
+                raise ValueError("Expected a JSON array")
+            return items
+        items = []
+        line_no = 0
+        while remaining > 0:
+            line = self.rfile.readline(remaining)
+            if not line:
+                break
+            remaining -= len(line)
+            line_no += 1
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError:
+                raise ValueError(f"Invalid JSON on line {line_no}")
+        return items
 
+    @instrumented
     def do_OPTIONS(self):
         self.send_response(HTTPStatus.NO_CONTENT)
         self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, PUT, OPTIONS")
         self.send_header("Access-Control-Allow-Headers", "Content-Type")
         self.end_headers()
 
+    @instrumented
     def do_GET(self):
-        if self.path.startswith("/api/models"):
-            status, data, _ = fetch_ollama("/api/tags")
-            if status >= 400:
-                self.send_bytes(status, "application/json", data)
-                return
+        if self.path == "/metrics":
+            self.send_bytes(HTTPStatus.OK, "text/plain; version=0.0.4; charset=utf-8", METRICS.render().encode("utf-8"))
+            return
+
+        if self.path == "/api/models/details":
             try:
-                payload = json.loads(data.decode("utf-8"))
-                models = [item.get("name") for item in payload.get("models", []) if item.get("name")]
+                models, _ = SHARED_CALLS.call(("model_details",), describe_models, ttl=RESPONSE_CACHE_TTL)
                 self.send_json(HTTPStatus.OK, {"models": models})
-            except json.JSONDecodeError:
-                self.send_json(HTTPStatus.BAD_GATEWAY, {"models": []})
+            except Exception as e:
+                self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
             return
 
         if self.path == "/api/models/tool-capable":
             try:
-                model = find_best_tool_model()
+                model, _ = SHARED_CALLS.call(("tool_model",), find_best_tool_model, ttl=RESPONSE_CACHE_TTL, keep=bool)
                 if model:
                     self.send_json(HTTPStatus.OK, {"model": model})
                 else:
@@ -470,42 +4759,147 @@ class OllamaHandler(BaseHTTPRequestHandler):
                 self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
             return
 
+        if self.path.startswith("/api/models"):
+            refresh = parse_qs(urlparse(self.path).query).get("refresh", ["0"])[0] == "1"
+            if refresh:
+                SHARED_CALLS.forget("model_details")
+                SHARED_CALLS.forget("tool_model")
+            status, models, error_body = MODEL_REGISTRY.list_tags(force=refresh)
+            if status >= 400:
+                self.send_bytes(status, "application/json", error_body)
+                return
+            self.send_json(HTTPStatus.OK, {"models": [item["name"] for item in models]})
+            return
+
         if self.path == "/api/rag/status":
             try:
                 model = get_embed_model()
-                self.send_json(HTTPStatus.OK, {"model": model})
+                self.send_json(HTTPStatus.OK, {"model": model, "lexical": FTS_ENABLED, "index": MEMORY_INDEX.snapshot(),
+                                               "embedding_cache": EMBEDDING_CACHE.snapshot(), "reembed": REEMBED.snapshot()})
+            except Exception as e:
+                self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+            return
+
+        if self.path == "/api/rag/queue":
+            try:
+                self.send_json(HTTPStatus.OK, MEMORY_QUEUE.snapshot())
+            except Exception as e:
+                self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+            return
+
+        if self.path == "/api/stats":
+            self.send_json(HTTPStatus.OK, {
+                "ollama_pool": OLLAMA_POOL.snapshot(),
+                "embedding_cache": EMBEDDING_CACHE.snapshot(),
+                "web_search": WEB_SEARCH.snapshot(),
+                "static": STATIC_ASSETS.snapshot(),
+                "blobs": BLOB_STORE.snapshot(),
+                "shared_calls": SHARED_CALLS.snapshot(),
+                "context_budget": CONTEXT_BUDGET.snapshot()
+            })
+            return
+
+        if self.path.startswith("/api/blobs/"):
+            digest = urlparse(self.path).path.rsplit("/", 1)[-1]
+            data = BLOB_STORE.get(digest)
+            if data is None:
+                self.send_json(HTTPStatus.NOT_FOUND, {"error": "Unknown blob"})
+                return
+            if self.headers.get("If-None-Match") == f'"{digest}"':
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_header("ETag", f'"{digest}"')
+                self.end_headers()
+                return
+            # Served with the type stored at upload, never one from the request; anything
+            # that could run script on this origin is downloaded instead of rendered
+            headers = {"ETag": f'"{digest}"', "Cache-Control": "public, max-age=31536000, immutable",
+                       "X-Content-Type-Options": "nosniff", "Content-Security-Policy": "default-src 'none'; sandbox"}
+            content_type = BLOB_STORE.content_type(digest)
+            if not content_type or not BLOB_STORE.SAFE_TYPES.match(content_type):
+                content_type = "application/octet-stream"
+                headers["Content-Disposition"] = f'attachment; filename="{digest}"'
+            self.send_bytes(HTTPStatus.OK, content_type, data, headers=headers)
+            return
+
+        if self.path == "/api/rag/documents":
+            try:
+                self.send_json(HTTPStatus.OK, {"documents": list_documents()})
             except Exception as e:
                 self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
             return
 
-        if self.path == "/api/rag/memories":
+        if urlparse(self.path).path == "/api/rag/memories":
+            params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
             try:
-                memories = get_all_memories()
-                self.send_json(HTTPStatus.OK, {"memories": memories})
+                page = list_memories(limit=params.get("limit", 100), cursor=params.get("cursor"), category=params.get("category"),
+                                     since=params.get("since"), until=params.get("until"))
+                self.send_json(HTTPStatus.OK, page)
+            except ValueError as e:
+                self.send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
             except Exception as e:
                 self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
             return
 
+        if urlparse(self.path).path == "/api/rag/export":
+            params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+            try:
+                blocks = export_memories(encoding=params.get("encoding", "float16"), category=params.get("category"),
+                                         since=params.get("since"), until=params.get("until"))
+            except ValueError as e:
+                self.send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+                return
+            filename = time.strftime("memories-%Y%m%d-%H%M%S.ndjson")
+            self.send_chunked(HTTPStatus.OK, "application/x-ndjson", blocks,
+                              headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+            return
+
         file_path = urlparse(self.path).path
         if file_path in ["", "/"]:
             file_path = "/index.html"
         if file_path not in ["/index.html", "/styles.css", "/app.js"]:
             file_path = "/index.html"
-        full_path = os.path.join(BASE_DIR, file_path.lstrip("/"))
-        if not os.path.exists(full_path):
+        self.send_static(file_path.lstrip("/"))
+
+    def send_static(self, name):
+        asset = STATIC_ASSETS.get(name)
+        if asset is None:
             self.send_json(HTTPStatus.NOT_FOUND, {"error": "Not Found"})
             return
-        with open(full_path, "rb") as file:
-            data = file.read()
-        content_type = "text/plain"
-        if file_path.endswith(".html"):
-            content_type = "text/html; charset=utf-8"
-        elif file_path.endswith(".css"):
-            content_type = "text/css; charset=utf-8"
-        elif file_path.endswith(".js"):
-            content_type = "application/javascript; charset=utf-8"
-        self.send_bytes(HTTPStatus.OK, content_type, data)
+        coding = STATIC_ASSETS.negotiate(self.headers.get("Accept-Encoding"), asset["bodies"])
+        headers = STATIC_ASSETS.headers(asset["etags"][coding])
+        if STATIC_ASSETS.matches(self.headers.get("If-None-Match"), asset["etags"]):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            for header, value in headers.items():
+                self.send_header(header, value)
+            self.end_headers()
+            STATIC_ASSETS.record(0, 0, not_modified=True)
+            return
+        data = asset["bodies"][coding]
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+        self.send_bytes(HTTPStatus.OK, asset["content_type"], data, headers=headers)
+        STATIC_ASSETS.record(len(data), len(asset["bodies"]["identity"]))
+
+    @instrumented
+    def do_PUT(self):
+        if self.path == "/api/blobs":
+            length = int(self.headers.get("Content-Length", "0"))
+            if length > BLOB_MAX_MB * 1024 * 1024:
+                self.send_json(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": f"Blobs are limited to {BLOB_MAX_MB:g} MB"})
+                return
+            data = self.rfile.read(length) if length else b""
+            if not data:
+                self.send_json(HTTPStatus.BAD_REQUEST, {"error": "Empty body"})
+                return
+            try:
+                digest, existing = BLOB_STORE.put(data, self.headers.get("Content-Type"))
+                self.send_json(HTTPStatus.OK, {"hash": digest, "size": len(data), "existing": existing})
+            except Exception as e:
+                self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+            return
+        self.send_json(HTTPStatus.NOT_FOUND, {"error": "Not Found"})
 
+    @instrumented
     def do_POST(self):
         if self.path == "/api/rag/query":
             length = int(self.headers.get("Content-Length", "0"))
@@ -515,9 +4909,114 @@ class OllamaHandler(BaseHTTPRequestHandler):
                 query = data.get("query", "")
                 limit = data.get("limit", 5)
                 threshold = data.get("threshold", 0.35)
+                if data.get("doc_id"):
+                    results = search_document(query, data["doc_id"], limit=limit)
+                    self.send_json(HTTPStatus.OK, {"results": results, "mode": "document"})
+                    return
+                mode = data.get("mode") or RAG_SEARCH_MODE
+                if mode not in SEARCH_MODES:
+                    self.send_json(HTTPStatus.BAD_REQUEST, {"error": f"mode must be one of {', '.join(SEARCH_MODES)}"})
+                    return
                 
-                results = search_memory(query, limit=limit, threshold=threshold)
-                self.send_json(HTTPStatus.OK, {"results": results})
+                results = search_memory(query, limit=limit, threshold=threshold, mode=mode,
+                                        category=data.get("category"), since=data.get("since"), until=data.get("until"))
+                self.send_json(HTTPStatus.OK, {"results": results, "mode": mode})
+            except ValueError as e:
+                self.send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+            except Exception as e:
+                self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+            return
+
+        if self.path.split("?", 1)[0] == "/api/rag/ingest":
+            length = int(self.headers.get("Content-Length", "0"))
+            try:
+                if "json" in self.headers.get("Content-Type", ""):
+                    # {"text"} or {"blob": sha256 from PUT /api/blobs}, plus the options below
+                    options = json.loads(self.rfile.read(length) if length else b"{}")
+                    if options.get("blob"):
+                        data = BLOB_STORE.get(options["blob"])
+                        if data is None:
+                            self.send_json(HTTPStatus.CONFLICT, {"error": "Unknown blob", "missing_blobs": [options["blob"]]})
+                            return
+                        pieces = [data.decode("utf-8", errors="replace")]
+                    elif isinstance(options.get("text"), str):
+                        pieces = [options["text"]]
+                    else:
+                        raise ValueError("text or blob is required")
+                else:
+                    # Raw text/markdown body, streamed; options come from the query string
+                    options = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+                    pieces = iter_decoded(self.rfile, length)
+                summary = ingest_document(
+                    pieces, options.get("name"), doc_id=options.get("doc_id"),
+                    chunk_size=options.get("chunk_size"), overlap=options.get("overlap"), unit=options.get("unit"),
+                    category=options.get("category") or "Document")
+                self.send_json(HTTPStatus.OK, summary)
+            except (ValueError, json.JSONDecodeError) as e:
+                self.send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+            except Exception as e:
+                self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+            return
+
+        if self.path.split("?", 1)[0] == "/api/rag/import":
+            params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+            try:
+                summary = import_memories(self.iter_body_lines(), batch_size=params.get("batch_size", 500),
+                                          skip_existing=params.get("skip_existing", "1") != "0")
+                self.send_json(HTTPStatus.OK, summary)
+            except ValueError as e:
+                self.send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+            except Exception as e:
+                self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+            return
+
+        if self.path == "/api/rag/documents/delete":
+            length = int(self.headers.get("Content-Length", "0"))
+            body = self.rfile.read(length) if length else b""
+            try:
+                data = json.loads(body)
+                removed = delete_document(data.get("doc_id"))
+                self.send_json(HTTPStatus.OK, {"success": removed > 0, "removed": removed})
+            except Exception as e:
+                self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+            return
+
+        if self.path == "/api/rag/extract":
+            length = int(self.headers.get("Content-Length", "0"))
+            body = self.rfile.read(length) if length else b""
+            try:
+                data = json.loads(body)
+                model, user_text, assistant_text = data.get("model"), data.get("user"), data.get("assistant")
+            except (json.JSONDecodeError, AttributeError):
+                self.send_json(HTTPStatus.BAD_REQUEST, {"error": "Invalid JSON"})
+                return
+            if not all(isinstance(value, str) and value.strip() for value in (model, user_text, assistant_text)):
+                self.send_json(HTTPStatus.BAD_REQUEST, {"error": "model, user and assistant are required"})
+                return
+            try:
+                job_id, depth = MEMORY_QUEUE.enqueue(model, user_text, assistant_text)
+                if job_id is None:
+                    # Backpressure: the client may retry later; nothing was stored
+                    self.send_json(HTTPStatus.TOO_MANY_REQUESTS, {"error": "Memory extraction queue is full", "depth": depth},
+                                   headers={"Retry-After": str(max(1, int(MEMORY_QUEUE_IDLE_SECONDS * 10)))})
+                    return
+                self.send_json(HTTPStatus.ACCEPTED, {"job_id": job_id, "depth": depth})
+            except Exception as e:
+                self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+            return
+
+        if urlparse(self.path).path == "/api/rag/bulk_add":
+            try:
+                items = self.read_json_items()
+            except ValueError as e:
+                self.send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+                return
+            try:
+                query = parse_qs(urlparse(self.path).query)
+                batch_size = int(query.get("batch_size", [EMBED_BATCH_SIZE])[0])
+                summary = bulk_add_memories(items, batch_size=batch_size)
+                status = HTTPStatus.SERVICE_UNAVAILABLE if "error" in summary else HTTPStatus.OK
+                self.send_json(status, summary)
             except Exception as e:
                 self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
             return
@@ -535,6 +5034,20 @@ class OllamaHandler(BaseHTTPRequestHandler):
                 self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
             return
             
+        if self.path == "/api/rag/dedup":
+            length = int(self.headers.get("Content-Length", "0"))
+            body = self.rfile.read(length) if length else b""
+            try:
+                data = json.loads(body) if body else {}
+                summary = dedup_memories(data.get("threshold", 0.9), dry_run=bool(data.get("dry_run", False)),
+                                         keep=data.get("keep", "oldest"))
+                self.send_json(HTTPStatus.OK, summary)
+            except (ValueError, TypeError) as e:
+                self.send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+            except Exception as e:
+                self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+            return
+
         if self.path == "/api/rag/clear":
             try:
                 success = clear_all_memories()
@@ -593,56 +5106,479 @@ class OllamaHandler(BaseHTTPRequestHandler):
                 self.send_json(HTTPStatus.BAD_REQUEST, {"error": "Invalid JSON"})
                 return
 
-            if is_stream:
-                status, response, content_type = fetch_ollama_stream("/api/chat", method="POST", body=body)
-                if response is None:
-                    self.send_json(HTTPStatus.BAD_GATEWAY, {"error": "Connection Failed"})
-                    return
+            try:
+                body, rag_results, context = prepare_chat_request(body, body_json)
+            except MissingBlobsError as e:
+                self.send_json(HTTPStatus.CONFLICT, {"error": str(e), "missing_blobs": e.missing})
+                return
+            except ValueError as e:
+                self.send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+                return
+            except Exception as e:
+                self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+                return
+            extra_headers = rag_response_headers(rag_results, context)
+            # Budgeted chats learn the model's prompt-eval speed from the final stats line
+            observe = (lambda data: CONTEXT_BUDGET.observe(body_json.get("model") or "", data)) if context is not None else None
+
+            CHAT_ACTIVITY.begin()
+            try:
+                if is_stream:
+                    status, response, content_type = fetch_ollama_stream("/api/chat", method="POST", body=body)
+                    if response is None:
+                        self.send_json(HTTPStatus.BAD_GATEWAY, {"error": "Connection Failed"})
+                        return
                 
-                # If status is error, don't use chunked encoding, just send the body
-                if status >= 400:
+                    # If status is error, don't use chunked encoding, just send the body
+                    if status >= 400:
+                        try:
+                            error_body = response.read()
+                            self.send_bytes(status, content_type, error_body)
+                        finally:
+                            response.close()
+                        return
+
+                    self.send_response(status)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Access-Control-Allow-Origin", "*")
+                    self.send_header("Transfer-Encoding", "chunked")
+                    for name, value in extra_headers.items():
+                        self.send_header(name, value)
+                    self.end_headers()
+
                     try:
-                        error_body = response.read()
-                        self.send_bytes(status, content_type, error_body)
+                        if rag_results is not None or context is not None:
+                            event = rag_stream_event(rag_results, context)
+                            self.wfile.write(b"%X\r\n%s\r\n" % (len(event), event))
+                        self.relay_chunked(response, observe)
+                    except Exception:
+                        pass
                     finally:
                         response.close()
                     return
+                else:
+                    status, data, content_type = fetch_chat(body, body_json, extra_headers)
+                    if observe is not None and status == HTTPStatus.OK:
+                        observe(data)
+                    self.send_bytes(status, content_type, data, headers=extra_headers)
+                    return
+            finally:
+                CHAT_ACTIVITY.end()
+        self.send_json(HTTPStatus.NOT_FOUND, {"error": "Not Found"})
 
-                self.send_response(status)
-                self.send_header("Content-Type", content_type)
-                self.send_header("Access-Control-Allow-Origin", "*")
-                self.send_header("Transfer-Encoding", "chunked")
-                self.end_headers()
 
-                try:
-                    while True:
-                        chunk = response.read(4096)
-                        if not chunk:
-                            break
-                        # chunked encoding format: hex(length)\r\nchunk\r\n
-                        self.wfile.write(f"{len(chunk):X}\r\n".encode("utf-8"))
-                        self.wfile.write(chunk)
-                        self.wfile.write(b"\r\n")
-                        self.wfile.flush()
-                    self.wfile.write(b"0\r\n\r\n")
-                    self.wfile.flush()
-                except Exception:
-                    pass
-                finally:
-                    response.close()
+class PooledHTTPServer(HTTPServer):
+    """
+    ThreadingHTTPServer with a fixed number of worker threads. When every
+    worker is busy the accept loop waits, leaving new connections in the
+    kernel backlog instead of spawning unbounded threads. A connection that
+    waits longer than `queue_timeout`, or arrives during shutdown(), gets a
+    503 so the loop never blocks indefinitely.
+    """
+
+    def __init__(self, server_address, handler_class, workers, queue_timeout=SERVER_QUEUE_TIMEOUT):
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="studio-worker")
+        self.slots = threading.BoundedSemaphore(workers)
+        self.queue_timeout = queue_timeout
+        self.stopping = threading.Event()
+
+    def process_request(self, request, client_address):
+        deadline = time.monotonic() + self.queue_timeout
+        # Wait in short slices so shutdown() is noticed while every worker is busy
+        while not self.slots.acquire(timeout=min(0.5, max(deadline - time.monotonic(), 0))):
+            if self.stopping.is_set() or time.monotonic() >= deadline:
+                self._reject(request)
                 return
+        self.executor.submit(self._work, request, client_address)
+
+    def _reject(self, request):
+        METRICS.inc("ollama_studio_http_rejected_total")
+        data = json.dumps({"error": "Server busy, try again later"}).encode("utf-8")
+        try:
+            request.sendall(b"HTTP/1.1 503 Service Unavailable\r\nContent-Type: application/json\r\nRetry-After: 1\r\n"
+                            b"Content-Length: %d\r\nConnection: close\r\n\r\n%s" % (len(data), data))
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def shutdown(self):
+        self.stopping.set()
+        super().shutdown()
+
+    def _work(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+
+class _LoopBody(io.RawIOBase):
+    """
+    The request as a worker thread reads it: the already parsed head, then
+    up to `length` body bytes pulled from the event loop's StreamReader as
+    the handler asks for them, so uploads are never held in memory whole.
+    """
+
+    def __init__(self, head, reader, length, loop):
+        self.head = head
+        self.reader = reader
+        self.remaining = length
+        self.loop = loop
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.head:
+            n = min(len(buffer), len(self.head))
+            buffer[:n] = self.head[:n]
+            self.head = self.head[n:]
+            return n
+        if self.remaining <= 0:
+            return 0
+        data = asyncio.run_coroutine_threadsafe(self.reader.read(min(len(buffer), self.remaining)), self.loop).result()
+        if not data:
+            self.remaining = 0
+            return 0
+        self.remaining -= len(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class _LoopConnection:
+    """Socket stand-in that lets OllamaHandler run in a worker thread while the event loop owns the real socket."""
+
+    def __init__(self, request, loop, writer):
+        self.request = request  # binary file-like holding the request head and body
+        self.loop = loop
+        self.writer = writer
+
+    def makefile(self, mode, buffering=None):
+        return self.request
+
+    def sendall(self, data):
+        asyncio.run_coroutine_threadsafe(self._write(bytes(data)), self.loop).result()
+
+    async def _write(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def settimeout(self, timeout):
+        pass
+
+    def setsockopt(self, *args):
+        pass
+
+
+class AsyncioStudioServer:
+    """
+    asyncio front end. Streaming /api/chat is relayed on the event loop
+    without a thread per connection; every other request is handed to
+    OllamaHandler on a bounded thread pool, reading its body from the
+    connection as it goes (imports, ingestion and blob uploads stream).
+    """
+
+    def __init__(self, server_address, handler_class, workers):
+        self.address = server_address
+        self.handler_class = handler_class
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="studio-worker")
+        self.loop = None
+        self.server = None
+        self.server_address = None
+        self.ready = threading.Event()
+
+    def serve_forever(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.handle_connection, *self.address))
+        self.server_address = self.server.sockets[0].getsockname()[:2]
+        self.ready.set()
+        try:
+            self.loop.run_until_complete(self.server.serve_forever())
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
+
+    def shutdown(self):
+        if self.loop and self.server:
+            self.loop.call_soon_threadsafe(self.server.close)
+
+    def server_close(self):
+        self.executor.shutdown(wait=False)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            headers = {}
+            for line in head.decode("latin-1").split("\r\n")[1:]:
+                if ":" in line:
+                    name, value = line.split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+            method, target = head.split(b" ", 2)[:2]
+            length = int(headers.get("content-length", "0"))
+            if method == b"POST" and urlparse(target.decode("latin-1")).path == "/api/chat":
+                body = await reader.readexactly(length) if length else b""
+                if await self.relay_chat(body, writer):
+                    return
+                request = io.BytesIO(head + body)
             else:
-                status, data, content_type = fetch_ollama("/api/chat", method="POST", body=body)
-                self.send_bytes(status, content_type, data)
+                request = io.BufferedReader(_LoopBody(head, reader, length, self.loop))
+            peer = writer.get_extra_info("peername") or ("", 0)
+            connection = _LoopConnection(request, self.loop, writer)
+            await self.loop.run_in_executor(self.executor, self.handler_class, connection, peer[:2], self)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, ConnectionError):
+            pass
+        except Exception as e:
+            print(f"Error handling connection: {e}")
+        finally:
+            writer.close()
+
+    async def relay_chat(self, body, writer):
+        """Streams a /api/chat response straight from Ollama. Returns False to fall back to OllamaHandler."""
+        try:
+            body_json = json.loads(body) if body else {}
+            is_stream = body_json.get("stream", False)
+        except (json.JSONDecodeError, AttributeError):
+            return False
+        if not is_stream:
+            return False
+        
+        started = time.perf_counter()
+        try:
+            (body, rag_results, context), stages = await self.loop.run_in_executor(self.executor, METRICS.collect, prepare_chat_request, body, body_json)
+        except Exception as e:
+            # OllamaHandler repeats the preparation and reports the error to the client properly
+            print(f"Preparing streamed chat failed, falling back to a worker thread: {e}")
+            METRICS.inc("ollama_studio_chat_relay_fallbacks_total")
+            return False
+        timing = {"status": None}
+        METRICS.inc("ollama_studio_http_requests_in_flight")
+        try:
+            return await self.relay_upstream(body, rag_results, writer, started, timing, context, body_json.get("model") or "")
+        finally:
+            elapsed = time.perf_counter() - started
+            status = timing.pop("status")
+            METRICS.log_request({"ts": round(time.time(), 3), "method": "POST", "route": "/api/chat",
+                                 "status": status, "seconds": round(elapsed, 6), **timing}, stages)
+            METRICS.inc("ollama_studio_http_requests_in_flight", -1)
+            METRICS.inc("ollama_studio_http_requests_total", method="POST", route="/api/chat", status=status or 0)
+            METRICS.observe("ollama_studio_http_request_seconds", elapsed, method="POST", route="/api/chat")
+
+    async def relay_upstream(self, body, rag_results, writer, started, timing, context=None, model=""):
+        """Relays the prepared chat request to Ollama; the response status and relay statistics go into `timing`."""
+        extra_headers = b"".join(b"%s: %s\r\n" % (name.encode("latin-1"), value.encode("latin-1"))
+                                 for name, value in rag_response_headers(rag_results, context).items())
+        
+        request = b"POST %s HTTP/1.1\r\nHost: %s:%d\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s" % (
+            (OLLAMA_POOL.prefix + "/api/chat").encode("latin-1"), OLLAMA_POOL.host.encode("latin-1"), OLLAMA_POOL.port, len(body), body)
+        upstream_started = time.perf_counter()
+        try:
+            upstream_reader, upstream_writer, head = await OLLAMA_POOL.stream_request(request)
+        except (OSError, EOFError, asyncio.LimitOverrunError) as e:
+            _record_ollama_call("/api/chat", upstream_started, HTTPStatus.BAD_GATEWAY)
+            timing["status"] = HTTPStatus.BAD_GATEWAY.value
+            data = json.dumps({"error": str(e) or "Connection Failed"}).encode("utf-8")
+            writer.write(b"HTTP/1.1 502 Bad Gateway\r\nContent-Type: application/json\r\nAccess-Control-Allow-Origin: *\r\n"
+                         b"Content-Length: %d\r\nConnection: close\r\n\r\n%s" % (len(data), data))
+            await writer.drain()
+            return True
+        
+        CHAT_ACTIVITY.begin()
+        complete = False
+        headers = {}
+        try:
+            status_line, *header_lines = head.decode("latin-1").split("\r\n")
+            status = int(status_line.split(" ", 2)[1])
+            timing["status"] = status
+            _record_ollama_call("/api/chat", upstream_started, status)
+            for line in header_lines:
+                if ":" in line:
+                    name, value = line.split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+            content_type = headers.get("content-type", "application/json")
+            
+            if status >= 400:
+                # Error bodies are small; send them with a Content-Length like send_bytes does
+                data = b"".join([part async for part in _upstream_body(upstream_reader, headers)])
+                complete = True
+                writer.write(b"HTTP/1.1 %d %s\r\nContent-Type: %s\r\nAccess-Control-Allow-Origin: *\r\n"
+                             b"Content-Length: %d\r\nConnection: close\r\n\r\n" % (
+                                 status, HTTPStatus(status).phrase.encode("latin-1"), content_type.encode("latin-1"), len(data)))
+                writer.write(data)
+                await writer.drain()
+                return True
+            
+            writer.write(b"HTTP/1.1 %d %s\r\nContent-Type: %s\r\nAccess-Control-Allow-Origin: *\r\n%s"
+                         b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n" % (
+                             status, HTTPStatus(status).phrase.encode("latin-1"), content_type.encode("latin-1"), extra_headers))
+            if rag_results is not None or context is not None:
+                event = rag_stream_event(rag_results, context)
+                writer.write(b"%X\r\n%s\r\n" % (len(event), event))
+            relayed = 0
+            tail = b""
+            async for data in _upstream_body(upstream_reader, headers):
+                if context is not None:
+                    tail = (tail + data)[-4096:]
+                if not relayed:
+                    first_byte = time.perf_counter() - started
+                    METRICS.observe("ollama_studio_chat_first_byte_seconds", first_byte)
+                    timing["first_byte_seconds"] = round(first_byte, 6)
+                relayed += len(data)
+                timing["relayed_bytes"] = relayed
+                writer.write(b"%X\r\n%s\r\n" % (len(data), data))
+                await writer.drain()
+            complete = True
+            if context is not None:
+                CONTEXT_BUDGET.observe(model, tail)
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+            return True
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            return True
+        finally:
+            # The upstream stream goes back to the pool only if its response was read to the end
+            reusable = complete and headers.get("connection", "").lower() != "close" and (
+                "chunked" in headers.get("transfer-encoding", "").lower() or "content-length" in headers)
+            OLLAMA_POOL.release_stream(upstream_reader, upstream_writer, reusable=reusable)
+            CHAT_ACTIVITY.end()
+            METRICS.inc("ollama_studio_chat_relayed_bytes_total", timing.get("relayed_bytes", 0))
+
+
+async def _upstream_body(reader, headers):
+    """Yields an upstream response body as it arrives, undoing chunked framing; ends once the whole body is read."""
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            if size == 0:
+                # Skip any trailers up to the blank line that ends the response
+                while await reader.readuntil(b"\r\n") != b"\r\n":
+                    pass
                 return
-        self.send_json(HTTPStatus.NOT_FOUND, {"error": "Not Found"})
+            while size:
+                data = await reader.read(min(size, 65536))
+                if not data:
+                    raise asyncio.IncompleteReadError(b"", size)
+                size -= len(data)
+                yield data
+            await reader.readexactly(2)
+    elif "content-length" in headers:
+        remaining = int(headers["content-length"])
+        while remaining:
+            data = await reader.read(min(remaining, 65536))
+            if not data:
+                raise asyncio.IncompleteReadError(b"", remaining)
+            remaining -= len(data)
+            yield data
+    else:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            yield data
+
+
+def make_server(mode=None, host="0.0.0.0", port=8000):
+    mode = (mode or SERVER_MODE).lower()
+    if mode == "single":
+        return HTTPServer((host, port), OllamaHandler)
+    if mode == "asyncio":
+        return AsyncioStudioServer((host, port), OllamaHandler, SERVER_WORKERS)
+    if mode != "threaded":
+        print(f"Unknown SERVER_MODE {mode!r}, using threaded")
+    return PooledHTTPServer((host, port), OllamaHandler, SERVER_WORKERS)
 
 
 def run():
     port = int(os.environ.get("PORT", "8000"))
-    server = HTTPServer(("0.0.0.0", port), OllamaHandler)
+    server = make_server(port=port)
+    # Map (or rebuild) the vector index now rather than on the first query; queries wait for it
+    threading.Thread(target=MEMORY_INDEX.ensure_loaded, daemon=True).start()
+    # Pick up extraction jobs left over from the last run
+    MEMORY_QUEUE.start()
+    # Check the embed model against the stored vectors, resuming an interrupted re-embedding
+    REEMBED.start()
     server.serve_forever()
 
 
-if __name__ == "__main__":
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ollama Studio server")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("serve", help="run the web server (default)")
+    reencode = commands.add_parser("reencode", help="convert stored vectors to another encoding")
+    reencode.add_argument("encoding", choices=VECTOR_ENCODINGS)
+    reencode.add_argument("--batch-size", type=int, default=500)
+    reencode.add_argument("--vacuum", action="store_true", help="VACUUM afterwards to return the freed space to the filesystem")
+    dedup = commands.add_parser("dedup", help="delete near-duplicate memories, keeping one per cluster")
+    dedup.add_argument("--threshold", type=float, default=0.9, help="cosine similarity at which memories count as duplicates")
+    dedup.add_argument("--keep", choices=DEDUP_KEEP, default="oldest")
+    dedup.add_argument("--dry-run", action="store_true", help="report the clusters without deleting anything")
+    export = commands.add_parser("export", help="write memories and their vectors as NDJSON")
+    export.add_argument("--out", default="-", help="file to write, or - for stdout")
+    export.add_argument("--encoding", choices=EXPORT_ENCODINGS, default="float16")
+    export.add_argument("--category", help="one category or a comma-separated list")
+    export.add_argument("--since", help="created on or after this date (YYYY-MM-DD[ HH:MM[:SS]])")
+    export.add_argument("--until", help="created before this date")
+    load = commands.add_parser("import", help="load an NDJSON export")
+    load.add_argument("path", help="file to read, or - for stdin")
+    load.add_argument("--batch-size", type=int, default=500)
+    load.add_argument("--keep-duplicates", action="store_true", help="import memories whose content is already stored")
+    vectors = commands.add_parser("vectors", help="maintain the memory-mapped .vec index files (run while the server is stopped)")
+    vectors.add_argument("action", choices=("check", "compact", "rebuild"))
+    args = parser.parse_args(argv)
+    
+    if args.command == "reencode":
+        summary = reencode_memories(args.encoding, batch_size=args.batch_size)
+        if args.vacuum:
+            get_db_connection().execute("VACUUM")
+        print(json.dumps(summary))
+        return
+    if args.command == "dedup":
+        print(json.dumps(dedup_memories(args.threshold, dry_run=args.dry_run, keep=args.keep), ensure_ascii=False, indent=2))
+        return
+    if args.command == "export":
+        blocks = export_memories(args.encoding, category=args.category, since=args.since, until=args.until)
+        out = sys.stdout.buffer if args.out == "-" else open(args.out, "wb")
+        try:
+            for block in blocks:
+                out.write(block)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+        return
+    if args.command == "import":
+        source = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+        try:
+            summary = import_memories(source, batch_size=args.batch_size, skip_existing=not args.keep_duplicates)
+        finally:
+            if source is not sys.stdin.buffer:
+                source.close()
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        return
+    if args.command == "vectors":
+        if args.action == "rebuild":
+            MEMORY_INDEX.rebuild()
+        elif args.action == "compact":
+            print(f"Reclaimed {MEMORY_INDEX.compact()} tombstoned rows")
+        else:
+            problems = MEMORY_INDEX.verify()
+            for problem in problems[:20]:
+                print(problem)
+            if problems:
+                print(f"{len(problems)} differences, rebuilding from SQLite")
+                MEMORY_INDEX.rebuild()
+        print(json.dumps(MEMORY_INDEX.snapshot()))
+        return
     run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Shared fixtures: a fake Ollama (benchmarks/fake_ollama.py) for the whole
+session, and a freshly imported server module per test, pointed at it and
+at an empty memory.db in the test's tmp_path. server.py reads its
+configuration at import time, so each test loads its own copy.
+"""
+import importlib.util
+import os
+import sys
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from fake_ollama import FakeOllama
+
+EMBED_DIM = 32
+
+
+@pytest.fixture(scope="session")
+def fake_ollama():
+    fake = FakeOllama(dim=EMBED_DIM, models=2, tokens=4, token_interval=0.0)
+    fake.base_url = fake.start()
+    yield fake
+    fake.stop()
+
+
+def load_server(db_path, **env):
+    """Imports server.py as a new module with memory.db at `db_path` and the given settings."""
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update({name: str(value) for name, value in env.items()})
+    os.environ["MEMORY_DB_PATH"] = str(db_path)
+    try:
+        spec = importlib.util.spec_from_file_location("server", os.path.join(ROOT, "server.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    return module
+
+
+@pytest.fixture
+def make_server(tmp_path, fake_ollama, monkeypatch):
+    monkeypatch.setenv("OLLAMA_BASE_URL", fake_ollama.base_url)
+
+    def make(name="memory.db", **env):
+        return load_server(tmp_path / name, **env)
+    return make
+
+
+@pytest.fixture
+def server(make_server):
+    return make_server()
+
+
+@pytest.fixture
+def serve(server):
+    """Starts `server` in the given SERVER_MODE on a free port and returns its base URL."""
+    started = []
+    server.OllamaHandler.log_message = lambda *args: None
+
+    def start(mode="threaded"):
+        httpd = server.make_server(mode, host="127.0.0.1", port=0)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        if mode == "asyncio":
+            httpd.ready.wait(5)
+        started.append(httpd)
+        return f"http://127.0.0.1:{httpd.server_address[1]}"
+    yield start
+    for httpd in started:
+        httpd.shutdown()
+        httpd.server_close()
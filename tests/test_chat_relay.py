@@ -0,0 +1,78 @@
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+from conftest import EMBED_DIM
+from fake_ollama import FakeOllama
+
+TOKEN_INTERVAL = 0.15
+
+
+@pytest.fixture(scope="module")
+def slow_ollama():
+    fake = FakeOllama(dim=EMBED_DIM, models=2, tokens=4, token_interval=TOKEN_INTERVAL)
+    fake.base_url = fake.start()
+    yield fake
+    fake.stop()
+
+
+def read_chunks(port, body):
+    """Posts a chat and returns [(seconds since sending, chunk payload)] as the chunks arrive."""
+    sock = socket.create_connection(("127.0.0.1", port), timeout=10)
+    data = json.dumps(body).encode("utf-8")
+    started = time.monotonic()
+    sock.sendall(b"POST /api/chat HTTP/1.1\r\nHost: test\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s" % (len(data), data))
+    stream = sock.makefile("rb")
+    assert stream.readline().split()[1] == b"200"
+    while stream.readline() != b"\r\n":
+        pass
+    chunks = []
+    while True:
+        size = int(stream.readline(), 16)
+        if not size:
+            break
+        chunks.append((time.monotonic() - started, stream.read(size)))
+        stream.readline()
+    sock.close()
+    return chunks
+
+
+def start(make_server, slow_ollama, **env):
+    server = make_server(OLLAMA_BASE_URL=slow_ollama.base_url, **env)
+    server.OllamaHandler.log_message = lambda *args: None
+    httpd = server.make_server("threaded", host="127.0.0.1", port=0)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return server, httpd
+
+
+CHAT = {"model": "llama3.1:8b", "stream": True, "messages": [{"role": "user", "content": "hi"}]}
+
+
+def test_tokens_are_relayed_as_they_arrive(make_server, slow_ollama):
+    server, httpd = start(make_server, slow_ollama)
+    try:
+        chunks = read_chunks(httpd.server_address[1], CHAT)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+    lines = [json.loads(line) for _, payload in chunks for line in payload.splitlines()]
+    assert "".join(line["message"]["content"] for line in lines) == "tok0 tok1 tok2 tok3 "
+    # One chunk per upstream token, each sent on arrival rather than after the whole response
+    assert len(chunks) == 5
+    assert chunks[-1][0] - chunks[0][0] >= 3 * TOKEN_INTERVAL * 0.8
+    assert server.METRICS.values[("ollama_studio_chat_relayed_bytes_total", ())] == sum(len(payload) for _, payload in chunks)
+
+
+def test_coalescing_merges_reads_within_the_window(make_server, slow_ollama):
+    _, httpd = start(make_server, slow_ollama, CHAT_COALESCE_MS=int(TOKEN_INTERVAL * 1000 * 2.5))
+    try:
+        chunks = read_chunks(httpd.server_address[1], CHAT)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+    lines = [json.loads(line) for _, payload in chunks for line in payload.splitlines()]
+    assert len(lines) == 5 and lines[-1]["done"]
+    assert 1 < len(chunks) < 5
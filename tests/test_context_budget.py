@@ -0,0 +1,56 @@
+import json
+from urllib.request import Request, urlopen
+
+import pytest
+
+
+def history(turns):
+    messages = [{"role": "system", "content": "You are a concise assistant."}]
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"turn {i}: " + "please keep these deployment notes in mind. " * 6})
+        messages.append({"role": "assistant", "content": f"noted {i}: " + "the notes are recorded for later. " * 6})
+    messages.append({"role": "user", "content": "what did we decide?"})
+    return messages
+
+
+def stream_chat(base_url, messages, budget):
+    body = {"model": "llama3.1:8b", "stream": True, "messages": messages, "budget": budget}
+    req = Request(base_url + "/api/chat", data=json.dumps(body).encode("utf-8"), method="POST",
+                  headers={"Content-Type": "application/json"})
+    with urlopen(req) as response:
+        header = dict(part.split("=", 1) for part in response.headers["X-Context-Budget"].split(";"))
+        return header, [json.loads(line) for line in response if line.strip()]
+
+
+@pytest.mark.parametrize("mode", ["threaded", "asyncio"])
+def test_long_chat_is_summarized_then_reused(serve, fake_ollama, mode):
+    base_url = serve(mode)
+    budget = {"tokens": 400, "num_ctx": 2048}
+    messages = history(12)
+    header, lines = stream_chat(base_url, messages, budget)
+    context = lines[0]["context"]
+    assert context["summary"] == "new" and header["summary"] == "new"
+    assert context["summarized_messages"] > 0
+    assert context["tokens_before"] > budget["tokens"] >= context["tokens_after"]
+    assert lines[-1]["done"]
+    # The model saw the summary and the recent turns, not the oldest ones
+    prompt = fake_ollama.prompts["llama3.1:8b"]
+    assert "turn 0:" not in prompt and "turn 11:" in prompt and "what did we decide?" in prompt
+
+    messages += [{"role": "assistant", "content": "We decided to deploy on fridays."}, {"role": "user", "content": "and then?"}]
+    _, lines = stream_chat(base_url, messages, budget)
+    context = lines[0]["context"]
+    assert context["summary"] == "cached"
+    assert context["reused_prefix_tokens"] > 0
+
+
+def test_memories_move_next_to_the_current_turn(server):
+    rag = {"role": "system", "content": server.RAG_CONTEXT_HEADER + "\n- the user prefers tabs"}
+    messages = [{"role": "system", "content": "Be brief."}, rag, {"role": "user", "content": "hello"},
+                {"role": "assistant", "content": "hi"}, {"role": "user", "content": "indentation?"}]
+    body = {"model": "llama3.1:8b", "messages": messages, "budget": True}
+    report = server.CONTEXT_BUDGET.apply(body)
+    assert "budget" not in body
+    assert report["summary"] is None and report["summarized_messages"] == 0
+    assert report["tokens_before"] == report["tokens_after"] <= report["budget"]
+    assert [m["content"] for m in body["messages"]] == ["Be brief.", "hello", "hi", rag["content"], "indentation?"]
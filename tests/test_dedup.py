@@ -0,0 +1,48 @@
+import json
+
+import numpy as np
+
+from conftest import EMBED_DIM
+
+
+def test_dedup_dry_run_matches_real_run(server, capsys):
+    rng = np.random.default_rng(0)
+    base = rng.standard_normal((40, EMBED_DIM)).astype(np.float32)
+    paraphrases = base[:10] + 0.02 * rng.standard_normal((10, EMBED_DIM)).astype(np.float32)
+    contents = [f"distinct memory {i}" for i in range(40)] + [f"paraphrase of memory {i}" for i in range(10)]
+    conn = server.get_db_connection()
+    with conn:
+        conn.executemany("INSERT INTO memories (content, category, embedding, embed_model, embed_dim) VALUES (?, 'General', ?, 'test-embed', ?)",
+                         [(c, v.tobytes(), EMBED_DIM) for c, v in zip(contents, np.concatenate([base, paraphrases]))])
+    server.MEMORY_INDEX.ensure_loaded()
+
+    server.main(["dedup", "--dry-run"])
+    dry = json.loads(capsys.readouterr().out)
+    assert dry["dry_run"] and dry["clusters"] == 10 and dry["removed"] == 10
+    assert conn.execute("SELECT COUNT(*) FROM memories").fetchone()[0] == 50
+
+    real = server.dedup_memories(0.9)
+    assert (real["clusters"], real["removed"], real["rows_after"], real["bytes_after"]) == \
+           (dry["clusters"], dry["removed"], dry["rows_after"], dry["bytes_after"])
+    assert [(c["keep"], c["remove"]) for c in real["sample"]] == [(c["keep"], c["remove"]) for c in dry["sample"]]
+    remaining = {row[0] for row in conn.execute("SELECT content FROM memories")}
+    assert remaining == set(contents[:40])
+    assert server.MEMORY_INDEX.size() == 40
+
+
+def test_dedup_keeps_chained_members_far_from_the_keeper(server):
+    # A~B and B~C are above the threshold but A~C is not: only B duplicates the kept A
+    a = np.zeros(EMBED_DIM, dtype=np.float32)
+    a[0] = 1.0
+    b, c = a.copy(), a.copy()
+    b[:2] = np.cos(0.4), np.sin(0.4)
+    c[:2] = np.cos(0.8), np.sin(0.8)
+    conn = server.get_db_connection()
+    with conn:
+        conn.executemany("INSERT INTO memories (content, category, embedding, embed_model, embed_dim) VALUES (?, 'General', ?, 'test-embed', ?)",
+                         [(content, vec.tobytes(), EMBED_DIM) for content, vec in (("memory A", a), ("memory B", b), ("memory C", c))])
+    assert float(a @ b) >= 0.9 and float(b @ c) >= 0.9 and float(a @ c) < 0.9
+
+    summary = server.dedup_memories(0.9)
+    assert summary["removed"] == 1
+    assert [row[0] for row in conn.execute("SELECT content FROM memories ORDER BY id")] == ["memory A", "memory C"]
@@ -0,0 +1,77 @@
+import pytest
+
+TEXT = " ".join(f"Sentence number {i} talks about topic {i % 7}." for i in range(60))
+
+
+def chunk_contents(server, doc_id):
+    rows = server.get_db_connection().execute(
+        "SELECT content FROM memories WHERE doc_id = ? ORDER BY chunk_index", (doc_id,)).fetchall()
+    return [row["content"] for row in rows]
+
+
+def test_chunks_do_not_depend_on_piece_boundaries(server):
+    whole = list(server.iter_chunks([TEXT], size=120, overlap=20, unit="chars"))
+    pieces = [TEXT[i:i + 37] for i in range(0, len(TEXT), 37)]
+    assert list(server.iter_chunks(pieces, size=120, overlap=20, unit="chars")) == whole
+    assert whole[0][0] == 0 and whole[-1][1] == len(TEXT)
+    for start, end, text in whole:
+        assert text == TEXT[start:end]
+        assert len(text) <= 120
+    # Consecutive chunks overlap without leaving gaps
+    assert all(following[0] <= previous[1] for previous, following in zip(whole, whole[1:]))
+
+
+def test_search_document_scores_only_its_chunks(server):
+    summary = server.ingest_document([TEXT], "notes.txt", chunk_size=120, overlap=0, unit="chars")
+    server.ingest_document(["An unrelated document about something else entirely."], "other.txt", unit="chars")
+    chunks = chunk_contents(server, summary["doc_id"])
+    assert summary["added"] == summary["chunks"] == len(chunks)
+    results = server.search_document(chunks[3], summary["doc_id"], limit=2)
+    assert len(results) == 2
+    assert results[0]["content"] == chunks[3]
+    assert results[0]["chunk_index"] == 3
+    assert results[0]["score"] == pytest.approx(1.0, abs=1e-3)
+    assert TEXT[results[0]["start"]:results[0]["end"]] == chunks[3]
+
+
+def test_reingest_switches_chunks_at_once(server, monkeypatch):
+    doc_id = server.ingest_document([TEXT], "notes.txt", chunk_size=120, overlap=0, unit="chars")["doc_id"]
+    old = chunk_contents(server, doc_id)
+    revised = TEXT.replace("topic 3.", "topic three.")
+    embed = server.get_embeddings
+    seen = []
+
+    def embed_and_look(texts, model):
+        # What readers see while the new version is being embedded
+        seen.append(chunk_contents(server, doc_id))
+        return embed(texts, model)
+
+    monkeypatch.setattr(server, "get_embeddings", embed_and_look)
+    summary = server.ingest_document([revised], "notes.txt", chunk_size=120, overlap=0, unit="chars", batch_size=1)
+    assert summary["added"] > 1 and summary["removed"] > 0
+    assert seen and all(contents == old for contents in seen)
+    new = chunk_contents(server, doc_id)
+    assert len(new) == summary["chunks"]
+    assert all("topic 3." not in content for content in new)
+    assert chunk_contents(server, doc_id + server.STAGING_SUFFIX) == []
+
+
+def test_failed_reingest_keeps_old_chunks(server, monkeypatch):
+    doc_id = server.ingest_document([TEXT], "notes.txt", chunk_size=120, overlap=0, unit="chars")["doc_id"]
+    old = chunk_contents(server, doc_id)
+    embed = server.get_embeddings
+    calls = []
+
+    def fail_second_batch(texts, model):
+        calls.append(texts)
+        if len(calls) == 2:
+            raise RuntimeError("embedding backend went away")
+        return embed(texts, model)
+
+    monkeypatch.setattr(server, "get_embeddings", fail_second_batch)
+    with pytest.raises(RuntimeError):
+        server.ingest_document([TEXT.upper()], "notes.txt", chunk_size=120, overlap=0, unit="chars", batch_size=1)
+    assert chunk_contents(server, doc_id) == old
+    assert chunk_contents(server, doc_id + server.STAGING_SUFFIX) == []
+    monkeypatch.setattr(server, "get_embeddings", embed)
+    assert server.search_document(old[1], doc_id, limit=1)[0]["content"] == old[1]
@@ -0,0 +1,53 @@
+import json
+from urllib.request import Request, urlopen
+
+
+def test_export_import_round_trip(tmp_path, make_server, capsys):
+    source = make_server("source.db")
+    for i in range(30):
+        assert source.add_memory(f"exported memory number {i} about topic {i % 4}", category=f"Topic {i % 4}")
+    source.main(["export", "--out", str(tmp_path / "export.ndjson"), "--encoding", "float32"])
+    lines = (tmp_path / "export.ndjson").read_text(encoding="utf-8").splitlines()
+    assert json.loads(lines[0])["type"] == "header" and len(lines) == 31
+
+    target = make_server("target.db")
+    target.main(["import", str(tmp_path / "export.ndjson")])
+    summary = json.loads(capsys.readouterr().out)
+    assert summary["imported"] == 30 and summary["embedded"] == 0 and not summary["errors"]
+
+    query = "SELECT content, category, created_at, embedding, embed_model, embed_dim FROM memories ORDER BY content"
+    before = [tuple(row) for row in source.get_db_connection().execute(query)]
+    after = [tuple(row) for row in target.get_db_connection().execute(query)]
+    assert after == before
+    hits = target.search_memory("exported memory number 7 about topic 3", limit=1)
+    assert hits[0]["content"] == "exported memory number 7 about topic 3"
+
+    # Importing the same file again skips everything
+    assert target.import_memories(lines)["skipped"] == 30
+
+    # float16 keeps vectors close enough to rank the same memory first
+    half = make_server("half.db")
+    half.import_memories(b"".join(source.export_memories("float16")).splitlines())
+    assert half.search_memory("exported memory number 7 about topic 3", limit=1)[0]["content"] == hits[0]["content"]
+
+
+def test_import_streams_through_asyncio_front_end(server, serve, monkeypatch):
+    for i in range(300):
+        assert server.add_memory(f"memory sent through the asyncio server, number {i}", category="Streamed")
+    export = b"".join(server.export_memories("float16"))
+    server.clear_all_memories()
+
+    reads = []
+    readinto = server._LoopBody.readinto
+    monkeypatch.setattr(server._LoopBody, "readinto", lambda self, buffer: reads.append(len(buffer)) or readinto(self, buffer))
+    base_url = serve("asyncio")
+    # Chunked pieces on the client side; the handler pulls the body from the event loop as it parses lines
+    req = Request(base_url + "/api/rag/import", data=iter([export[i:i + 1000] for i in range(0, len(export), 1000)]),
+                  method="POST", headers={"Content-Type": "application/x-ndjson", "Content-Length": str(len(export))})
+    with urlopen(req) as response:
+        summary = json.load(response)
+    assert summary["imported"] == 300 and not summary["errors"]
+    # Read a buffer at a time, never the whole upload at once
+    assert len(reads) > 5 and max(reads) < len(export)
+    page = server.list_memories(limit=1000, category="Streamed")
+    assert len(page["memories"]) == 300
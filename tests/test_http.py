@@ -0,0 +1,39 @@
+import json
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+
+@pytest.fixture(params=["threaded", "asyncio"])
+def base_url(request, serve):
+    return serve(request.param)
+
+
+def put_blob(base_url, data, content_type):
+    req = Request(base_url + "/api/blobs", data=data, method="PUT", headers={"Content-Type": content_type})
+    with urlopen(req) as response:
+        return json.load(response)["hash"]
+
+
+def test_blob_served_with_upload_type(base_url):
+    digest = put_blob(base_url, b"\x89PNG\r\n\x1a\nnot really a png", "image/png")
+    with urlopen(f"{base_url}/api/blobs/{digest}?type=text/html") as response:
+        assert response.headers["Content-Type"] == "image/png"
+        assert response.headers["X-Content-Type-Options"] == "nosniff"
+        assert response.headers["Content-Disposition"] is None
+
+
+@pytest.mark.parametrize("content_type", ["text/html", "image/svg+xml", "application/octet-stream"])
+def test_active_blob_types_are_downloaded(base_url, content_type):
+    digest = put_blob(base_url, b"<script>alert(document.domain)</script>" + content_type.encode(), content_type)
+    with urlopen(f"{base_url}/api/blobs/{digest}?type=text/html") as response:
+        assert response.headers["Content-Type"] == "application/octet-stream"
+        assert response.headers["Content-Disposition"].startswith("attachment")
+        assert response.headers["X-Content-Type-Options"] == "nosniff"
+
+
+def test_unknown_blob(base_url):
+    with pytest.raises(HTTPError) as error:
+        urlopen(f"{base_url}/api/blobs/{'0' * 64}")
+    assert error.value.code == 404
@@ -0,0 +1,91 @@
+import json
+
+import numpy as np
+
+
+def test_bulk_add_dedups_within_request(server, monkeypatch):
+    rng = np.random.default_rng(0)
+    base = rng.standard_normal((150, 32)).astype(np.float32)
+    vectors = {f"fact number {i:03d}": base[i] for i in range(150)}
+    # Every tenth item paraphrases an earlier one
+    vectors.update({f"paraphrase of {i:03d}": base[i] + 0.01 for i in range(0, 150, 10)})
+    monkeypatch.setattr(server, "get_embeddings", lambda texts, model: [vectors[t].tolist() for t in texts])
+    items = [{"content": text} for text in vectors] + [{"content": "fact number 000"}, {"content": "short"}]
+
+    summary = server.bulk_add_memories(items, batch_size=16)
+    statuses = [r["status"] for r in summary["results"]]
+    assert summary["added"] == 150
+    assert statuses[:150] == ["added"] * 150
+    assert statuses[150:165] == ["duplicate"] * 15
+    assert statuses[-2:] == ["duplicate", "invalid"]
+    assert server.MEMORY_INDEX.size() == 150
+
+
+def test_hybrid_score_follows_fused_rank(server):
+    for text in ["nginx returned 502 on host web-01", "the database host db-02 ran out of disk",
+                 "web-01 was rebooted after the kernel update", "lunch order for the team meeting"]:
+        assert server.add_memory(text)
+    results = server.search_memory("web-01 502", limit=4, threshold=-1.0, mode="hybrid")
+    scores = [r["score"] for r in results]
+    assert len(results) == 4
+    assert scores == sorted(scores, reverse=True)
+    assert 0 < scores[-1] < scores[0] <= 1.0
+    # Every memory is in the vector list; only the two mentioning web-01 are lexical matches
+    assert sum("lexical_score" in r for r in results) == 2
+    assert all("vector_score" in r for r in results)
+
+
+def test_filtered_ids_cached_until_write(server):
+    for i in range(6):
+        assert server.add_memory(f"{'work' if i % 2 else 'home'} note number {i}", category="Work" if i % 2 else "Home")
+    calls = []
+    server.get_db_connection().set_trace_callback(calls.append)
+    where = server.memory_filters(category="Work")
+    first = server.filtered_memory_ids(*where)
+    second = server.filtered_memory_ids(*where)
+    assert second is first and len(first) == 3
+    assert sum("SELECT id FROM memories" in sql for sql in calls) == 1
+    assert server.add_memory("work note added later on", category="Work")
+    assert len(server.filtered_memory_ids(*where)) == 4
+    server.get_db_connection().set_trace_callback(None)
+
+    results = server.search_memory("work note", limit=10, threshold=-1.0, category="Work")
+    assert len(results) == 4 and all(r["content"].startswith("work") for r in results)
+
+
+def test_import_normalizes_dates_for_paging(server):
+    lines = [json.dumps({"type": "header", "format": server.EXPORT_FORMAT, "version": 1, "encoding": "float32"})]
+    lines += [json.dumps({"type": "memory", "content": f"imported memory number {i}", "created_at": created_at})
+              for i, created_at in enumerate(["2024-03-01", "2024-03-01 09:30:00", "2024-03-01T18:00", "2024-02-28 23:59:59"])]
+    summary = server.import_memories(lines)
+    assert summary["imported"] == 4, summary
+    stored = [row["created_at"] for row in server.get_db_connection().execute("SELECT created_at FROM memories ORDER BY id")]
+    assert stored == ["2024-03-01 00:00:00", "2024-03-01 09:30:00", "2024-03-01 18:00:00", "2024-02-28 23:59:59"]
+
+    seen, cursor = [], None
+    while True:
+        page = server.list_memories(limit=1, cursor=cursor, since="2024-03-01")
+        seen += [m["created_at"] for m in page["memories"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert seen == ["2024-03-01 18:00:00", "2024-03-01 09:30:00", "2024-03-01 00:00:00"]
+
+
+def test_bulk_add_ids_match_rows_and_sync_once(server, monkeypatch):
+    server.MEMORY_INDEX.ensure_loaded()
+    # A gap in the id sequence: the rows a bulk insert gets are not simply the newest ones
+    conn = server.get_db_connection()
+    with conn:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) SELECT 'memories', 0 WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'memories')")
+        conn.execute("UPDATE sqlite_sequence SET seq = 1000 WHERE name = 'memories'")
+    syncs = []
+    sync_files = server.MEMORY_INDEX._sync_files
+    monkeypatch.setattr(server.MEMORY_INDEX, "_sync_files", lambda: syncs.append(1) or sync_files())
+
+    summary = server.bulk_add_memories([{"content": f"bulk inserted fact number {i}"} for i in range(50)])
+    assert summary["added"] == 50 and len(syncs) == 1
+    stored = dict(conn.execute("SELECT id, content FROM memories").fetchall())
+    for i, result in enumerate(summary["results"]):
+        assert result["id"] > 1000 and stored[result["id"]] == f"bulk inserted fact number {i}"
+    assert server.search_memory("bulk inserted fact number 17", limit=1)[0]["id"] == summary["results"][17]["id"]
@@ -0,0 +1,52 @@
+import threading
+
+import numpy as np
+
+
+def test_search_spans_blocks(server):
+    # A legacy row (embed_model NULL) and model-tagged rows of the same dimension live in separate blocks
+    index = server.MemoryIndex(vector_file="")
+    index.loaded = True
+    index.upsert(1, [1.0, 0.0, 0.0], model=None)
+    index.upsert(2, [-0.25, 0.97, 0.0], model="embed")
+    index.upsert(3, [0.99, 0.01, 0.0], model="embed")
+    hits = index.search([1.0, 0.0, 0.0], limit=3, threshold=-1.0, model="embed")
+    assert [memory_id for memory_id, _ in hits] == [1, 3, 2]
+    assert np.isclose(hits[0][1], 1.0)
+
+
+def test_search_with_ids_spans_blocks(server):
+    index = server.MemoryIndex(vector_file="")
+    index.loaded = True
+    index.upsert(1, [1.0, 0.0], model=None)
+    index.upsert(2, [0.9, 0.1], model="embed")
+    index.upsert(3, [0.8, 0.2], model="embed")
+    hits = index.search([1.0, 0.0], limit=5, threshold=-1.0, model="embed", ids=[1, 3])
+    assert [memory_id for memory_id, _ in hits] == [1, 3]
+
+
+def test_search_scores_outside_lock(server, monkeypatch):
+    index = server.MemoryIndex(vector_file="")
+    index.loaded = True
+    index.upsert(1, [1.0, 0.0], model="embed")
+    index.upsert(2, [0.0, 1.0], model="embed")
+    held = []
+    score = server.VectorBlock.score
+
+    def spy(block, rows, query):
+        # A writer must be able to take the lock while a search is scoring
+        def probe():
+            acquired = index.lock.acquire(blocking=False)
+            held.append(not acquired)
+            if acquired:
+                index.lock.release()
+
+        writer = threading.Thread(target=probe)
+        writer.start()
+        writer.join()
+        return score(block, rows, query)
+
+    monkeypatch.setattr(server.VectorBlock, "score", spy)
+    hits = index.search([1.0, 0.0], limit=1, threshold=-1.0, model="embed")
+    assert [memory_id for memory_id, _ in hits] == [1]
+    assert held and not any(held)
@@ -0,0 +1,70 @@
+import json
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+
+@pytest.fixture
+def queue_server(make_server):
+    """Threaded server whose extraction queue does not wait for idle chats; yields (module, base URL)."""
+    started = []
+
+    def start(**env):
+        server = make_server(MEMORY_QUEUE_IDLE_SECONDS=0, **env)
+        server.OllamaHandler.log_message = lambda *args: None
+        httpd = server.make_server("threaded", host="127.0.0.1", port=0)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        started.append(httpd)
+        return server, f"http://127.0.0.1:{httpd.server_address[1]}"
+    yield start
+    for httpd in started:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def extract(base_url, user, assistant="Noted."):
+    body = json.dumps({"model": "llama3.1:8b", "user": user, "assistant": assistant}).encode("utf-8")
+    req = Request(base_url + "/api/rag/extract", data=body, method="POST", headers={"Content-Type": "application/json"})
+    with urlopen(req) as response:
+        return response.status, json.load(response)
+
+
+def wait_processed(server, count, timeout=10):
+    deadline = time.monotonic() + timeout
+    while server.MEMORY_QUEUE.snapshot()["processed"] < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+def test_extracted_memories_are_stored(queue_server):
+    server, base_url = queue_server()
+    status, job = extract(base_url, "I deploy the studio with docker compose")
+    assert status == 202 and job["job_id"]
+    extract(base_url, "hi")
+    extract(base_url, "I deploy the studio with docker compose")
+    wait_processed(server, 3)
+    snapshot = server.MEMORY_QUEUE.snapshot()
+    assert (snapshot["added"], snapshot["duplicates"], snapshot["nothing_to_remember"]) == (1, 1, 1)
+    assert snapshot["depth"] == 0
+    contents = [memory["content"] for memory in server.list_memories()["memories"]]
+    assert contents == ["The user said: I deploy the studio with docker compose"]
+
+
+def test_full_queue_pushes_back(queue_server):
+    server, base_url = queue_server(MEMORY_QUEUE_SIZE=1)
+    # A running chat keeps the worker from taking jobs
+    server.CHAT_ACTIVITY.begin()
+    try:
+        assert extract(base_url, "my editor of choice is neovim")[0] == 202
+        with pytest.raises(HTTPError) as error:
+            extract(base_url, "my shell of choice is fish")
+        assert error.value.code == 429
+        assert error.value.headers["Retry-After"]
+        assert server.MEMORY_QUEUE.snapshot()["rejected"] == 1
+    finally:
+        server.CHAT_ACTIVITY.end()
+    wait_processed(server, 1)
+    assert server.MEMORY_QUEUE.snapshot()["added"] == 1
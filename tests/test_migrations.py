@@ -0,0 +1,58 @@
+import json
+import sqlite3
+
+import numpy as np
+
+from conftest import EMBED_DIM
+
+
+def create_baseline_db(path, fake_ollama, contents):
+    # The schema server.py created before any migration existed
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE memories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            content TEXT NOT NULL,
+            category TEXT DEFAULT 'General',
+            embedding BLOB NOT NULL,
+            created_at TEXT DEFAULT (datetime('now', 'localtime'))
+        )
+    ''')
+    conn.executemany("INSERT INTO memories (content, embedding) VALUES (?, ?)",
+                     [(content, np.asarray(fake_ollama.embed(content), dtype=np.float32).tobytes()) for content in contents])
+    conn.commit()
+    conn.close()
+
+
+def test_migrates_baseline_schema(tmp_path, fake_ollama, make_server):
+    contents = ["the staging database runs on host db-stage-01", "deploys are frozen on fridays", "the VPN config lives in ops/vpn.conf"]
+    create_baseline_db(tmp_path / "memory.db", fake_ollama, contents)
+    server = make_server()
+
+    conn = server.get_db_connection()
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(server.SCHEMA_MIGRATIONS)
+    assert {"embed_model", "embed_dim", "embed_encoding", "doc_id", "chunk_hash"} <= server._table_columns(conn, "memories")
+    assert server.list_memories()["memories"][-1]["content"] == contents[0]
+    # Legacy vectors have no embed model and still match queries from the current one
+    assert server.search_memory(contents[2], limit=1, mode="vector")[0]["content"] == contents[2]
+    assert server.search_memory("db-stage-01", limit=1, mode="lexical")[0]["content"] == contents[0]
+    # Running the migrations again is a no-op
+    server.init_db()
+    assert conn.execute("SELECT COUNT(*) FROM memories").fetchone()[0] == 3
+
+
+def test_fts_index_created_once_fts5_is_available(make_server):
+    server = make_server()
+    server.add_memory("the release checklist lives in docs/release.md", "General")
+    # What a database migrated on a SQLite build without FTS5 looks like
+    conn = server.get_db_connection()
+    for trigger in ("memories_fts_insert", "memories_fts_delete", "memories_fts_update"):
+        conn.execute(f"DROP TRIGGER {trigger}")
+    conn.execute("DROP TABLE memories_fts")
+    conn.commit()
+
+    server = make_server()
+    assert server.FTS_ENABLED
+    assert server.search_memory("release.md", limit=1, mode="lexical")[0]["content"].startswith("the release checklist")
+    server.add_memory("incident reviews happen on thursdays", "General")
+    assert server.search_memory("thursdays", limit=1, mode="lexical")[0]["content"] == "incident reviews happen on thursdays"
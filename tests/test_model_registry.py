@@ -0,0 +1,40 @@
+import pytest
+
+from conftest import EMBED_DIM
+from fake_ollama import FakeOllama
+
+
+@pytest.fixture
+def ollama():
+    # Its own fake so the per-path request counts belong to this test
+    fake = FakeOllama(dim=EMBED_DIM, models=4, token_interval=0.0)
+    fake.base_url = fake.start()
+    yield fake
+    fake.stop()
+
+
+def test_details_are_fetched_once_per_model(make_server, ollama):
+    server = make_server(OLLAMA_BASE_URL=ollama.base_url)
+    described = {model["name"]: model for model in server.describe_models()}
+    assert list(described) == ollama.models
+    assert described["nomic-embed-text:latest"]["embedding"] and not described["llama3.1:8b"]["embedding"]
+    assert described["llama3.1:8b"]["tools"] and described["llama3.1:8b"]["context_length"] == 8192
+    server.describe_models()
+    assert server.find_best_embed_model() == "nomic-embed-text:latest"
+    assert ollama.requests["/api/show"] == len(ollama.models)
+    assert ollama.requests["/api/tags"] == 1
+
+
+def test_removed_model_details_are_forgotten(make_server, ollama):
+    server = make_server(OLLAMA_BASE_URL=ollama.base_url)
+    server.describe_models()
+    removed = ollama.models.pop()
+    server.MODEL_REGISTRY.list_tags(force=True)
+    assert removed not in server.MODEL_REGISTRY.details
+    assert [model["name"] for model in server.describe_models()] == ollama.models
+    # Pulled again: its details are fetched anew
+    ollama.models.append(removed)
+    server.MODEL_REGISTRY.list_tags(force=True)
+    shows = ollama.requests["/api/show"]
+    server.describe_models()
+    assert ollama.requests["/api/show"] == shows + 1
@@ -0,0 +1,70 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+def get(pool, path):
+    conn, response = pool.request("GET", path)
+    data = response.read()
+    pool.release(conn, reusable=not response.will_close)
+    return response.status, data
+
+
+def test_connections_are_reused(server, fake_ollama):
+    pool = server.OllamaConnectionPool(fake_ollama.base_url, 2, 5, 30)
+    for _ in range(3):
+        status, data = get(pool, "/api/tags")
+        assert status == 200 and json.loads(data)["models"]
+    stats = pool.snapshot()
+    assert (stats["requests"], stats["reused"], stats["connections_opened"], stats["idle"]) == (3, 2, 1, 1)
+    assert stats["in_use"] == 0
+
+
+def test_idle_connections_are_capped(server, fake_ollama):
+    pool = server.OllamaConnectionPool(fake_ollama.base_url, 2, 5, 30)
+    held = [pool.request("GET", "/api/tags") for _ in range(3)]
+    assert pool.snapshot()["in_use"] == 3
+    for conn, response in held:
+        response.read()
+        pool.release(conn)
+    stats = pool.snapshot()
+    assert (stats["connections_opened"], stats["idle"], stats["in_use"]) == (3, 2, 0)
+
+
+def test_connection_closed_by_server_is_retried(server):
+    class ClosingHandler(BaseHTTPRequestHandler):
+        # Keep-alive response, but the server hangs up right after it like an idle timeout would
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"ok")
+            self.close_connection = True
+
+    upstream = HTTPServer(("127.0.0.1", 0), ClosingHandler)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    try:
+        pool = server.OllamaConnectionPool(f"http://127.0.0.1:{upstream.server_address[1]}", 2, 5, 30)
+        assert get(pool, "/") == (200, b"ok")
+        assert get(pool, "/") == (200, b"ok")
+        stats = pool.snapshot()
+        assert stats["stale_retries"] == 1
+        assert stats["connections_opened"] == 2
+    finally:
+        upstream.shutdown()
+        upstream.server_close()
+
+
+def test_ollama_calls_share_the_pool(server):
+    before = server.OLLAMA_POOL.snapshot()
+    for _ in range(3):
+        status, _, _ = server.fetch_ollama("/api/tags")
+        assert status == 200
+    after = server.OLLAMA_POOL.snapshot()
+    assert after["requests"] - before["requests"] == 3
+    assert after["reused"] - before["reused"] >= 2
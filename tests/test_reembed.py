@@ -0,0 +1,73 @@
+import time
+
+import numpy as np
+import pytest
+
+from conftest import EMBED_DIM
+
+
+def store_old_vectors(server, contents, dim=8):
+    rng = np.random.default_rng(0)
+    conn = server.get_db_connection()
+    with conn:
+        conn.executemany("INSERT INTO memories (content, category, embedding, embed_model, embed_dim) VALUES (?, 'General', ?, 'old-embed', ?)",
+                         [(content, rng.standard_normal(dim).astype(np.float32).tobytes(), dim) for content in contents])
+
+
+def wait_for_swap(server, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.REEMBED.snapshot()["jobs_finished"]:
+            return
+        time.sleep(0.05)
+    pytest.fail(f"re-embedding did not finish: {server.REEMBED.snapshot()}")
+
+
+def test_reembed_swaps_in_new_model(server):
+    contents = [f"stored fact number {i}" for i in range(40)]
+    store_old_vectors(server, contents)
+    model = server.get_embed_model()
+    wait_for_swap(server)
+
+    rows = server.get_db_connection().execute("SELECT DISTINCT embed_model, embed_dim FROM memories").fetchall()
+    assert [tuple(row) for row in rows] == [(model, EMBED_DIM)]
+    assert server.MEMORY_INDEX.key_counts() == {(model, EMBED_DIM): 40}
+    hits = server.search_memory(contents[7], limit=1)
+    assert hits and hits[0]["content"] == contents[7]
+    assert server.REEMBED.snapshot()["status"] == "idle"
+
+
+def test_reembed_gives_up_on_failing_rows(server, monkeypatch):
+    store_old_vectors(server, ["stored fact that embeds fine", "poisoned fact that never embeds", "another fact that embeds fine"])
+    fetch_embeddings, fetch_embedding = server.fetch_embeddings, server.fetch_embedding
+    monkeypatch.setattr(server, "fetch_embeddings", lambda texts, model: [None if "poisoned" in t else v for t, v in zip(texts, fetch_embeddings(texts, model))])
+    monkeypatch.setattr(server, "fetch_embedding", lambda text, model: None if "poisoned" in text else fetch_embedding(text, model))
+    monkeypatch.setattr(server.REEMBED, "MAX_ATTEMPTS", 2)
+    server.get_embed_model()
+    wait_for_swap(server)
+
+    stats = server.REEMBED.snapshot()
+    assert stats["given_up"] == 1 and stats["failed"] == 2
+    rows = {row["content"]: tuple(row) for row in server.get_db_connection().execute("SELECT content, embed_model, embed_dim, LENGTH(embedding) FROM memories")}
+    # The memory given up on keeps its old vector; the others moved to the new model
+    assert rows.pop("poisoned fact that never embeds")[1:] == ("old-embed", 8, 32)
+    assert all(row[2] == EMBED_DIM for row in rows.values())
+    assert server.MEMORY_INDEX.key_counts() == {(server.get_embed_model(), EMBED_DIM): 2, ("old-embed", 8): 1}
+    # The next model check finds nothing stale, so no new job starts
+    server.EMBED_MODEL_CHECKED_AT = 0
+    server.get_embed_model()
+    assert server.REEMBED.snapshot()["status"] == "idle"
+    # Its old vector still exports and imports
+    lines = b"".join(server.export_memories("float32")).splitlines()
+    assert server.import_memories(lines, skip_existing=False)["imported"] == 3
+
+
+def test_wait_idle_wakes_when_chats_end(server):
+    activity = server.ActivityTracker()
+    activity.begin()
+    assert activity.wait_idle(0.05) is False
+    started = time.perf_counter()
+    timer = __import__("threading").Timer(0.1, activity.end)
+    timer.start()
+    assert activity.wait_idle(5) is True
+    assert time.perf_counter() - started < 1
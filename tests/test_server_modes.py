@@ -0,0 +1,105 @@
+import http.client
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.request import Request, urlopen
+
+
+def stream_chat(base_url, **options):
+    body = {"model": "llama3.1:8b", "stream": True, "messages": [{"role": "user", "content": "hello there"}], **options}
+    req = Request(base_url + "/api/chat", data=json.dumps(body).encode("utf-8"), method="POST",
+                  headers={"Content-Type": "application/json"})
+    with urlopen(req) as response:
+        return response.headers, [json.loads(line) for line in response if line.strip()]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_asyncio_chat_reuses_pooled_upstream(server, serve):
+    base_url = serve("asyncio")
+    _, lines = stream_chat(base_url)
+    assert "".join(line["message"]["content"] for line in lines) == "tok0 tok1 tok2 tok3 "
+    assert lines[-1]["done"]
+    # The upstream stream is handed back to the pool once the response is read to the end
+    wait_for(lambda: len(server.OLLAMA_POOL.idle_streams) == 1)
+    reused = server.OLLAMA_POOL.snapshot()["reused"]
+    stream_chat(base_url)
+    wait_for(lambda: len(server.OLLAMA_POOL.idle_streams) == 1)
+    assert server.OLLAMA_POOL.snapshot()["reused"] == reused + 1
+
+
+def test_asyncio_chat_fallback_is_logged(server, serve, capsys, monkeypatch):
+    base_url = serve("asyncio")
+    prepare = server.prepare_chat_request
+    calls = []
+
+    def failing_once(body, body_json):
+        calls.append(body)
+        if len(calls) == 1:
+            raise RuntimeError("blob store unavailable")
+        return prepare(body, body_json)
+
+    monkeypatch.setattr(server, "prepare_chat_request", failing_once)
+    _, lines = stream_chat(base_url)
+    assert lines[-1]["done"]
+    assert len(calls) == 2
+    assert "falling back to a worker thread: blob store unavailable" in capsys.readouterr().out
+    assert server.METRICS.values[("ollama_studio_chat_relay_fallbacks_total", ())] == 1
+
+
+def start_busy_server(server, queue_timeout):
+    """A one-worker PooledHTTPServer whose only worker is stuck in a request until the returned event is set."""
+    release = threading.Event()
+
+    class SlowHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            release.wait(10)
+            self.send_response(204)
+            self.end_headers()
+
+    httpd = server.PooledHTTPServer(("127.0.0.1", 0), SlowHandler, 1, queue_timeout=queue_timeout)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    busy = http.client.HTTPConnection("127.0.0.1", httpd.server_address[1], timeout=10)
+    busy.request("GET", "/")
+    wait_for(lambda: httpd.slots._value == 0)
+    return httpd, busy, release
+
+
+def test_busy_workers_do_not_block_shutdown(server):
+    httpd, busy, release = start_busy_server(server, queue_timeout=60)
+    waiting = socket.create_connection(("127.0.0.1", httpd.server_address[1]), timeout=10)
+    waiting.sendall(b"GET / HTTP/1.1\r\nHost: test\r\n\r\n")
+    time.sleep(0.2)
+    started = time.monotonic()
+    httpd.shutdown()
+    assert time.monotonic() - started < 3
+    assert waiting.recv(4096).startswith(b"HTTP/1.1 503")
+    release.set()
+    assert busy.getresponse().status == 204
+    httpd.server_close()
+
+
+def test_queue_timeout_rejects_with_503(server):
+    httpd, busy, release = start_busy_server(server, queue_timeout=0.2)
+    try:
+        rejected = http.client.HTTPConnection("127.0.0.1", httpd.server_address[1], timeout=10)
+        rejected.request("GET", "/")
+        response = rejected.getresponse()
+        assert response.status == 503
+        assert response.headers["Retry-After"] == "1"
+        release.set()
+        assert busy.getresponse().status == 204
+    finally:
+        release.set()
+        httpd.shutdown()
+        httpd.server_close()
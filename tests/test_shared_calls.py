@@ -0,0 +1,75 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+
+import pytest
+
+from conftest import EMBED_DIM
+from fake_ollama import FakeOllama
+
+
+@pytest.fixture
+def ollama():
+    # Slow enough that concurrent callers overlap; its own request counts
+    fake = FakeOllama(dim=EMBED_DIM, models=2, latency=0.3, token_interval=0.0)
+    fake.base_url = fake.start()
+    yield fake
+    fake.stop()
+
+
+def chat(base_url, **options):
+    body = {"model": "llama3.1:8b", "stream": False, "messages": [{"role": "user", "content": "what is 2 + 2?"}], "options": options}
+    req = Request(base_url + "/api/chat", data=json.dumps(body).encode("utf-8"), method="POST",
+                  headers={"Content-Type": "application/json"})
+    with urlopen(req) as response:
+        return response.headers["X-Cache"], json.load(response)["message"]["content"]
+
+
+def test_identical_deterministic_chats_share_one_call(make_server, ollama):
+    server = make_server(OLLAMA_BASE_URL=ollama.base_url)
+    server.OllamaHandler.log_message = lambda *args: None
+    httpd = server.make_server("threaded", host="127.0.0.1", port=0)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    try:
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda _: chat(base_url, seed=1, temperature=0), range(4)))
+        assert len({content for _, content in results}) == 1
+        assert sorted(source for source, _ in results) == ["miss", "shared", "shared", "shared"]
+        assert ollama.requests["/api/chat"] == 1
+        # Later identical requests come from the cache; sampled ones always go upstream
+        assert chat(base_url, seed=1, temperature=0)[0] == "hit"
+        assert chat(base_url, temperature=0.7)[0] is None
+        assert ollama.requests["/api/chat"] == 2
+        counters = server.SHARED_CALLS.snapshot()["kinds"]["chat"]
+        assert (counters["calls"], counters["shared"], counters["hits"]) == (1, 3, 1)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_errors_are_shared_but_not_cached(server):
+    calls = []
+    release = threading.Event()
+
+    def failing():
+        calls.append(1)
+        release.wait(5)
+        raise RuntimeError("backend down")
+
+    def call():
+        try:
+            server.SHARED_CALLS.call(("test", 1), failing, ttl=60)
+        except RuntimeError as e:
+            return str(e)
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(call) for _ in range(3)]
+        while server.SHARED_CALLS.snapshot()["kinds"].get("test", {}).get("shared", 0) < 2:
+            time.sleep(0.01)
+        release.set()
+        assert [future.result() for future in futures] == ["backend down"] * 3
+    assert len(calls) == 1
+    assert server.SHARED_CALLS.call(("test", 1), lambda: "ok", ttl=60) == ("ok", "miss")
@@ -0,0 +1,74 @@
+import gzip
+import http.client
+import os
+import time
+from urllib.parse import urlparse
+
+import pytest
+
+from conftest import ROOT
+
+
+@pytest.fixture(params=["threaded", "asyncio"])
+def connect(request, serve):
+    port = urlparse(serve(request.param)).port
+    return lambda: http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+
+
+def get(connect, path, **headers):
+    conn = connect()
+    conn.request("GET", path, headers=headers)
+    response = conn.getresponse()
+    return response, response.read()
+
+
+def test_compressed_asset_and_revalidation(connect, server):
+    with open(os.path.join(ROOT, "app.js"), "rb") as file:
+        source = file.read()
+    response, body = get(connect, "/app.js", **{"Accept-Encoding": "gzip"})
+    assert response.status == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Content-Type"] == "application/javascript; charset=utf-8"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert gzip.decompress(body) == source and len(body) < len(source)
+    etag = response.headers["ETag"]
+
+    response, body = get(connect, "/app.js", **{"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status == 304 and body == b""
+    assert response.headers["ETag"] == etag
+
+    # Clients that do not accept gzip get the file itself under its own ETag
+    response, body = get(connect, "/app.js", **{"Accept-Encoding": "gzip;q=0"})
+    assert response.status == 200 and body == source
+    assert response.headers["Content-Encoding"] is None
+    assert response.headers["ETag"] != etag
+    # Responses are counted after they are sent
+    deadline = time.monotonic() + 5
+    while server.STATIC_ASSETS.snapshot()["responses"] < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    stats = server.STATIC_ASSETS.snapshot()
+    assert (stats["loads"], stats["responses"], stats["not_modified"]) == (1, 3, 1)
+
+
+def test_changed_file_is_reloaded(server, tmp_path):
+    page = tmp_path / "index.html"
+    page.write_text("<p>first</p>" * 50)
+    assets = server.StaticAssets(str(tmp_path), ["index.html"])
+    first = assets.get("index.html")
+    assert assets.get("index.html") is first
+    page.write_text("<p>second</p>" * 50)
+    second = assets.get("index.html")
+    assert second["bodies"]["identity"] == page.read_bytes()
+    assert second["etags"]["gzip"] != first["etags"]["gzip"]
+    assert assets.snapshot()["loads"] == 2
+    assert assets.get("missing.html") is None
+
+
+def test_negotiation(server):
+    bodies = {"identity": b"x", "gzip": b"g", "br": b"b"}
+    negotiate = server.StaticAssets.negotiate
+    assert negotiate("gzip, deflate, br", bodies) == "br"
+    assert negotiate("br;q=0, gzip", bodies) == "gzip"
+    assert negotiate("*", {"identity": b"x", "gzip": b"g"}) == "gzip"
+    assert negotiate("", bodies) == "identity"
+    assert server.StaticAssets.matches('W/"abc", "def"', {"identity": '"def"'})
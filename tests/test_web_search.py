@@ -0,0 +1,57 @@
+def make_search(server, behaviour, **options):
+    """A WebSearch over stub backends; behaviour maps backend -> "ok", "empty" or "fail", and can change later."""
+    calls = []
+
+    class StubDDGS:
+        def text(self, query, max_results=5, backend="api"):
+            calls.append(backend)
+            if behaviour[backend] == "fail":
+                raise RuntimeError(f"{backend} blocked")
+            if behaviour[backend] == "empty":
+                return []
+            return [{"title": f"{backend}: {query}", "href": f"https://example.com/{backend}", "body": "result"}]
+
+    search = server.WebSearch(["api", "html"], client_factory=StubDDGS, **options)
+    return search, calls
+
+
+def test_results_are_cached_by_normalized_query(server):
+    search, calls = make_search(server, {"api": "ok", "html": "ok"})
+    first = search.search("Ollama  Studio")
+    assert search.search("ollama studio") == {"results": first["results"], "cached": True}
+    assert calls == ["api"]
+    assert search.snapshot()["hit_rate"] == 0.5
+
+
+def test_breaker_probe_is_not_lost_when_an_earlier_backend_answers(server, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(server.time, "time", lambda: now[0])
+    behaviour = {"api": "empty", "html": "fail"}
+    search, calls = make_search(server, behaviour, ttl=0, failures=2, cooldown=60)
+    for _ in range(2):
+        search.search("open the html breaker")
+    assert search.snapshot()["backends"]["html"]["open"]
+    search.search("breaker open")
+    assert calls[-1] == "api"
+
+    # Cooldown over; api answers first, so html is never queried and must not be left probing
+    now[0] += 61
+    behaviour.update(api="ok", html="ok")
+    calls.clear()
+    assert "results" in search.search("api answers")
+    assert calls == ["api"]
+    assert search.snapshot()["backends"]["html"]["probing"] is False
+
+    # html is still tried (as the probe) once api stops answering, and closes its breaker
+    behaviour["api"] = "empty"
+    calls.clear()
+    assert search.search("html recovers")["results"][0]["title"].startswith("html")
+    assert calls == ["api", "html"]
+    assert search.snapshot()["backends"]["html"]["failures"] == 0
+
+
+def test_all_breakers_open(server):
+    search, calls = make_search(server, {"api": "fail", "html": "fail"}, ttl=0, failures=1, cooldown=60)
+    assert "Last error" in search.search("first")["error"]
+    assert search.search("second")["error"].startswith("All search backends are failing")
+    assert calls == ["api", "html"]